@@ -5,7 +5,8 @@
 
 
 import numpy as np
-from matplotlib import pyplot as plt
+
+import instrumentation as inst
 
 
 # In[37]:
@@ -54,9 +55,49 @@ def Murnaghan(rho, rho0, B0, B1):
     Pressure (float) corresponding to the given density (Pa)."""
     return (B0/B1)*((rho0/rho)**(-1*B1)-1)
 
-def DensityFromP(P, rho0, B0, B1, form, thresh=0.01):
+def BM3Slope(rho, rho0, B0, B1):
+    """Derivative of the BM3 pressure with respect to density, dP/drho (Pa m^3/kg). Arguments as in BM3."""
+    x = (rho/rho0)**(1/3)
+    c = 0.75*(B1-4)
+    dP_dx = 1.5*B0*((7*x**6-5*x**4)*(1+c*(x**2-1)) + (x**7-x**5)*2*c*x)
+    return dP_dx*x/(3*rho)
+
+def VinetSlope(rho, rho0, B0, B1):
+    """Derivative of the Vinet pressure with respect to density, dP/drho (Pa m^3/kg). Arguments as in Vinet."""
+    eta = (rho0/rho)**(1/3)
+    a = 1.5*(B1-1)
+    dP_deta = 3*B0*np.exp(a*(1-eta))*((eta-2)/eta**3 - a*(1-eta)/eta**2)
+    return -dP_deta*eta/(3*rho)
+
+def MurnaghanSlope(rho, rho0, B0, B1):
+    """Derivative of the Murnaghan pressure with respect to density, dP/drho (Pa m^3/kg). Arguments as in Murnaghan."""
+    return (B0/rho)*(rho/rho0)**B1
+
+def MurnaghanDensity(P, rho0, B0, B1):
+    """Exact inverse of the Murnaghan equation of state.
+
+    Parameters:
+    P (float): Pressure (Pa), above -B0/B1.
+    rho0 (float): Initial (zero-pressure) density (kg/m^3).
+    B0 (float): Bulk modulus at zero pressure (Pa).
+    B1 (float): Pressure derivative of the bulk modulus.
+
+    Returns:
+    Density (float) at pressure P (kg/m^3)."""
+    return rho0*(1+B1*P/B0)**(1/B1)
+
+def DensityFromP(P, rho0, B0, B1, form, thresh=0.01, policy=None):
     """Calculate density from pressure using a specified equation of state.
 
+    The Murnaghan equation is inverted exactly. BM3 and Vinet start from the Murnaghan inverse with the same
+    rho0, B0 and B1, which shares their behaviour to first order in P, and take safeguarded Newton steps:
+    a step that would leave the bracket known to contain the root is replaced by bisection (or, while no
+    upper bound is known, by doubling). Two or three steps usually suffice.
+
+    With a tolerance.TolerancePolicy, the absolute thresh is replaced by the policy's relative density
+    tolerance and the steps are capped; a capped inversion returns its best estimate and is counted in
+    policy.exceeded.
+
     Parameters:
     P (float): Pressure (Pa).
     rho0 (float): Initial (zero-pressure) density (kg/m^3).
@@ -64,99 +105,126 @@ def DensityFromP(P, rho0, B0, B1, form, thresh=0.01):
     B1 (float): Pressure derivative of the bulk modulus.
     form (str): Name of the equation of state ('bm3', 'vinet', or 'murnaghan').
     thresh (float, optional): Convergence threshold for pressure (Pa). Default is 0.01 Pa.
+    policy (TolerancePolicy, optional): Relative tolerance and step cap replacing thresh. Default is None.
 
     Returns:
     Estimated density (float) at pressure P (kg/m^3)."""
     # check form is supported and assign EoS variable to call that function
-    supported_EoSs = {'bm3':BM3, 'vinet':Vinet, 'murnaghan':Murnaghan}
+    supported_EoSs = {'bm3':(BM3, BM3Slope), 'vinet':(Vinet, VinetSlope), 'murnaghan':(Murnaghan, MurnaghanSlope)}
     assert form.lower() in supported_EoSs.keys()
-    EoS = supported_EoSs[form.lower()]
-    
-    # find rough bounds for density
-    rho_upper = 2*rho0  #initialize for loop
-    rho_lower = 0.9*rho0  # below rho0 to avoid weirdness at 0 pressure
-    while True:
-        P_upper = EoS(rho_upper, rho0, B0, B1)
-        P_lower = EoS(rho_lower, rho0, B0, B1)
-        if P<P_upper and P>P_lower:  # bounds are good
-            break
-        if P>P_upper:  #highest density too low
-            rho_lower = rho_upper
-            rho_upper += rho0
-        if P<P_lower:  # lowest density to too high
-            P_upper = P_lower
-            P_lower /= 10
-    
-    # iterate until P_guess within thresh of P when calculated using rho_guess
-    rho_guess = (rho_upper+rho_lower)/2
+    EoS, Slope = supported_EoSs[form.lower()]
+
+    rho_guess = MurnaghanDensity(P, rho0, B0, B1)
+    if form.lower() == 'murnaghan':
+        if inst.active is not None:
+            inst.active.add('density_from_p_calls')
+        return rho_guess
+    if not np.isfinite(rho_guess):  # P below -B0/B1, outside the Murnaghan range
+        rho_guess = 0.9*rho0
+
+    # the root lies above rho0 for positive pressures and below it for negative ones
+    rho_lower, rho_upper = (rho0, np.inf) if P >= 0 else (0.0, rho0)
+    bracket_steps = 0
+    bisection_steps = 0
+    newton_steps = 0
     while True:
         P_guess = EoS(rho_guess, rho0, B0, B1)
+        slope = Slope(rho_guess, rho0, B0, B1)
+        if policy is not None:  # relative tolerance derived from the outer convergence target
+            thresh = policy.pressure_tolerance(rho_guess, slope)
         if np.abs(P-P_guess) < thresh:  # rho_guess is good
             break
-        if P_guess > P: # rho_guess is too high
+        if P_guess > P:  # rho_guess is too high
             rho_upper = rho_guess
-        if P_guess < P:  # rho_guess is too low
+        else:  # rho_guess is too low
             rho_lower = rho_guess
-        
-        #  recalculate rho_guess with new bounds
-        rho_guess = (rho_upper+rho_lower)/2
-    
-    return rho_guess    
+        if np.isfinite(rho_upper) and rho_upper - rho_lower <= 4*np.finfo(float).eps*rho_upper:
+            break  # the bracket cannot shrink any further in floating point
+        if policy is not None and bracket_steps+bisection_steps+newton_steps >= policy.max_inversion_steps:
+            policy.exceed('inversion')
+            break
+
+        rho_next = rho_guess - (P_guess-P)/slope
+        if rho_lower < rho_next < rho_upper:
+            newton_steps += 1
+        elif np.isinf(rho_upper):  # Newton step left the bracket with no upper bound yet: double
+            bracket_steps += 1
+            rho_next = 2*rho_lower
+        else:  # Newton step left the bracket: bisect
+            bisection_steps += 1
+            rho_next = (rho_upper+rho_lower)/2
+        rho_guess = rho_next
+
+    if inst.active is not None:  # record work done when instrumentation is switched on
+        inst.active.add('density_from_p_calls')
+        inst.active.add('bracket_iterations', bracket_steps)
+        inst.active.add('bisection_iterations', bisection_steps)
+        inst.active.add('newton_iterations', newton_steps)
+
+    return rho_guess
 
 
 # In[38]:
 
 
+# EoS parameters for each phase of each component, shared by the density functions below and by eos_kernels
+ice_params = {
+    'Ih':{'rho0':930, 'B0':9.85 * (10 ** 9), 'B1':6.6, 'form':'Murnaghan'},
+    'VI':{'rho0':1271, 'B0':14.05 * (10 ** 9), 'B1':4, 'form':'BM3'},
+    'VII':{'rho0':1456, 'B0':14.9 * (10 ** 9), 'B1':5.4, 'form':'BM3'}
+}
+
+##############
+# NOTES:
+# Mg:Si is 1:1, meaning that below bridgmanite fomration at 23 GPa will have mix
+# of Mg2SiO4 and SiO2, each with several phase trasnitions.  Mix is equimolar.
+# Molar mass of Mg2SiO4: 140.69 g
+# Molar mass of SiO2: 60.083 g
+# So mass (and density) fraction is 0.299 SiO2 : 0.701
+part_SiO2 = 0.299
+part_Mg2SiO4 = 0.701
+
+rock_params = {
+    'forsterite':{'rho0':3221,'B0':125 * (10 ** 9),'B1':4,'form':'BM3'},
+    'wadsleyite':{'rho0':3491,'B0':160 * (10 ** 9),'B1':4,'form':'BM3'},
+    'ringwoodite':{'rho0':3548,'B0':182 * (10 ** 9),'B1':4.2,'form':'BM3'},
+    'quartz':{'rho0':2648,'B0':37.4 * (10 ** 9),'B1':6.2,'form':'BM3'},
+    'coesite':{'rho0':2921,'B0':96 * (10 ** 9),'B1':8.4,'form':'BM3'},
+    'stichovite':{'rho0':4290,'B0':309.9 * (10 ** 9),'B1':4.59,'form':'BM3'},
+    'bridgmanite':{'rho0':4101,'B0':256 * (10 ** 9),'B1':4,'form':'BM3'},
+    'ppv':{'rho0':4058,'B0':221 * (10 ** 9),'B1':4.2,'form':'vinet'}
+}
+
+core_params = {
+    'Fe93Si7':{'rho0':7678, 'B0':136.2 * (10 ** 9), 'B1':5.97, 'form':'vinet'}
+}
+
+
 # EoS for individual compoonents
-def IceDensity(P):
-    """Returns the density of ice at a given pressure via corresponding EoS based on phase."""
-    
-    ice_params = {
-        'Ih':{'rho0':930, 'B0':9.85 * (10 ** 9), 'B1':6.6, 'form':'Murnaghan'},
-        'VI':{'rho0':1271, 'B0':14.05 * (10 ** 9), 'B1':4, 'form':'BM3'},
-        'VII':{'rho0':1456, 'B0':14.9 * (10 ** 9), 'B1':5.4, 'form':'BM3'}
-    }
+def IceDensity(P, policy=None):
+    """Returns the density of ice at a given pressure via corresponding EoS based on phase.
+    policy (TolerancePolicy, optional) sets the tolerance of the inversion, as in DensityFromP."""
     
     # pick phase according to pressure
     if P<1 * (10 ** 9):
-        return DensityFromP(P, **ice_params['Ih'])
+        return DensityFromP(P, **ice_params['Ih'], policy=policy)
     elif P<2.1 * (10 ** 9):
-        return DensityFromP(P, **ice_params['VI'])
+        return DensityFromP(P, **ice_params['VI'], policy=policy)
     else:
-        return DensityFromP(P, **ice_params['VII'])
+        return DensityFromP(P, **ice_params['VII'], policy=policy)
         
 
-def RockDensity(P):
+def RockDensity(P, policy=None):
     """Return the density of rock (MgSiO3) at a given pressure.
     Considers phase transitions accounting for a mixture of Mg2SiO4 and SiO2.
 
     Parameters:
     P (float): Pressure (Pa).
+    policy (TolerancePolicy, optional): Tolerance of the inversions, as in DensityFromP.
 
     Returns:
     Density (float) of the rock at the given pressure (kg/m^3)."""
     
-    ##############
-    # NOTES:
-    # Mg:Si is 1:1, meaning that below bridgmanite fomration at 23 GPa will have mix
-    # of Mg2SiO4 and SiO2, each with several phase trasnitions.  Mix is equimolar.
-    # Molar mass of Mg2SiO4: 140.69 g
-    # Molar mass of SiO2: 60.083 g
-    # So mass (and density) fraction is 0.299 SiO2 : 0.701
-    part_SiO2 = 0.299
-    part_Mg2SiO4 = 0.701
-    
-    rock_params = {
-        'forsterite':{'rho0':3221,'B0':125 * (10 ** 9),'B1':4,'form':'BM3'},
-        'wadsleyite':{'rho0':3491,'B0':160 * (10 ** 9),'B1':4,'form':'BM3'},
-        'ringwoodite':{'rho0':3548,'B0':182 * (10 ** 9),'B1':4.2,'form':'BM3'},
-        'quartz':{'rho0':2648,'B0':37.4 * (10 ** 9),'B1':6.2,'form':'BM3'},
-        'coesite':{'rho0':2921,'B0':96 * (10 ** 9),'B1':8.4,'form':'BM3'},
-        'stichovite':{'rho0':4290,'B0':309.9 * (10 ** 9),'B1':4.59,'form':'BM3'},
-        'bridgmanite':{'rho0':4101,'B0':256 * (10 ** 9),'B1':4,'form':'BM3'},
-        'ppv':{'rho0':4058,'B0':221 * (10 ** 9),'B1':4.2,'form':'vinet'}
-    }
-    
     # Mg2SiO4, SiO2, and MgSiO3 all have phase traisitions
     # SiO2: quartz -2.5GPa-> coesite -8GPa-> stichovite
     # Mg2SiO4: forsterite -14GPa-> wadsleyite -18GPa-> ringwoodite
@@ -164,46 +232,43 @@ def RockDensity(P):
     
     # Pick phases according to pressure
     if P<2.5 * (10 ** 9):  # quartz plus forsterite
-        rho_quartz = DensityFromP(P, **rock_params['quartz'])
-        rho_forsterite = DensityFromP(P, **rock_params['forsterite'])
+        rho_quartz = DensityFromP(P, **rock_params['quartz'], policy=policy)
+        rho_forsterite = DensityFromP(P, **rock_params['forsterite'], policy=policy)
         return part_SiO2*rho_quartz + part_Mg2SiO4*rho_forsterite
     elif P<8 * (10 ** 9):  # coesite plus forsterite
-        rho_coesite = DensityFromP(P, **rock_params['coesite'])
-        rho_forsterite = DensityFromP(P, **rock_params['forsterite'])
+        rho_coesite = DensityFromP(P, **rock_params['coesite'], policy=policy)
+        rho_forsterite = DensityFromP(P, **rock_params['forsterite'], policy=policy)
         return part_SiO2*rho_coesite + part_Mg2SiO4*rho_forsterite
     elif P<14 * (10 ** 9):  # stichovite plus forsterite
-        rho_stichovite = DensityFromP(P, **rock_params['stichovite'])
-        rho_forsterite = DensityFromP(P, **rock_params['forsterite'])
+        rho_stichovite = DensityFromP(P, **rock_params['stichovite'], policy=policy)
+        rho_forsterite = DensityFromP(P, **rock_params['forsterite'], policy=policy)
         return part_SiO2*rho_stichovite + part_Mg2SiO4*rho_forsterite
     elif P<18 * (10 ** 9):  # stichovite plus wadsleyite
-        rho_stichovite = DensityFromP(P, **rock_params['stichovite'])
-        rho_wadsleyite = DensityFromP(P, **rock_params['wadsleyite'])
+        rho_stichovite = DensityFromP(P, **rock_params['stichovite'], policy=policy)
+        rho_wadsleyite = DensityFromP(P, **rock_params['wadsleyite'], policy=policy)
         return part_SiO2*rho_stichovite + part_Mg2SiO4*rho_wadsleyite
     elif P<23 * (10 ** 9):  # stichovite plus ringwoodite
-        rho_stichovite = DensityFromP(P, **rock_params['stichovite'])
-        rho_ringwoodite = DensityFromP(P, **rock_params['ringwoodite'])
+        rho_stichovite = DensityFromP(P, **rock_params['stichovite'], policy=policy)
+        rho_ringwoodite = DensityFromP(P, **rock_params['ringwoodite'], policy=policy)
         return part_SiO2*rho_stichovite + part_Mg2SiO4*rho_ringwoodite
     elif P<120 * (10 ** 9):  # bridgmanite
-        return DensityFromP(P, **rock_params['bridgmanite'])
+        return DensityFromP(P, **rock_params['bridgmanite'], policy=policy)
     else:   # P>120 and have ppv phase
-        return DensityFromP(P, **rock_params['ppv'])
+        return DensityFromP(P, **rock_params['ppv'], policy=policy)
     
 
-def CoreDensity(P):
+def CoreDensity(P, policy=None):
     """Return the density of Fe93Si7 core alloy at a given pressure using the Vinet EoS (based on Wicks 2018)
     
     Parameters:
     P (float): Pressure (Pa).
+    policy (TolerancePolicy, optional): Tolerance of the inversion, as in DensityFromP.
 
     Returns:
     Density (float) of the core alloy at the given pressure (kg/m^3)
     """
     
-    core_params = {
-        'Fe93Si7':{'rho0':7678, 'B0':136.2 * (10 ** 9), 'B1':5.97, 'form':'vinet'}
-    }
-    
-    return DensityFromP(P, **core_params['Fe93Si7'])
+    return DensityFromP(P, **core_params['Fe93Si7'], policy=policy)
 
 
 
@@ -216,6 +281,7 @@ vRockDensity = np.vectorize(RockDensity)
 vCoreDesnity = np.vectorize(CoreDensity)
 
 
+# from matplotlib import pyplot as plt
 # pressures = np.linspace(0, 300 * (10 ** 9), 600)
 # plt.plot(pressures, vIceDensity(pressures), label='ice')
 # plt.plot(pressures, vRockDensity(pressures), label='rock')
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Differential Accuracy Harness
+
+Replays a stratified subset of the stored planets through a chosen solver backend and measures how far it
+departs from looped_solver.Solver, so that a faster engine (eos_kernels.solve_planet on either backend, a
+higher-order quadrature, a looser TolerancePolicy, ...) can be checked before it is used for production runs.
+
+Planets are read from:
+- data/monte_carlo_results/diamond_results_*.csv: radius, ice fraction, mass and max ice pressure
+- data/max_pressure_colormap/max_pressure_data.csv: ice fraction, radius and max ice pressure (no mass)
+Both were written by Solver, so by default their stored values are the reference. Pass reference=Solver (or
+--resolve) to solve the reference afresh instead, eg: after the EoS parameters have changed.
+
+The subset is stratified so that every region of the sampled space is represented: each source is split into
+STRATA_BINS x STRATA_BINS bins of radius and ice fraction, and each bin into candidates, noncandidates and
+boundary planets (max ice pressure within BOUNDARY_BAND of 10 GPa, where classification flips happen).
+per_stratum planets are drawn from every stratum with a seeded generator.
+
+Each planet is solved as monte_carlo.evaluate_planet does (1000 shells, core and mantle splitting what the ice
+leaves), and the report gives the maximum and percentiles of the relative error in mass and in max ice
+pressure, every planet whose diamond yes/no classification flips, and every planet the backend failed to solve.
+
+Usage:
+    python accuracy_harness.py --backend numba
+    python accuracy_harness.py --backend numpy --quadrature simpson --rtol 1e-4 --output harness_rows.csv
+
+    import accuracy_harness as ah
+    rows = ah.replay(ah.stratified_subset(ah.load_planets()), ek.solve_planet, backend='numba')
+    ah.print_report(ah.summarize(rows))
+"""
+
+import argparse
+import csv
+import glob
+import os
+import time
+
+import numpy as np
+
+import criteria
+import divergence
+import eos_kernels as ek
+import monte_carlo as mc
+import planetary_dictionary as dct
+from looped_solver import Solver
+from tolerance import TolerancePolicy
+
+r_earth = 6370 * (10 ** 3)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+MONTE_CARLO_FILES = sorted(glob.glob(os.path.join(DATA_DIR, 'monte_carlo_results', 'diamond_results_*.csv')))
+GRID_FILE = os.path.join(DATA_DIR, 'max_pressure_colormap', 'max_pressure_data.csv')
+
+BOUNDARY_BAND = 0.05
+#Planets whose max ice pressure lies within this fraction of the criteria.DIAMOND threshold form their own strata.
+
+STRATA_BINS = 5
+#Bins per axis (radius and ice fraction) of each source.
+
+PERCENTILES = [50, 90, 99]
+
+BACKENDS = {
+    'solver': (Solver, {}),
+    'numpy': (ek.solve_planet, {'backend': 'numpy'}),
+    'numba': (ek.solve_planet, {'backend': 'numba'}),
+}
+#Solver and options of each backend selectable from the command line.
+
+QUANTITIES = ['mass', 'max_p']
+
+CSV_HEADER = ['source', 'row', 'stratum', 'rand_earth', 'rand_ice',
+              'reference_mass', 'mass', 'mass_relative_error',
+              'reference_max_p', 'max_p', 'max_p_relative_error',
+              'reference_diamond', 'diamond', 'flipped', 'solve_time', 'failure']
+
+
+def load_planets(monte_carlo_files=MONTE_CARLO_FILES, grid_file=GRID_FILE):
+    """
+    Reads the stored planets.
+
+    Parameters:
+    monte_carlo_files (list, optional): Monte Carlo results csvs. Defaults to those in data/monte_carlo_results.
+    grid_file (str, optional): Max pressure grid csv, or None to leave it out. Defaults to max_pressure_data.csv.
+
+    Returns:
+    list: One dict per planet with its source (file name), row, rand_earth, rand_ice and stored mass (kg, nan for
+          the grid) and max_p (Pa). Grid planets that were not solved (nan) are left out.
+    """
+    planets = []
+    for filename in monte_carlo_files:
+        with open(filename, 'r', newline='') as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row_number, row in enumerate(reader):
+                planets.append({'source': os.path.basename(filename), 'row': row_number,
+                                'rand_earth': float(row[0]), 'rand_ice': float(row[1]),
+                                'mass': float(row[4]), 'max_p': float(row[5])})
+    if grid_file is not None:
+        with open(grid_file, 'r', newline='') as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row_number, row in enumerate(reader):
+                max_p = float(row[2]) * (10 ** 9)
+                if np.isfinite(max_p):
+                    planets.append({'source': os.path.basename(grid_file), 'row': row_number,
+                                    'rand_earth': float(row[1]), 'rand_ice': float(row[0]),
+                                    'mass': float('nan'), 'max_p': max_p})
+    return(planets)
+
+
+def _category(max_p):
+    if abs(max_p / criteria.DIAMOND.threshold - 1) <= BOUNDARY_BAND:
+        return('boundary')
+    return('yes' if criteria.DIAMOND.candidate(max_p) else 'no')
+
+
+def stratified_subset(planets, per_stratum=2, bins=STRATA_BINS, seed=0):
+    """
+    Draws up to per_stratum planets from every stratum (source, radius bin, ice fraction bin, category).
+
+    Parameters:
+    planets (list): Planets from load_planets().
+    per_stratum (int, optional): Planets drawn per stratum. Defaults to 2.
+    bins (int, optional): Bins per axis. Defaults to STRATA_BINS.
+    seed (int, optional): Seed of the draw. Defaults to 0.
+
+    Returns:
+    list: The selected planets, each with a 'stratum' label added, in source and row order.
+    """
+    rng = np.random.default_rng(seed)
+    strata = {}
+    for source in sorted({planet['source'] for planet in planets}):
+        members = [planet for planet in planets if planet['source'] == source]
+        radius = np.array([planet['rand_earth'] for planet in members])
+        ice = np.array([planet['rand_ice'] for planet in members])
+        radius_bin = np.digitize(radius, np.linspace(radius.min(), radius.max(), bins + 1)[1:-1])
+        ice_bin = np.digitize(ice, np.linspace(ice.min(), ice.max(), bins + 1)[1:-1])
+        for planet, i, j in zip(members, radius_bin, ice_bin):
+            strata.setdefault((source, int(i), int(j), _category(planet['max_p'])), []).append(planet)
+
+    subset = []
+    for (source, i, j, category), members in strata.items():
+        chosen = rng.choice(len(members), size=min(per_stratum, len(members)), replace=False)
+        subset.extend({**members[k], 'stratum': f'r{i}-i{j}-{category}'} for k in sorted(chosen))
+    return(sorted(subset, key=lambda planet: (planet['source'], planet['row'])))
+
+
+def evaluate(rand_earth, rand_ice, solver=Solver, **solver_options):
+    """
+    Solves one planet as monte_carlo.evaluate_planet does.
+
+    Parameters:
+    rand_earth (float): Planet radius in Earth radii.
+    rand_ice (float): Fractional depth of the ice layer; the rest is split equally between core and mantle.
+    solver (callable, optional): Solver or a drop-in such as eos_kernels.solve_planet. Defaults to Solver.
+    **solver_options: Passed to solver, eg: backend='numba', quadrature_rule='simpson', policy=TolerancePolicy().
+
+    Returns:
+    tuple: (mass (kg), max ice pressure (Pa)).
+
+    Raises:
+    divergence.SolverDiverged: If the planet's densities do not converge.
+    """
+    radius = rand_earth * r_earth
+    radii_list = [*range(1, int(radius), int(radius / 1000))]
+    fraction = 0.5 * (1 - rand_ice)
+    insert_dict = dct.planetary_dictionary(rand_earth, fraction, fraction)
+    boundary = list(insert_dict.keys())[1]
+
+    profile = divergence.check(solver(radii_list, insert_dict, **solver_options))
+    mass = float(mc.compute_mass(radii_list, profile.density))
+    max_p = float(profile.pressure[profile.radius >= boundary].max())
+    return(mass, max_p)
+
+
+def _relative_error(value, reference):
+    return(abs(value - reference) / abs(reference) if np.isfinite(reference) else float('nan'))
+
+
+def replay(planets, solver=ek.solve_planet, reference=None, **solver_options):
+    """
+    Solves every planet with the chosen backend and compares it with the reference.
+
+    Parameters:
+    planets (list): Planets from stratified_subset() (or load_planets()).
+    solver (callable, optional): Backend under test. Defaults to eos_kernels.solve_planet.
+    reference (callable, optional): Solver to compute the reference with, eg: Solver. Defaults to None, the
+                                    stored values.
+    **solver_options: Passed to solver.
+
+    Returns:
+    list: One dict per planet with the keys of CSV_HEADER. A planet the backend (or the reference) failed to
+          solve has nan values and the failure reason.
+    """
+    rows = []
+    for planet in planets:
+        row = {key: planet.get(key, '') for key in ['source', 'row', 'stratum', 'rand_earth', 'rand_ice']}
+        row.update(dict.fromkeys(['mass', 'max_p', 'mass_relative_error', 'max_p_relative_error', 'solve_time'],
+                                 float('nan')))
+        row.update({'diamond': '', 'flipped': False, 'failure': ''})
+        try:
+            if reference is None:
+                reference_mass, reference_max_p = planet['mass'], planet['max_p']
+            else:
+                reference_mass, reference_max_p = evaluate(planet['rand_earth'], planet['rand_ice'], reference)
+            row.update({'reference_mass': reference_mass, 'reference_max_p': reference_max_p,
+                        'reference_diamond': 'yes' if criteria.DIAMOND.candidate(reference_max_p) else 'no'})
+
+            start = time.perf_counter()
+            mass, max_p = evaluate(planet['rand_earth'], planet['rand_ice'], solver, **solver_options)
+            row['solve_time'] = time.perf_counter() - start
+        except divergence.SolverDiverged as error:
+            row.setdefault('reference_mass', float('nan'))
+            row.setdefault('reference_max_p', float('nan'))
+            row.setdefault('reference_diamond', '')
+            row['failure'] = error.failure.reason
+            rows.append(row)
+            continue
+
+        row.update({'mass': mass, 'max_p': max_p, 'diamond': 'yes' if criteria.DIAMOND.candidate(max_p) else 'no',
+                    'mass_relative_error': _relative_error(mass, reference_mass),
+                    'max_p_relative_error': _relative_error(max_p, reference_max_p)})
+        row['flipped'] = row['diamond'] != row['reference_diamond']
+        rows.append(row)
+    return(rows)
+
+
+def summarize(rows, percentiles=PERCENTILES):
+    """
+    Summarizes the rows of replay().
+
+    Returns:
+    dict: 'planets' and 'solved' counts, the mean 'solve_time' (s), for each of 'mass' and 'max_p' the 'max' and
+          'p<percentile>' relative errors over the solved planets (nan if none have that quantity), and the rows of
+          every 'flip' and 'failure'.
+    """
+    solved = [row for row in rows if not row['failure']]
+    summary = {'planets': len(rows), 'solved': len(solved),
+               'solve_time': float(np.mean([row['solve_time'] for row in solved])) if solved else float('nan'),
+               'flips': [row for row in solved if row['flipped']],
+               'failures': [row for row in rows if row['failure']]}
+    for name in QUANTITIES:
+        errors = np.array([row[f'{name}_relative_error'] for row in solved], dtype=float)
+        errors = errors[np.isfinite(errors)]
+        stats = {'max': float(errors.max()) if errors.size else float('nan')}
+        for q in percentiles:
+            stats[f'p{q}'] = float(np.percentile(errors, q)) if errors.size else float('nan')
+        summary[name] = stats
+    return(summary)
+
+
+def print_report(summary):
+    """Prints a summary from summarize()."""
+    print(f"{summary['solved']} of {summary['planets']} planets solved, {summary['solve_time']:.3g} s each")
+    for name in QUANTITIES:
+        print(f"{name} relative error: " + ", ".join(f"{key} {value:.2e}" for key, value in summary[name].items()))
+    print(f"{len(summary['flips'])} classification flips")
+    for row in summary['flips']:
+        print(f"  {row['source']} row {row['row']}: rand_earth {row['rand_earth']:.4f}, rand_ice {row['rand_ice']:.4f}, "
+              f"max_p {row['reference_max_p'] / 1e9:.4f} -> {row['max_p'] / 1e9:.4f} GPa "
+              f"({row['reference_diamond']} -> {row['diamond']})")
+    if summary['failures']:
+        print(f"{len(summary['failures'])} planets failed")
+        for row in summary['failures']:
+            print(f"  {row['source']} row {row['row']}: {row['failure']}")
+
+
+def write_csv(rows, filename):
+    """Writes the rows of replay() to a csv."""
+    with open(filename, mode='w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=CSV_HEADER)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare a solver backend against the stored Solver results.")
+    parser.add_argument('--backend', choices=list(BACKENDS), default='numba' if 'numba' in ek.available_backends()
+                        else 'numpy')
+    parser.add_argument('--quadrature', default='rectangle', help="Radial integration rule (quadrature.METHODS).")
+    parser.add_argument('--rtol', type=float, help="Solve with a TolerancePolicy of this relative tolerance.")
+    parser.add_argument('--per-stratum', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--resolve', action='store_true', help="Solve the reference with Solver instead of "
+                                                               "using the stored values.")
+    parser.add_argument('--output', help="Csv to write the per-planet comparison to.")
+    args = parser.parse_args(argv)
+
+    solver, options = BACKENDS[args.backend]
+    options = dict(options)
+    if args.quadrature != 'rectangle':
+        options['quadrature_rule'] = args.quadrature
+    if args.rtol is not None:
+        options['policy'] = TolerancePolicy(rtol=args.rtol)
+
+    planets = stratified_subset(load_planets(), args.per_stratum, seed=args.seed)
+    rows = replay(planets, solver, Solver if args.resolve else None, **options)
+    if args.output:
+        write_csv(rows, args.output)
+    print_report(summarize(rows))
+
+
+if __name__ == '__main__':
+    main()
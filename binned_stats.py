@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Binned Monte Carlo Statistics
+
+Streaming 2-D histograms of Monte Carlo results, for diagnostics plots whose cost does not grow with the
+number of planets. A BinnedStats holds, for every bin of planet radius x mass (or radius x ice fraction):
+- the number of candidate and noncandidate planets
+- their summed sample weights (1 per planet unless importance sampled)
+- the weighted sum of max_p, giving the mean max ice pressure of the bin
+
+Bins are updated as results arrive (one planet or a batch of arrays at a time), and two BinnedStats with the
+same bin edges merge by adding their arrays, so parallel workers or shards can each keep their own and combine
+them at the end. They are saved to and loaded from .npz files, and plot() renders straight from the bins.
+
+monte_carlo_run() keeps one for each layout and saves them next to its csv as <name>_bins_<layout>.npz;
+monte_carlo.plot_results() renders from them (or builds them from the csv in chunks if they are missing).
+sharded_runner.py merges the bins of its shards the same way.
+
+Usage:
+    import binned_stats as bs
+    stats = bs.BinnedStats('mass_radius')
+    stats.update(rand_earth, planet_mass, max_p, candidate)      # scalars or arrays
+    stats.merge(other_worker_stats)
+    stats.plot('diamond_results_5000_bins.png')
+"""
+
+import csv
+
+import numpy as np
+
+import criteria
+
+LAYOUTS = {
+    'mass_radius': {'y': 'planet_mass', 'y_label': 'Mass (kg)', 'log_y': True},
+    'ice_radius': {'y': 'rand_ice', 'y_label': 'Ice Thickness Fraction', 'log_y': False},
+}
+#Second axis of each layout; the first is always the planet radius (rand_earth, in Earth radii).
+
+RADIUS_EDGES = np.linspace(0.5, 1.5, 81)
+MASS_EDGES = np.geomspace(1e23, 3e25, 81)
+ICE_EDGES = np.linspace(0.1, 0.9, 81)
+#Default bin edges, covering the sampled ranges of monte_carlo.py.
+
+CSV_COLUMNS = {'rand_earth': 0, 'rand_ice': 1, 'planet_mass': 4, 'max_p': 5, 'diamond_formation': 6}
+#Columns of a monte_carlo results csv (see monte_carlo.CSV_HEADER).
+
+ARRAYS = ['candidates', 'noncandidates', 'candidate_weight', 'noncandidate_weight', 'max_p_sum']
+
+
+class BinnedStats:
+    """
+    Mergeable 2-D histograms of candidate and noncandidate planets and of their max ice pressure.
+
+    Parameters:
+    layout (str, optional): 'mass_radius' or 'ice_radius'. Defaults to 'mass_radius'.
+    x_edges (array, optional): Radius bin edges (Earth radii). Defaults to RADIUS_EDGES.
+    y_edges (array, optional): Mass (kg) or ice fraction bin edges. Defaults to MASS_EDGES or ICE_EDGES.
+
+    Attributes:
+    candidates, noncandidates (array): Number of planets per bin, indexed [x, y].
+    candidate_weight, noncandidate_weight (array): Summed sample weights per bin.
+    max_p_sum (array): Weighted sum of max_p (Pa) per bin.
+    outside (int): Number of planets that fell outside the edges.
+    """
+
+    def __init__(self, layout='mass_radius', x_edges=None, y_edges=None):
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown layout '{layout}'; choose from {list(LAYOUTS)}.")
+        self.layout = layout
+        self.x_edges = np.asarray(RADIUS_EDGES if x_edges is None else x_edges, dtype=float)
+        default_y = MASS_EDGES if layout == 'mass_radius' else ICE_EDGES
+        self.y_edges = np.asarray(default_y if y_edges is None else y_edges, dtype=float)
+        shape = (self.x_edges.size - 1, self.y_edges.size - 1)
+        self.candidates = np.zeros(shape, dtype=np.int64)
+        self.noncandidates = np.zeros(shape, dtype=np.int64)
+        self.candidate_weight = np.zeros(shape)
+        self.noncandidate_weight = np.zeros(shape)
+        self.max_p_sum = np.zeros(shape)
+        self.outside = 0
+
+    def __len__(self):
+        return(int(self.candidates.sum() + self.noncandidates.sum()) + self.outside)
+
+    def __repr__(self):
+        return(f"BinnedStats('{self.layout}', planets={len(self)}, bins={self.candidates.shape})")
+
+    def update(self, radius, y, max_p, candidate=None, weight=1.0):
+        """
+        Adds one planet or a batch of planets.
+
+        Parameters:
+        radius (float or array): Planet radius (Earth radii).
+        y (float or array): Planet mass (kg) or ice fraction, matching the layout.
+        max_p (float or array): Max ice pressure (Pa).
+        candidate (bool or array, optional): Diamond candidacy. Defaults to criteria.DIAMOND (max_p >= 10 GPa).
+        weight (float or array, optional): Sample weight. Defaults to 1.
+        """
+        radius = np.atleast_1d(np.asarray(radius, dtype=float))
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+        max_p = np.atleast_1d(np.asarray(max_p, dtype=float))
+        candidate = criteria.DIAMOND.candidate(max_p) if candidate is None else np.atleast_1d(np.asarray(candidate, dtype=bool))
+        weight = np.broadcast_to(np.asarray(weight, dtype=float), radius.shape)
+
+        i = np.searchsorted(self.x_edges, radius, side='right') - 1
+        j = np.searchsorted(self.y_edges, y, side='right') - 1
+        #The last edge closes the last bin, as in np.histogram2d.
+        i[radius == self.x_edges[-1]] = self.x_edges.size - 2
+        j[y == self.y_edges[-1]] = self.y_edges.size - 2
+        inside = (i >= 0) & (i < self.x_edges.size - 1) & (j >= 0) & (j < self.y_edges.size - 1)
+        self.outside += int(np.count_nonzero(~inside))
+
+        i, j, max_p, candidate, weight = i[inside], j[inside], max_p[inside], candidate[inside], weight[inside]
+        np.add.at(self.candidates, (i[candidate], j[candidate]), 1)
+        np.add.at(self.noncandidates, (i[~candidate], j[~candidate]), 1)
+        np.add.at(self.candidate_weight, (i[candidate], j[candidate]), weight[candidate])
+        np.add.at(self.noncandidate_weight, (i[~candidate], j[~candidate]), weight[~candidate])
+        np.add.at(self.max_p_sum, (i, j), weight * max_p)
+
+    def update_row(self, row, weight=1.0):
+        """
+        Adds one row of a monte_carlo results csv (as written by monte_carlo_run). Candidacy is read from its
+        diamond_formation column, so bins follow whichever criterion classified the planets.
+        """
+        y = row[CSV_COLUMNS[LAYOUTS[self.layout]['y']]]
+        self.update(float(row[CSV_COLUMNS['rand_earth']]), float(y), float(row[CSV_COLUMNS['max_p']]),
+                    row[CSV_COLUMNS['diamond_formation']] == 'yes', weight=weight)
+
+    def merge(self, other):
+        """Adds the counts of another BinnedStats with the same layout and edges, eg: from another worker."""
+        if (other.layout != self.layout or not np.array_equal(other.x_edges, self.x_edges)
+                or not np.array_equal(other.y_edges, self.y_edges)):
+            raise ValueError("Only BinnedStats with the same layout and bin edges can be merged.")
+        for name in ARRAYS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.outside += other.outside
+        return(self)
+
+    def counts(self):
+        """Number of planets per bin."""
+        return(self.candidates + self.noncandidates)
+
+    def candidate_fraction(self):
+        """Weighted fraction of candidates per bin (nan for empty bins)."""
+        total = self.candidate_weight + self.noncandidate_weight
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return(np.where(total > 0, self.candidate_weight / total, np.nan))
+
+    def mean_max_p(self):
+        """Weighted mean max ice pressure per bin (Pa, nan for empty bins)."""
+        total = self.candidate_weight + self.noncandidate_weight
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return(np.where(total > 0, self.max_p_sum / total, np.nan))
+
+    def save(self, filename):
+        """Saves the bins to an .npz file."""
+        np.savez(filename, layout=self.layout, x_edges=self.x_edges, y_edges=self.y_edges, outside=self.outside,
+                 **{name: getattr(self, name) for name in ARRAYS})
+
+    @classmethod
+    def load(cls, filename):
+        """Loads bins saved by save()."""
+        with np.load(filename) as data:
+            stats = cls(str(data['layout']), data['x_edges'], data['y_edges'])
+            for name in ARRAYS:
+                setattr(stats, name, data[name].copy())
+            stats.outside = int(data['outside'])
+        return(stats)
+
+    def plot(self, plot_filename, title=None):
+        """
+        Saves and shows three panels rendered from the bins: the number of planets, the candidate fraction, and
+        the mean max ice pressure with its 10 GPa contour. The cost does not depend on the number of planets.
+        """
+        from matplotlib import colors
+        from matplotlib import pyplot as plt
+
+        layout = LAYOUTS[self.layout]
+        counts = self.counts().T.astype(float)
+        panels = [
+            (np.where(counts > 0, counts, np.nan), 'Planets per bin', 'viridis',
+             colors.LogNorm(vmin=1, vmax=max(counts.max(), 1))),
+            (self.candidate_fraction().T, 'Candidate fraction', 'RdGy_r', colors.Normalize(0, 1)),
+            (self.mean_max_p().T / 1e9, 'Mean max pressure in ice (GPa)', 'viridis', colors.Normalize(0, 20)),
+        ]
+
+        fig, axes = plt.subplots(1, 3, figsize=(16, 5), sharey=True)
+        fig.suptitle(title or f"Monte Carlo Planets ({len(self)} planets)")
+        for ax, (values, label, cmap, norm) in zip(axes, panels):
+            mesh = ax.pcolormesh(self.x_edges, self.y_edges, values, cmap=cmap, norm=norm, shading='flat')
+            fig.colorbar(mesh, ax=ax, label=label)
+            ax.set_xlabel('Radius (Earth Radii)')
+        x_centres = (self.x_edges[:-1] + self.x_edges[1:]) / 2
+        y_centres = (self.y_edges[:-1] + self.y_edges[1:]) / 2
+        if np.isfinite(panels[2][0]).sum() > 3:
+            axes[2].contour(x_centres, y_centres, np.ma.masked_invalid(panels[2][0]),
+                            levels=[criteria.DIAMOND.threshold / 1e9], colors='red', linewidths=1.5)
+        axes[0].set_ylabel(layout['y_label'])
+        if layout['log_y']:
+            axes[0].set_yscale('log')
+
+        plt.tight_layout()
+        plt.savefig(plot_filename, dpi=300)
+        plt.show()
+
+
+def bins_filename(filename, layout):
+    """Returns the .npz file of the bins of a results csv, eg: diamond_results_5000_bins_mass_radius.npz."""
+    return(filename.replace('.csv', f'_bins_{layout}.npz'))
+
+
+def new_bins(**edges):
+    """Returns an empty BinnedStats for every layout, keyed by layout name."""
+    return({layout: BinnedStats(layout, **edges) for layout in LAYOUTS})
+
+
+def save_bins(bins, filename):
+    """Saves the bins of every layout next to the results csv filename."""
+    for layout, stats in bins.items():
+        stats.save(bins_filename(filename, layout))
+
+
+def from_csv(filename, layout='mass_radius', x_edges=None, y_edges=None, chunk_size=100000):
+    """
+    Builds a BinnedStats from a monte_carlo results csv, reading it in chunks of chunk_size rows so that memory
+    use does not grow with the file. Importance-sampled csvs are weighted by their sample_weight column, and
+    candidacy is read from the diamond_formation column.
+    """
+    stats = BinnedStats(layout, x_edges, y_edges)
+    y_column = CSV_COLUMNS[LAYOUTS[layout]['y']]
+    with open(filename, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        weight_column = header.index('sample_weight') if 'sample_weight' in header else None
+        while True:
+            chunk = [row for _, row in zip(range(chunk_size), reader)]
+            if not chunk:
+                break
+            columns = np.array([[row[CSV_COLUMNS['rand_earth']], row[y_column], row[CSV_COLUMNS['max_p']],
+                                 row[weight_column] if weight_column is not None else 1.0] for row in chunk],
+                               dtype=float)
+            candidate = np.array([row[CSV_COLUMNS['diamond_formation']] == 'yes' for row in chunk])
+            stats.update(columns[:, 0], columns[:, 1], columns[:, 2], candidate, weight=columns[:, 3])
+    return(stats)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Max Pressure Contour Plot
+
+Sweeps a grid of ice thickness fractions and planet radii, solves each planet with looped_solver.Solver and
+maps the maximum pressure in its ice layer, with a contour at the 10 GPa diamond precipitation threshold.
+Moved here from contour_plot_maker.ipynb so that the sweep can also be split across machines
+(see sharded_runner.py).
+
+Grid csv columns: ice_thickness_fraction, planet_radius_Earth_units, max_pressure_GPa
+(eg: data/max_pressure_colormap/max_pressure_data.csv). Planets whose solve does not converge are left as nan
+(blank in the plot) and listed in a *_failures.csv next to the grid csv.
+
+Usage:
+    from contour_plot import plot_max_p_vs_ratio, plot_from_csv
+    plot_max_p_vs_ratio(1.1)                  # solve the grid, write the csv and plot it
+    plot_from_csv('max_pressure_data.csv')   # replot an existing csv
+"""
+
+import csv
+
+import numpy as np
+
+import criteria
+import divergence
+import planetary_dictionary as dct
+from looped_solver import Solver
+
+r_earth = 6370 * (10 ** 3)
+
+GRID_HEADER = ['ice_thickness_fraction', 'planet_radius_Earth_units', 'max_pressure_GPa']
+
+FAILURE_PARAMETERS = ['ice_thickness_fraction', 'planet_radius_Earth_units']
+#Planet parameters recorded for each skipped planet in a *_failures.csv.
+
+
+def grid_axes(up_to_rad):
+    """
+    Returns the ice thickness fractions and planet radii (Earth radii) of the sweep up to up_to_rad.
+    """
+    ice_thicknesses = np.arange(0.1, 0.9, 0.01)
+    earth_radii = np.arange(0.6, up_to_rad, up_to_rad / 80)
+    return(ice_thicknesses, earth_radii)
+
+
+def max_ice_pressure(earth_rad, ice_thick):
+    """
+    Solves one planet of the grid and returns the maximum pressure in its ice layer (Pa).
+
+    Parameters:
+    earth_rad (float): Planet radius in Earth radii.
+    ice_thick (float): Fractional depth of the ice layer; the rest is split equally between core and mantle.
+
+    Raises:
+    divergence.SolverDiverged: If the planet's densities do not converge.
+    """
+    x = (1 - ice_thick) / 2
+    fe = x
+    si = x
+
+    iceball_profile_dictionary = dct.planetary_dictionary(earth_rad, fe, si)
+    radius = earth_rad * r_earth
+    iceball_radii_list = [*range(1, int(radius), int(radius / 1000))]
+
+    profile = divergence.check(Solver(iceball_radii_list, iceball_profile_dictionary))
+    in_ice = profile.radius >= list(iceball_profile_dictionary.keys())[1]
+
+    return(float(profile.pressure[in_ice].max()))
+
+
+def write_grid_csv(filename, ice_thicknesses, earth_radii, z_matrix_gpa):
+    """Writes a max pressure grid (GPa, indexed [ice, radius]) to a csv, one row per planet."""
+    with open(filename, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(GRID_HEADER)
+
+        for i, ice_thick in enumerate(ice_thicknesses):
+            for j, earth_rad in enumerate(earth_radii):
+                writer.writerow([ice_thick, earth_rad, z_matrix_gpa[i, j]])
+
+
+def read_grid_csv(filename):
+    """
+    Reads a grid csv written by write_grid_csv().
+
+    Returns:
+    tuple: (ice_thicknesses, earth_radii, z_matrix_gpa), the matrix indexed [ice, radius].
+    """
+    with open(filename, 'r') as file:
+        reader = csv.reader(file)
+        next(reader)
+        rows = np.array([[float(value) for value in row] for row in reader])
+
+    ice_thicknesses, ice_index = np.unique(rows[:, 0], return_inverse=True)
+    earth_radii, radius_index = np.unique(rows[:, 1], return_inverse=True)
+    z_matrix_gpa = np.full((len(ice_thicknesses), len(earth_radii)), np.nan)
+    z_matrix_gpa[ice_index, radius_index] = rows[:, 2]
+    return(ice_thicknesses, earth_radii, z_matrix_gpa)
+
+
+def plot_grid(ice_thicknesses, earth_radii, z_matrix_gpa, plot_filename):
+    """
+    Saves and shows the max pressure colormap with its 10 GPa contour.
+    The 'twilight' colormap may be best; vmin, vmax = 0, 20 centres it at 10 GPa.
+    """
+    from matplotlib import pyplot as plt
+
+    plt.figure()
+    extent = [earth_radii[0], earth_radii[-1], ice_thicknesses[0], ice_thicknesses[-1]]
+
+    vmin, vmax = 0, 20
+    img = plt.imshow(
+        z_matrix_gpa,
+        origin='lower',
+        aspect='auto',
+        extent=extent,
+        cmap='viridis',
+        interpolation='none',
+        vmin=vmin,
+        vmax=vmax
+    )
+
+    plt.colorbar(img, label='Max Pressure in Ice (GPa)')
+
+    X, Y = np.meshgrid(earth_radii, ice_thicknesses)
+
+    contour_level = criteria.DIAMOND.threshold / 1e9
+    plt.contour(X, Y, z_matrix_gpa, levels=[contour_level], colors='red', linewidths=2)
+
+    plt.xlabel('Planet Radius (Earth Radii)')
+    plt.ylabel('Ice Thickness Fraction')
+    plt.title('Max Pressure vs Ice Thickness and Radius')
+
+    plt.savefig(plot_filename, bbox_inches='tight')
+    plt.show()
+
+
+def plot_max_p_vs_ratio(up_to_rad, filename='max_pressure_data.csv', plot_filename='contour_colormap.png'):
+    """
+    Solves the whole grid up to up_to_rad Earth radii, saves it to a csv and plots it.
+
+    Parameters:
+    up_to_rad (float): Largest planet radius of the sweep (Earth radii, exclusive).
+    filename (str, optional): Output csv. Defaults to 'max_pressure_data.csv'.
+    plot_filename (str, optional): Output figure. Defaults to 'contour_colormap.png'.
+    """
+    import tqdm
+
+    ice_thicknesses, earth_radii = grid_axes(up_to_rad)
+
+    z_matrix = np.zeros((len(ice_thicknesses), len(earth_radii)))
+
+    total_iterations = len(ice_thicknesses) * len(earth_radii)
+    progress = tqdm.tqdm(total=total_iterations, desc="Calculating max pressure", ncols=100)
+
+    with divergence.FailureLog(filename.replace('.csv', '_failures.csv'), FAILURE_PARAMETERS) as failures:
+        for i, ice_thick in enumerate(ice_thicknesses):
+            for j, earth_rad in enumerate(earth_radii):
+                try:
+                    z_matrix[i, j] = max_ice_pressure(earth_rad, ice_thick)
+                except divergence.SolverDiverged as error:
+                    z_matrix[i, j] = np.nan
+                    failures.log(i * len(earth_radii) + j, [ice_thick, earth_rad], error.failure)
+                progress.update(1)
+
+    progress.close()
+
+    write_grid_csv(filename, ice_thicknesses, earth_radii, z_matrix / 1e9)
+    print(f"Saved pressure data to '{filename}'")
+
+    plot_grid(ice_thicknesses, earth_radii, z_matrix / 1e9, plot_filename)
+
+
+def plot_from_csv(filename='max_pressure_data.csv', plot_filename='contour_colormap_from_csv_1.png'):
+    """Replots a grid straight from its csv, without solving any planets."""
+    plot_grid(*read_grid_csv(filename), plot_filename)
+
+
+if __name__ == '__main__':
+    plot_max_p_vs_ratio(1.1)
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Diamond Precipitation Criteria
+
+Pluggable criteria for diamond precipitation, evaluated on the solved shells of the ice layer of many planets
+at once. The shells of a batch of planets are held end to end in flat arrays (IceShells), and every metric is
+a vectorized reduction over each planet's segment, so a criterion costs a few array passes however many planets
+it is applied to.
+
+Criteria:
+- PressureThreshold: the maximum ice pressure, and whether it reaches the threshold. DIAMOND, at 10 GPa, is the
+  default candidacy test of the Monte Carlo runs, and every module that classifies planets from their max_p
+  alone (binned_stats, samplers, eos_uncertainty, accuracy_harness, the 10 GPa contours) goes through it.
+- PressureWindow: thickness of ice whose pressure lies in [low, high), and its fraction of the ice layer.
+- ThicknessAbove: thickness of ice at or above a threshold pressure (a window open at the top).
+- OnsetDepth: depth below the surface of the shallowest ice shell at or above a threshold pressure.
+
+Each criterion returns a dictionary of per-planet metric arrays, including a boolean metric under its own name
+(the planet's yes/no), so several criteria give all their metrics in one pass of evaluate(). New criteria
+subclass the abstract Criterion and implement metrics().
+
+Since they only need the radius and pressure of each shell, criteria can be applied after the solve to the
+profiles stored in a profile_archive.ProfileArchive (evaluate_archive), to study new criteria without re-running
+the physics. Archived profiles are float32, so pressures agree with the solve to about 1 part in 10^7.
+
+Usage:
+    import criteria
+    shells = criteria.IceShells.from_profiles([profile], [mantle_ice_boundary])
+    criteria.evaluate(shells)['diamond']
+
+    results = criteria.evaluate_archive(profile_archive.ProfileArchive('profiles'),
+                                        [criteria.DIAMOND, criteria.PressureWindow(10e9, 50e9, name='window')])
+    criteria.write_csv(results, 'criteria.csv')
+"""
+
+import csv
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+DIAMOND_PRESSURE = 10 * (10 ** 9)
+#Pressure (Pa) at which the ice layer is taken to allow diamond precipitation.
+
+
+def _segment_reduce(ufunc, values, starts, counts, empty):
+    #Reduces values over each segment [start, start + count), giving empty for segments without shells.
+    out = np.full(counts.size, empty, dtype=float)
+    filled = counts > 0
+    if filled.any():
+        out[filled] = ufunc.reduceat(values, starts[filled])
+    return(out)
+
+
+class IceShells:
+    """
+    The ice-layer shells of a batch of planets, end to end in flat arrays.
+
+    Parameters:
+    radius (array): Radius of every shell (m), planet after planet, each planet's shells in increasing radius.
+    pressure (array): Pressure of every shell (Pa).
+    counts (array): Number of shells of each planet.
+    boundary (array): Mantle-ice boundary radius of each planet (m).
+    surface (array): Outermost radius of each planet (m).
+    step (array): Shell spacing of each planet (m).
+
+    Attributes:
+    starts (array): Index of each planet's first shell.
+    planet (array): Index of the planet of every shell.
+    """
+
+    def __init__(self, radius, pressure, counts, boundary, surface, step):
+        self.radius = np.asarray(radius, dtype=float)
+        self.pressure = np.asarray(pressure, dtype=float)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.boundary = np.asarray(boundary, dtype=float)
+        self.surface = np.asarray(surface, dtype=float)
+        self.step = np.asarray(step, dtype=float)
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]]).astype(np.int64)
+        self.planet = np.repeat(np.arange(self.counts.size), self.counts)
+
+    def __len__(self):
+        return(self.counts.size)
+
+    def __repr__(self):
+        return(f"IceShells(planets={len(self)}, shells={self.radius.size})")
+
+    @classmethod
+    def from_profiles(cls, profiles, boundaries):
+        """
+        Collects the ice shells (radius at or beyond the boundary, as in monte_carlo.evaluate_planet) of solved
+        planets.
+
+        Parameters:
+        profiles (list): PlanetProfiles, or anything with evenly spaced radius and pressure arrays.
+        boundaries (list): Mantle-ice boundary radius of each planet (m), eg: list(insert_dict.keys())[1].
+        """
+        radius, pressure, counts, surface, step = [], [], [], [], []
+        for profile, boundary in zip(profiles, boundaries):
+            radii = np.asarray(profile.radius, dtype=float)
+            in_ice = radii >= boundary
+            radius.append(radii[in_ice])
+            pressure.append(np.asarray(profile.pressure, dtype=float)[in_ice])
+            counts.append(int(in_ice.sum()))
+            surface.append(radii[-1])
+            step.append(radii[1] - radii[0])
+        return(cls(np.concatenate(radius) if radius else [], np.concatenate(pressure) if pressure else [], counts,
+                   boundaries, surface, step))
+
+    @classmethod
+    def from_archive(cls, archive, planet_ids=None, boundary='mantle_ice_boundary'):
+        """
+        Collects the ice shells of archived planets, with one gather per field rather than a loop over planets.
+
+        Parameters:
+        archive (ProfileArchive): Archive filled by monte_carlo_run(archive=...).
+        planet_ids (list, optional): Planets to collect. Defaults to every planet in the archive.
+        boundary (str, optional): Archive parameter holding the mantle-ice boundary radius (m).
+        """
+        if boundary not in archive.index:
+            raise KeyError(f"The archive has no '{boundary}' parameter; expected one of {archive.parameters}.")
+        rows = (np.arange(len(archive)) if planet_ids is None
+                else np.array([archive.row(planet_id) for planet_id in planet_ids], dtype=np.int64))
+        offsets = archive.index['offset'][rows]
+        lengths = archive.index['length'][rows]
+        boundaries = archive.index[boundary][rows]
+
+        #Position of every shell of the chosen planets in the archive's concatenated arrays.
+        first = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        positions = np.repeat(offsets - first, lengths) + np.arange(lengths.sum())
+        radius = np.asarray(archive.values('radius')[positions], dtype=float)
+        pressure = np.asarray(archive.values('pressure')[positions], dtype=float)
+
+        planet = np.repeat(np.arange(rows.size), lengths)
+        in_ice = radius >= boundaries[planet].astype(np.float32)
+        #Compared in float32, the precision the radii are stored in.
+        last = first + lengths - 1
+        return(cls(radius[in_ice], pressure[in_ice], np.bincount(planet[in_ice], minlength=rows.size), boundaries,
+                   radius[last], radius[np.minimum(first + 1, last)] - radius[first]))
+
+    def ice_thickness(self):
+        """Thickness of each planet's ice layer (m), from the boundary to the surface."""
+        return(self.surface - self.boundary)
+
+    def maximum(self, values):
+        """Largest of values (one per shell) over each planet's shells; nan for a planet without ice shells."""
+        return(_segment_reduce(np.maximum, values, self.starts, self.counts, np.nan))
+
+    def total(self, values):
+        """Sum of values (one per shell) over each planet's shells."""
+        return(_segment_reduce(np.add, values, self.starts, self.counts, 0.0))
+
+
+class Criterion(ABC):
+    """
+    Abstract base class of the criteria. Subclasses implement metrics() and report their yes/no under name; one
+    that does not implement metrics() cannot be instantiated.
+    """
+
+    name = 'criterion'
+
+    @abstractmethod
+    def metrics(self, shells):
+        """
+        Evaluates the criterion for every planet of an IceShells batch.
+
+        Returns:
+        dict: Per-planet arrays keyed by metric name, including a boolean array under self.name.
+        """
+
+
+class PressureThreshold(Criterion):
+    """
+    Maximum ice pressure, and whether it reaches threshold.
+
+    Parameters:
+    threshold (float, optional): Pressure (Pa). Defaults to DIAMOND_PRESSURE.
+    name (str, optional): Name of the yes/no metric. Defaults to 'diamond'.
+
+    Metrics: max_p (Pa), <name>.
+    """
+
+    def __init__(self, threshold=DIAMOND_PRESSURE, name='diamond'):
+        self.threshold = threshold
+        self.name = name
+
+    def metrics(self, shells):
+        max_p = shells.maximum(shells.pressure)
+        return({'max_p': max_p, self.name: self.candidate(max_p)})
+
+    def candidate(self, max_p):
+        """The yes/no of the criterion from maximum ice pressures (Pa) alone, for results stored without profiles."""
+        return(np.asarray(max_p) >= self.threshold)
+
+
+class PressureWindow(Criterion):
+    """
+    Thickness of ice whose pressure lies in [low, high).
+
+    Parameters:
+    low, high (float): Pressure window (Pa).
+    min_thickness (float, optional): Thickness (m) the window must exceed for a yes. Defaults to 0.
+    name (str, optional): Name of the yes/no metric and prefix of the others. Defaults to 'window'.
+
+    Metrics: <name>_thickness (m), <name>_fraction (of the ice layer), <name>.
+    """
+
+    def __init__(self, low, high, min_thickness=0.0, name='window'):
+        self.low = low
+        self.high = high
+        self.min_thickness = min_thickness
+        self.name = name
+
+    def metrics(self, shells):
+        inside = (shells.pressure >= self.low) & (shells.pressure < self.high)
+        thickness = shells.total(inside * shells.step[shells.planet])
+        return({f'{self.name}_thickness': thickness,
+                f'{self.name}_fraction': thickness / shells.ice_thickness(),
+                self.name: thickness > self.min_thickness})
+
+
+class ThicknessAbove(PressureWindow):
+    """
+    Thickness of ice at or above threshold.
+
+    Parameters:
+    threshold (float, optional): Pressure (Pa). Defaults to DIAMOND_PRESSURE.
+    min_thickness (float, optional): Thickness (m) that must be exceeded for a yes. Defaults to 0.
+    name (str, optional): Defaults to 'thick_ice'.
+
+    Metrics: <name>_thickness (m), <name>_fraction (of the ice layer), <name>.
+    """
+
+    def __init__(self, threshold=DIAMOND_PRESSURE, min_thickness=0.0, name='thick_ice'):
+        super().__init__(threshold, np.inf, min_thickness, name)
+
+
+class OnsetDepth(Criterion):
+    """
+    Depth below the surface of the shallowest ice shell at or above threshold.
+
+    Parameters:
+    threshold (float, optional): Pressure (Pa). Defaults to DIAMOND_PRESSURE.
+    max_depth (float, optional): Depth (m) the onset must be shallower than for a yes. Defaults to no limit.
+    name (str, optional): Defaults to 'onset'.
+
+    Metrics: <name>_depth (m, nan if the threshold is never reached), <name>_depth_fraction (of the ice layer),
+    <name>.
+    """
+
+    def __init__(self, threshold=DIAMOND_PRESSURE, max_depth=np.inf, name='onset'):
+        self.threshold = threshold
+        self.max_depth = max_depth
+        self.name = name
+
+    def metrics(self, shells):
+        onset = shells.maximum(np.where(shells.pressure >= self.threshold, shells.radius, -np.inf))
+        depth = np.where(np.isfinite(onset), shells.surface - onset, np.nan)
+        return({f'{self.name}_depth': depth,
+                f'{self.name}_depth_fraction': depth / shells.ice_thickness(),
+                self.name: depth <= self.max_depth})
+
+
+DIAMOND = PressureThreshold()
+#The candidacy test of the Monte Carlo runs: a maximum ice pressure of at least 10 GPa.
+
+DEFAULT_CRITERIA = [DIAMOND, ThicknessAbove(), OnsetDepth()]
+
+
+def evaluate(shells, criteria=DEFAULT_CRITERIA):
+    """
+    Evaluates several criteria on one IceShells batch.
+
+    Returns:
+    dict: Every criterion's per-planet metric arrays, in one dictionary.
+    """
+    results = {}
+    for criterion in criteria:
+        metrics = criterion.metrics(shells)
+        clash = set(metrics) & set(results)
+        if clash:
+            raise ValueError(f"Criteria report the same metrics {sorted(clash)}; give them different names.")
+        results.update(metrics)
+    return(results)
+
+
+def evaluate_archive(archive, criteria=DEFAULT_CRITERIA, planet_ids=None, chunk_size=10000):
+    """
+    Evaluates criteria on the stored profiles of an archive, chunk_size planets at a time so that memory use does
+    not grow with the archive.
+
+    Parameters:
+    archive (ProfileArchive): Archive filled by monte_carlo_run(archive=...).
+    criteria (list, optional): Criteria to evaluate. Defaults to DEFAULT_CRITERIA.
+    planet_ids (list, optional): Planets to evaluate. Defaults to every planet in the archive.
+    chunk_size (int, optional): Planets per chunk. Defaults to 10000.
+
+    Returns:
+    dict: 'planet_id' and the archived parameters of each planet, followed by the metrics of every criterion.
+    """
+    planet_ids = archive.index['planet_id'] if planet_ids is None else np.asarray(planet_ids, dtype=np.int64)
+    chunks = [evaluate(IceShells.from_archive(archive, planet_ids[k:k + chunk_size]), criteria)
+              for k in range(0, len(planet_ids), chunk_size)]
+    rows = np.array([archive.row(planet_id) for planet_id in planet_ids], dtype=np.int64)
+    results = {'planet_id': planet_ids}
+    results.update({name: archive.index[name][rows] for name in archive.parameters})
+    if chunks:
+        results.update({name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]})
+    return(results)
+
+
+def write_csv(results, filename):
+    """Writes the results of evaluate_archive() (or evaluate()) to a csv, one row per planet."""
+    names = list(results)
+    with open(filename, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(names)
+        for values in zip(*(results[name] for name in names)):
+            writer.writerow([value.item() if hasattr(value, 'item') else value for value in values])
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Divergence Detection
+
+Watches the residual history of the solver's fixed-point iteration (the largest change in density between
+two iterations, over the shells checked for convergence) so that a planet which will not converge is given
+up on within a few iterations instead of running to the iteration cap.
+
+A solve is flagged as:
+- 'oscillating': successive density updates point in opposite directions (cosine below OSCILLATION_COSINE)
+  for RUN iterations in a row while the residual shrinks by less than 1 - MIN_DECREASE every two iterations,
+  eg: shells flipping between two phases on either side of a phase boundary.
+- 'stagnating': the residual has not fallen across the last WINDOW iterations (the last one is no smaller than
+  the first of the window). Slow but steady contraction, however slow, is never flagged.
+- 'diverging': the residual has grown RUN iterations in a row.
+- 'invalid': a density became nan or infinite.
+- 'max_iterations': the iteration cap was reached without any of the above.
+- 'inversion_cap': the densities converged, but some EoS inversion of the last iteration reached the step cap
+  of the solve's tolerance.TolerancePolicy, so they are not within its tolerance.
+
+looped_solver.Solver and eos_kernels.solve_planet retry a flagged solve once, from its last densities, with
+damped (under-relaxed) updates rho <- rho + damping * (rho_new - rho) at RETRY_DAMPING times the damping
+used so far. Damping leaves the solution unchanged but turns an oscillation into a converging sequence.
+If the retry is flagged as well (or the solve was 'invalid'), the returned PlanetProfile has converged=False
+and a SolveFailure record as its failure attribute.
+
+The batch runners (monte_carlo, contour_plot, sharded_runner) turn such a profile into a SolverDiverged
+exception, record the planet in a FailureLog csv and carry on with the next one.
+
+Usage:
+    profile = Solver(radii_list, insert_dict)
+    if not profile.converged:
+        print(profile.failure.reason, profile.failure.iterations, profile.failure.residuals[-5:])
+"""
+
+import csv
+import os
+
+import numpy as np
+
+WINDOW = 6
+#Number of iterations over which stagnation is judged.
+
+RUN = 3
+#Number of consecutive iterations that must oscillate or grow.
+
+MIN_DECREASE = 0.9
+#A residual that has not fallen below this fraction of its earlier value is not making progress.
+
+OSCILLATION_COSINE = -0.5
+#Successive updates whose cosine is below this point in opposite directions.
+
+RETRY_DAMPING = 0.5
+#Factor applied to the damping for the retry.
+
+RETRY_REASONS = ('oscillating', 'stagnating', 'diverging')
+#Flags for which a damped retry is worth trying. Damping cannot repair nan densities.
+
+FAILURE_HEADER = ['sample_index', 'reason', 'iterations', 'damping', 'residual']
+#Leading columns of a FailureLog, before the planet parameters.
+
+
+class SolveFailure:
+    """
+    Record of a solve that did not converge.
+
+    Parameters:
+    reason (str): 'oscillating', 'stagnating', 'diverging', 'invalid', 'max_iterations' or 'inversion_cap'.
+    iterations (int): Iterations taken, including the retry.
+    damping (float): Damping of the last iteration.
+    residuals (array): Largest density change (kg/m^3) of every iteration, including the retry.
+    """
+
+    __slots__ = ('reason', 'iterations', 'damping', 'residuals')
+
+    def __init__(self, reason, iterations, damping, residuals):
+        self.reason = reason
+        self.iterations = int(iterations)
+        self.damping = float(damping)
+        self.residuals = np.asarray(residuals, dtype=float)
+
+    def __repr__(self):
+        return(f"SolveFailure(reason={self.reason!r}, iterations={self.iterations}, damping={self.damping})")
+
+    def residual(self):
+        """Largest density change of the last iteration (kg/m^3), or nan if there was none."""
+        return(float(self.residuals[-1]) if self.residuals.size else float('nan'))
+
+
+class SolverDiverged(RuntimeError):
+    """Raised by the batch runners for a planet whose solve did not converge. The record is in failure."""
+
+    def __init__(self, failure):
+        super().__init__(f"Solver gave up ({failure.reason}) after {failure.iterations} iterations.")
+        self.failure = failure
+
+
+def check(profile):
+    """
+    Returns a converged profile unchanged and raises SolverDiverged for any other.
+
+    Parameters:
+    profile (PlanetProfile): Result of Solver or eos_kernels.solve_planet.
+    """
+    if not profile.converged:
+        raise SolverDiverged(profile.failure or SolveFailure('max_iterations', profile.iterations, 1.0, []))
+    return(profile)
+
+
+class ResidualMonitor:
+    """
+    Residual history of one solve, checked after every iteration.
+
+    Attributes:
+    residuals (list): Largest density change of every iteration so far.
+    alignments (list): Cosine between each density update and the one before (0 for the first).
+    retried (bool): Whether restart() has been called, ie: this is the damped retry.
+    """
+
+    __slots__ = ('residuals', 'alignments', 'retried', '_start', '_previous')
+
+    def __init__(self):
+        self.residuals = []
+        self.alignments = []
+        self.retried = False
+        self._start = 0
+        self._previous = None
+
+    def update(self, delta):
+        """
+        Records one iteration from its density update (new minus old densities over the checked shells).
+
+        Returns:
+        str: The flag raised by this iteration (see verdict()), or None.
+        """
+        delta = np.asarray(delta, dtype=float)
+        alignment = 0.0
+        if self._previous is not None:
+            norms = np.linalg.norm(delta) * np.linalg.norm(self._previous)
+            alignment = float(np.dot(delta, self._previous) / norms) if norms > 0 else 0.0
+        self._previous = delta
+        return(self.record(float(np.max(np.abs(delta))) if delta.size else 0.0, alignment))
+
+    def record(self, residual, alignment):
+        """Records one iteration from its residual and alignment, as computed by the compiled solve."""
+        self.residuals.append(residual)
+        self.alignments.append(alignment)
+        return(self.verdict())
+
+    def verdict(self):
+        """
+        Returns 'invalid', 'oscillating', 'diverging' or 'stagnating' if the iterations since the last restart
+        show it, otherwise None.
+        """
+        residuals = self.residuals[self._start:]
+        alignments = self.alignments[self._start:]
+        if not np.isfinite(residuals[-1]):
+            return('invalid')
+        if (len(residuals) > RUN and all(a < OSCILLATION_COSINE for a in alignments[-RUN:])
+                and residuals[-1] > MIN_DECREASE * residuals[-3]):
+            return('oscillating')
+        if len(residuals) > RUN and all(residuals[-k] > residuals[-k - 1] for k in range(1, RUN + 1)):
+            return('diverging')
+        if len(residuals) > WINDOW and residuals[-1] >= residuals[-WINDOW]:
+            return('stagnating')
+        return(None)
+
+    def restart(self):
+        """Starts judging afresh, for the damped retry. The history is kept for the failure record."""
+        self.retried = True
+        self._start = len(self.residuals)
+        self._previous = None
+
+    def failure(self, reason, iterations, damping):
+        """Returns the SolveFailure record of this solve."""
+        return(SolveFailure(reason, iterations, damping, self.residuals))
+
+
+def respond(monitor, reason, damping):
+    """
+    Decides how a solve continues after an iteration that did not converge.
+
+    Parameters:
+    monitor (ResidualMonitor): The solve's monitor.
+    reason (str): The flag returned by monitor.update() or monitor.record() for the iteration, or None.
+    damping (float): Damping used so far.
+
+    Returns:
+    tuple: (reason, damping). reason is None to keep iterating with the returned damping, or the flag
+           on which to give up.
+    """
+    if reason is None:
+        return(None, damping)
+    if monitor.retried or reason not in RETRY_REASONS:
+        return(reason, damping)
+    monitor.restart()
+    return(None, damping * RETRY_DAMPING)
+
+
+class FailureLog:
+    """
+    Csv of the planets skipped by a batch run, written as they fail. The file is only created once a
+    planet fails, so a clean run leaves none behind.
+
+    Parameters:
+    filename (str): Csv to write, eg: diamond_results_5000_failures.csv.
+    parameter_names (list): Names of the planet parameters logged after FAILURE_HEADER.
+
+    Usage:
+        with FailureLog('run_failures.csv', ['rand_earth', 'rand_ice']) as failures:
+            try:
+                row = evaluate_planet(rand_earth, rand_ice)
+            except SolverDiverged as error:
+                failures.log(i, [rand_earth, rand_ice], error.failure)
+    """
+
+    def __init__(self, filename, parameter_names):
+        self.filename = filename
+        self.parameter_names = list(parameter_names)
+        self.count = 0
+        self._file = None
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def log(self, sample_index, parameters, failure):
+        """Appends one failed planet and reports it."""
+        if self._file is None:
+            self._file = open(self.filename, 'w', newline='')
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(FAILURE_HEADER + self.parameter_names)
+        self._writer.writerow([sample_index, failure.reason, failure.iterations, failure.damping,
+                               failure.residual()] + list(parameters))
+        self._file.flush()
+        self.count += 1
+        print(f"Skipped planet {sample_index} {dict(zip(self.parameter_names, parameters))}: {failure.reason} "
+              f"after {failure.iterations} iterations")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_failures(filename):
+    """
+    Reads a FailureLog csv.
+
+    Returns:
+    list: One row (list of strings) per failed planet, in FailureLog column order. Empty if the file does not exist.
+    """
+    if not os.path.exists(filename):
+        return([])
+    with open(filename, 'r', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        return(list(reader))
@@ -0,0 +1,524 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+EoS and Radial Integration Kernels
+
+Array versions of the EoS_Bits equations of state, of the density inversion in DensityFromP (exact for
+Murnaghan, safeguarded Newton from a Murnaghan guess for BM3 and Vinet), of the shell loops in
+solve_adams_williamson, and a fused per-planet solve loop that follows the same fixed-point iteration as
+looped_solver.Solver.
+
+Two interchangeable backends provide these kernels:
+- 'numba': nopython-compiled scalar loops, including the whole per-planet solve (requires numba).
+- 'numpy': vectorized NumPy, always available and used as the fallback when numba is not installed.
+
+The backend can be chosen per call (backend='numpy') or for the whole session with set_backend().
+Both backends run the same algorithms as the pure-Python path, so results agree with Solver to within
+the pressure threshold of DensityFromP.
+
+Usage:
+    import eos_kernels as ek
+    profile = ek.solve_planet(radii_list, dct.planetary_dictionary(1, 0.3, 0.5))
+    profile.pressure, profile.gravity, profile.converged
+"""
+
+from importlib.util import find_spec
+
+import numpy as np
+
+import EoS_Bits as EOS
+import divergence
+import instrumentation as inst
+import quadrature
+from planet_profile import PlanetProfile
+
+G = 6.6743015 / (10 ** 11)
+
+FORMS = {'bm3': 0, 'vinet': 1, 'murnaghan': 2}
+#Integer codes for each equation of state, as used in the phase tables.
+
+LAYER_PHASES = [
+    [(np.inf, [(1.0, 'Fe93Si7')])],
+    [(2.5 * (10 ** 9), [(EOS.part_Mg2SiO4, 'forsterite'), (EOS.part_SiO2, 'quartz')]),
+     (8 * (10 ** 9), [(EOS.part_Mg2SiO4, 'forsterite'), (EOS.part_SiO2, 'coesite')]),
+     (14 * (10 ** 9), [(EOS.part_Mg2SiO4, 'forsterite'), (EOS.part_SiO2, 'stichovite')]),
+     (18 * (10 ** 9), [(EOS.part_Mg2SiO4, 'wadsleyite'), (EOS.part_SiO2, 'stichovite')]),
+     (23 * (10 ** 9), [(EOS.part_Mg2SiO4, 'ringwoodite'), (EOS.part_SiO2, 'stichovite')]),
+     (120 * (10 ** 9), [(1.0, 'bridgmanite')]),
+     (np.inf, [(1.0, 'ppv')])],
+    [(1 * (10 ** 9), [(1.0, 'Ih')]),
+     (2.1 * (10 ** 9), [(1.0, 'VI')]),
+     (np.inf, [(1.0, 'VII')])]
+]
+#For each layer (core, mantle, ice): the phases in order of increasing pressure, each given as
+#(upper pressure bound in Pa, [(mass fraction, phase name), ...]). Mirrors CoreDensity, RockDensity and IceDensity.
+
+MAX_COMPONENTS = 2
+
+NO_CAP = np.iinfo(np.int64).max
+#Step cap of the compiled inversions when no tolerance policy is given.
+
+
+def material_params(params=None):
+    """
+    Returns the EoS parameters of every phase, keyed by phase name, with optional overrides applied.
+
+    Parameters:
+    params (dict, optional): Overrides keyed by phase name, eg: {'VII': {'B0': 15.5 * (10 ** 9)}}.
+                             Unspecified phases and parameters keep their EoS_Bits values.
+
+    Returns:
+    dict: A dictionary mapping each phase name to a dictionary of rho0, B0, B1 and form.
+    """
+    phases = {**EOS.core_params, **EOS.rock_params, **EOS.ice_params}
+    merged = {name: dict(values) for name, values in phases.items()}
+    for name, values in (params or {}).items():
+        if name not in merged:
+            raise KeyError(f"Unknown phase '{name}'.")
+        merged[name].update(values)
+    return(merged)
+
+
+def phase_tables(params=None):
+    """
+    Flattens LAYER_PHASES and the phase parameters into the arrays consumed by the kernels.
+
+    Parameters:
+    params (dict, optional): Phase parameter overrides, as accepted by material_params().
+
+    Returns:
+    tuple: (layer_start, p_max, weight, rho0, B0, B1, form) where layer_start[l]:layer_start[l + 1] indexes
+           the phases of layer l, p_max holds each phase's upper pressure bound, and the remaining arrays
+           have shape (number of phases, MAX_COMPONENTS) with unused components given zero weight.
+    """
+    phases = material_params(params)
+    rows = [phase for layer in LAYER_PHASES for phase in layer]
+    layer_start = np.cumsum([0] + [len(layer) for layer in LAYER_PHASES])
+    p_max = np.array([bound for bound, _ in rows], dtype=float)
+    weight = np.zeros((len(rows), MAX_COMPONENTS))
+    rho0 = np.ones((len(rows), MAX_COMPONENTS))
+    B0 = np.ones((len(rows), MAX_COMPONENTS))
+    B1 = np.ones((len(rows), MAX_COMPONENTS))
+    form = np.zeros((len(rows), MAX_COMPONENTS), dtype=np.int64)
+    for i, (_, components) in enumerate(rows):
+        for c, (fraction, name) in enumerate(components):
+            weight[i, c] = fraction
+            rho0[i, c] = phases[name]['rho0']
+            B0[i, c] = phases[name]['B0']
+            B1[i, c] = phases[name]['B1']
+            form[i, c] = FORMS[phases[name]['form'].lower()]
+    return(layer_start, p_max, weight, rho0, B0, B1, form)
+
+
+def layer_indices(radii_list, insert_dict):
+    """
+    Assigns each radius to a layer of insert_dict the same way Solver does.
+
+    The outermost cutoff is taken to be the largest radius in radii_list, as Solver enforces.
+
+    Parameters:
+    radii_list (list): Radial distances from the center of the planet (m).
+    insert_dict (dict): Planet composition dictionary from planetary_dictionary().
+
+    Returns:
+    tuple: (layer, initial_densities), two arrays giving each radius's layer index (0 core, 1 mantle, 2 ice)
+           and the layer's preliminary density guess.
+    """
+    radii = np.asarray(radii_list)
+    cutoffs = np.array([*insert_dict.keys()], dtype=float)
+    cutoffs[-1] = int(max(radii_list))
+    layer = np.searchsorted(cutoffs, radii, side='left')
+    guesses = np.array([int(value[0]) for value in insert_dict.values()], dtype=float)
+    return(layer, guesses[layer])
+
+
+def _inversion_args(policy):
+    #Relative tolerance (0 for the absolute threshold) and step cap of the compiled inversions.
+    if policy is None:
+        return(0.0, NO_CAP)
+    return(policy.inversion_rtol, policy.max_inversion_steps)
+
+
+# NumPy backend
+
+def _np_pressure(form, rho, rho0, B0, B1):
+    if form == 0:
+        return EOS.BM3(rho, rho0, B0, B1)
+    if form == 1:
+        return EOS.Vinet(rho, rho0, B0, B1)
+    return EOS.Murnaghan(rho, rho0, B0, B1)
+
+
+def _np_slope(form, rho, rho0, B0, B1):
+    if form == 0:
+        return EOS.BM3Slope(rho, rho0, B0, B1)
+    if form == 1:
+        return EOS.VinetSlope(rho, rho0, B0, B1)
+    return EOS.MurnaghanSlope(rho, rho0, B0, B1)
+
+
+def _np_density_from_p(P, rho0, B0, B1, form, thresh=0.01, policy=None):
+    P = np.asarray(P, dtype=float)
+    with np.errstate(invalid='ignore'):
+        rho_guess = np.asarray(EOS.MurnaghanDensity(P, rho0, B0, B1), dtype=float).copy()
+    if form == 2:
+        if inst.active is not None:
+            inst.active.add('density_from_p_calls', P.size)
+        return(rho_guess)
+    rho_guess[~np.isfinite(rho_guess)] = 0.9 * rho0
+
+    #Safeguarded Newton on every element independently, dropping elements from the working set as they
+    #converge. Steps that leave the bracket [rho_lower, rho_upper] bisect it instead (or double rho_lower
+    #while no upper bound is known), as in EoS_Bits.DensityFromP.
+    rho_lower = np.where(P >= 0, rho0, 0.0)
+    rho_upper = np.where(P >= 0, np.inf, rho0)
+    live = np.arange(P.size)
+    steps = 0
+    iteration = 0
+    while live.size:
+        P_guess = _np_pressure(form, rho_guess[live], rho0, B0, B1)
+        slope = _np_slope(form, rho_guess[live], rho0, B0, B1)
+        tolerance = thresh if policy is None else policy.pressure_tolerance(rho_guess[live], slope)
+        keep = np.abs(P[live] - P_guess) >= tolerance
+        live, P_guess, slope = live[keep], P_guess[keep], slope[keep]
+        too_high = P_guess > P[live]
+        rho_upper[live[too_high]] = rho_guess[live[too_high]]
+        rho_lower[live[~too_high]] = rho_guess[live[~too_high]]
+        upper = rho_upper[live]
+        keep = np.isinf(upper) | (upper - rho_lower[live] > 4 * np.finfo(float).eps * upper)
+        live, P_guess, slope = live[keep], P_guess[keep], slope[keep]
+        if policy is not None and iteration >= policy.max_inversion_steps and live.size:
+            policy.exceed('inversion', live.size)
+            break
+        iteration += 1
+        steps += live.size
+
+        lower, upper = rho_lower[live], rho_upper[live]
+        rho_next = rho_guess[live] - (P_guess - P[live]) / slope
+        outside = ~((rho_next > lower) & (rho_next < upper))
+        rho_next[outside] = np.where(np.isinf(upper[outside]), 2 * lower[outside],
+                                     (upper[outside] + lower[outside]) / 2)
+        rho_guess[live] = rho_next
+
+    if inst.active is not None:
+        inst.active.add('density_from_p_calls', P.size)
+        inst.active.add('newton_iterations', steps)
+    return(rho_guess)
+
+
+def _np_adams_williamson(radii, densities):
+    step_size = radii[1] - radii[0]
+    shell_mass = 4 * np.pi * (radii ** 2) * step_size * densities
+    integrand = (G * np.cumsum(shell_mass) * densities) / (radii ** 2)
+    total_pressure = np.cumsum(integrand * step_size)
+    return(integrand / densities, total_pressure[-1] - total_pressure)
+
+
+def _np_density_step(pressures, layer, tables, policy=None):
+    layer_start, p_max, weight, rho0, B0, B1, form = tables
+    densities = np.zeros(pressures.shape)
+    new_pressures = np.zeros(pressures.shape)
+    for l in range(len(layer_start) - 1):
+        in_layer = layer == l
+        p_min = -np.inf
+        for i in range(layer_start[l], layer_start[l + 1]):
+            mask = in_layer & (pressures >= p_min) & (pressures < p_max[i])
+            p_min = p_max[i]
+            if not mask.any():
+                continue
+            rho = 0.0
+            for c in range(MAX_COMPONENTS):
+                if weight[i, c] > 0:
+                    rho = rho + weight[i, c] * _np_density_from_p(pressures[mask], rho0[i, c], B0[i, c], B1[i, c],
+                                                                  form[i, c], policy=policy)
+            pressure = 0.0
+            for c in range(MAX_COMPONENTS):
+                if weight[i, c] > 0:
+                    pressure = pressure + weight[i, c] * _np_pressure(form[i, c], rho, rho0[i, c], B0[i, c], B1[i, c])
+            densities[mask] = rho
+            new_pressures[mask] = pressure
+    return(densities, new_pressures)
+
+
+def _np_solve(radii, layer, densities, tables, discrepancy, max_calls, min_calls, check_shells=1000,
+              integrate=_np_adams_williamson, density_step=_np_density_step, damping=1.0, policy=None):
+    monitor = divergence.ResidualMonitor()
+    calls = 1
+    while calls <= max_calls:
+        with inst.stage('adams_williamson'):
+            gravities, pressures = integrate(radii, densities)
+        capped = 0 if policy is None else policy.exceeded['inversion']
+        with inst.stage('eos'):
+            new_densities, new_pressures = density_step(pressures, layer, tables, policy)
+        update = new_densities - densities
+        tolerance = discrepancy if policy is None else policy.density_tolerance(new_densities[:check_shells])
+        if calls >= min_calls and np.all(np.abs(update)[:check_shells] < tolerance):
+            if policy is not None and policy.exceeded['inversion'] > capped:
+                return(new_densities, None, None, calls, monitor.failure('inversion_cap', calls, damping))
+            return(new_densities, new_pressures, gravities, calls, None)
+        reason, damping = divergence.respond(monitor, monitor.update(update[:check_shells]), damping)
+        if reason is not None:
+            return(densities, None, None, calls, monitor.failure(reason, calls, damping))
+        densities = new_densities if damping == 1 else densities + damping * update
+        calls += 1
+    if policy is not None:
+        policy.exceed('solver')
+    return(densities, None, None, max_calls, monitor.failure('max_iterations', max_calls, damping))
+
+
+def _nb_solve(radii, layer, densities, tables, discrepancy, max_calls, min_calls, check_shells, damping=1.0,
+              policy=None):
+    #The compiled solve runs divergence.WINDOW iterations at a time, so that the monitor can stop it early. The
+    #iterations of a chunk after the one the monitor flags are discarded, so failures and damped retries start
+    #from the same iteration, with the same densities, as in _np_solve.
+    monitor = divergence.ResidualMonitor()
+    residuals = np.zeros(divergence.WINDOW)
+    alignments = np.zeros(divergence.WINDOW)
+    previous = np.zeros(min(check_shells, densities.size))
+    history = np.zeros((divergence.WINDOW, densities.size))
+    proposals = np.zeros((divergence.WINDOW, densities.size))
+    counts = np.zeros((divergence.WINDOW, 2), dtype=np.int64)
+
+    def count(steps, capped):
+        if inst.active is not None:
+            inst.active.add('newton_iterations', int(steps))
+        if policy is not None:
+            policy.exceed('inversion', int(capped))
+
+    calls = 0
+    while calls < max_calls:
+        chunk = min(divergence.WINDOW, max_calls - calls)
+        with inst.stage('fused_solve'):
+            densities, pressures, gravities, done, steps, capped, final_capped = _nb.solve(
+                radii, layer, densities, *tables, discrepancy, chunk, max(min_calls - calls, 1), check_shells,
+                damping, residuals, alignments, previous, history, proposals, counts,
+                0.0 if policy is None else policy.rtol, *_inversion_args(policy))
+        #The monitor judges every iteration before the converged one, as in _np_solve, so a flag raised earlier
+        #in the chunk still stops or retries the solve.
+        unconverged = done - 1 if done > 0 else chunk
+        used, reason, retry_damping, flagged = unconverged, None, damping, False
+        for k in range(unconverged):
+            reason, retry_damping = divergence.respond(monitor, monitor.record(residuals[k], alignments[k]), damping)
+            if reason is not None or retry_damping != damping:
+                used, flagged = k + 1, True
+                break
+        if done > 0 and not flagged:
+            count(steps, capped)
+            if final_capped:
+                return(densities, None, None, calls + done, monitor.failure('inversion_cap', calls + done, damping))
+            return(densities, pressures, gravities, calls + done, None)
+        count(*counts[:used].sum(axis=0))
+        if reason is not None:
+            return(history[used - 1], None, None, calls + used, monitor.failure(reason, calls + used, damping))
+        if retry_damping != damping:
+            #Roll back to the flagged iteration and apply its update damped, as _np_solve does.
+            densities = history[used - 1] + retry_damping * (proposals[used - 1] - history[used - 1])
+            damping = retry_damping
+            previous[:] = 0
+        calls += used
+    if policy is not None:
+        policy.exceed('solver')
+    return(densities, None, None, max_calls, monitor.failure('max_iterations', max_calls, damping))
+
+
+# Backend selection
+
+_numba_installed = find_spec('numba') is not None
+_nb = None
+#The numba_kernels module, imported the first time the numba backend is used.
+
+backend = 'numba' if _numba_installed else 'numpy'
+#Backend used when a kernel is called without an explicit backend.
+
+
+def available_backends():
+    """Returns a list of the kernel backends that can be used in this environment."""
+    return(['numba', 'numpy'] if _numba_installed else ['numpy'])
+
+
+def set_backend(name):
+    """
+    Selects the backend used by the kernels in this module when none is given explicitly.
+
+    Parameters:
+    name (str): 'numba' or 'numpy'.
+    """
+    global backend
+    if name not in available_backends():
+        raise ValueError(f"Backend '{name}' is not available; choose from {available_backends()}.")
+    backend = name
+
+
+def _resolve(name):
+    global _nb
+    name = backend if name is None else name
+    if name not in available_backends():
+        raise ValueError(f"Backend '{name}' is not available; choose from {available_backends()}.")
+    if name == 'numba' and _nb is None:
+        import numba_kernels
+        _nb = numba_kernels
+    return(name)
+
+
+def pressure(rho, rho0, B0, B1, form):
+    """
+    Calculates pressure from density for an array of densities with one EoS.
+
+    Parameters:
+    rho (array): Densities (kg/m^3).
+    rho0 (float): Initial (zero-pressure) density (kg/m^3).
+    B0 (float): Bulk modulus at zero pressure (Pa).
+    B1 (float): Pressure derivative of the bulk modulus.
+    form (str): Name of the equation of state ('bm3', 'vinet', or 'murnaghan').
+
+    Returns:
+    array: Pressures corresponding to rho (Pa).
+    """
+    return(_np_pressure(FORMS[form.lower()], np.asarray(rho, dtype=float), rho0, B0, B1))
+
+
+def density_from_p(P, rho0, B0, B1, form, thresh=0.01, backend=None, policy=None):
+    """
+    Array version of EoS_Bits.DensityFromP: inverts one EoS for every pressure in P.
+
+    Parameters:
+    P (array): Pressures (Pa).
+    rho0 (float): Initial (zero-pressure) density (kg/m^3).
+    B0 (float): Zero pressure bulk modulus (Pa).
+    B1 (float): Pressure derivative of the bulk modulus.
+    form (str): Name of the equation of state ('bm3', 'vinet', or 'murnaghan').
+    thresh (float, optional): Convergence threshold for pressure (Pa). Default is 0.01 Pa.
+    backend (str, optional): 'numba' or 'numpy'. Defaults to the module-wide backend.
+    policy (TolerancePolicy, optional): Relative tolerance and step cap replacing thresh, as in DensityFromP.
+
+    Returns:
+    array: Densities at pressures P (kg/m^3).
+    """
+    P = np.asarray(P, dtype=float)
+    if _resolve(backend) == 'numba':
+        rho, steps, capped = _nb.density_from_p(P.ravel(), float(rho0), float(B0), float(B1), FORMS[form.lower()],
+                                                thresh, *_inversion_args(policy))
+        if inst.active is not None:
+            inst.active.add('density_from_p_calls', P.size)
+            inst.active.add('newton_iterations', steps)
+        if policy is not None:
+            policy.exceed('inversion', capped)
+        return(rho.reshape(P.shape))
+    return(_np_density_from_p(P, rho0, B0, B1, FORMS[form.lower()], thresh, policy))
+
+
+def adams_williamson(rad, local_densities, backend=None, quadrature_rule='rectangle', cutoffs=None):
+    """
+    Array version of solve_adams_williamson.adams_williamson.
+
+    Parameters:
+    rad (array): Evenly spaced radii at which to calculate gravity and pressure (m).
+    local_densities (array): Densities corresponding to each radius in rad (kg/m^3).
+    backend (str, optional): 'numba' or 'numpy'. Defaults to the module-wide backend.
+    quadrature_rule (str, optional): One of quadrature.METHODS. Defaults to 'rectangle'. The higher-order
+                                     rules are vectorized NumPy on either backend.
+    cutoffs (list, optional): Outer radius of each layer, where the density may jump.
+
+    Returns:
+    tuple: Two arrays, the gravity (m/s^2) and the pressure (Pa) at each radius.
+    """
+    radii = np.asarray(rad, dtype=float)
+    densities = np.asarray(local_densities, dtype=float)
+    if quadrature_rule != 'rectangle':
+        return(quadrature.adams_williamson(radii, densities, quadrature_rule, cutoffs))
+    if _resolve(backend) == 'numba':
+        return(_nb.adams_williamson(radii, densities))
+    return(_np_adams_williamson(radii, densities))
+
+
+def layer_densities(pressures, layer, params=None):
+    """
+    Evaluates the layer materials at given pressures, as one EoS pass of Solver does.
+
+    Parameters:
+    pressures (array): Pressures (Pa).
+    layer (array): Layer index of each pressure (0 core, 1 mantle, 2 ice).
+    params (dict, optional): Phase parameter overrides, as accepted by material_params().
+
+    Returns:
+    array: Densities of the (mixed) phase stable at each pressure (kg/m^3).
+    """
+    pressures = np.asarray(pressures, dtype=float)
+    return(_np_density_step(pressures, np.asarray(layer), phase_tables(params))[0])
+
+
+def _nb_density_step(pressures, layer, tables, policy=None):
+    densities, new_pressures, steps, capped = _nb.density_step(pressures, layer, *tables, 0.01,
+                                                               *_inversion_args(policy))
+    if inst.active is not None:
+        inst.active.add('newton_iterations', steps)
+    if policy is not None:
+        policy.exceed('inversion', capped)
+    return(densities, new_pressures)
+
+
+def solve_planet(radii_list, insert_dict, density_list=None, discrepancy=10, max_calls=2000, min_calls=1,
+                 params=None, backend=None, quadrature_rule='rectangle', check_shells=1000, damping=1.0, policy=None):
+    '''
+    Fused equivalent of looped_solver.Solver: iterates Adams-Williamson pressures and EoS densities
+    until the densities are self-consistent.
+
+    Parameters:
+    radii_list (list): Evenly spaced radial distances from the center of the planet (in meters).
+    insert_dict (dict): A dictionary specifying the planet's compositional layers, eg: from planetary_dictionary().
+                        Unlike Solver, the dictionary is not modified.
+    density_list (list, optional): Initial density guesses at each radius, eg: a converged profile of a similar
+                                   planet. Defaults to the preliminary densities in insert_dict.
+    discrepancy (float, optional): The convergence threshold for density in kg/m^3. Defaults to 10.
+    max_calls (int, optional): Maximum number of iterations. Defaults to 2000, as in Solver.
+    min_calls (int, optional): Minimum number of iterations. Defaults to 1. When warm-starting from a converged
+                               profile, use 2 or more: the pressures of the first iteration are still those of
+                               density_list, so they do not yet reflect any change in params.
+    params (dict, optional): Phase parameter overrides, as accepted by material_params().
+    backend (str, optional): 'numba' or 'numpy'. Defaults to the module-wide backend.
+    quadrature_rule (str, optional): Radial integration rule, one of quadrature.METHODS. Defaults to 'rectangle',
+                                     as in Solver. With the other rules, the integration runs in NumPy and only
+                                     the EoS step uses the numba backend.
+    check_shells (int, optional): Number of innermost shells whose densities must agree to within discrepancy,
+                                  1000 as in Solver. None checks every shell, which finer grids need.
+    damping (float, optional): Fraction of each density update applied, as in Solver. Defaults to 1. Planets that
+                               oscillate, stagnate or diverge are retried once with damping (see divergence.py).
+    policy (TolerancePolicy, optional): Relative convergence target and iteration caps replacing discrepancy and
+                                        max_calls, from which the tolerance of the EoS inversions is derived,
+                                        as in Solver. Defaults to None.
+
+    Returns:
+        PlanetProfile: As returned by Solver, with the density (kg/m^3), pressure (Pa), gravity (m/s^2) and
+        layer index at each radius. If the densities do not converge, converged is False, pressure and
+        gravity are nan and failure holds a divergence.SolveFailure record.
+    '''
+    radii = np.asarray(radii_list, dtype=float)
+    layer, densities = layer_indices(radii_list, insert_dict)
+    if density_list is not None:
+        densities = np.array(density_list, dtype=float)
+    tables = phase_tables(params)
+
+    check_shells = radii.size if check_shells is None else check_shells
+    if policy is not None:
+        max_calls = policy.max_iterations
+
+    if quadrature_rule != 'rectangle':
+        cutoffs = [*insert_dict.keys()]
+        density_step = _nb_density_step if _resolve(backend) == 'numba' else _np_density_step
+        densities, pressures, gravities, calls, failure = _np_solve(
+            radii, layer, densities, tables, discrepancy, max_calls, min_calls, check_shells,
+            lambda r, rho: quadrature.adams_williamson(r, rho, quadrature_rule, cutoffs), density_step, damping,
+            policy)
+    elif _resolve(backend) == 'numba':
+        densities, pressures, gravities, calls, failure = _nb_solve(radii, layer, densities, tables, discrepancy,
+                                                                    max_calls, min_calls, check_shells, damping,
+                                                                    policy)
+    else:
+        densities, pressures, gravities, calls, failure = _np_solve(radii, layer, densities, tables, discrepancy,
+                                                                    max_calls, min_calls, check_shells,
+                                                                    damping=damping, policy=policy)
+
+    inst.add('solver_iterations', calls)
+    if failure is not None:
+        return(PlanetProfile.failed(radii, densities, layer, calls, failure))
+    return(PlanetProfile(radii, densities, pressures, gravities, layer, converged=True, iterations=calls))
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+EoS Parameter Uncertainty Propagation
+
+Propagates uncertainties in the phase parameters of EoS_Bits (rho0, B0, B1 of each phase) to the maximum
+pressure in the ice layer of a planet, and so to its diamond precipitation candidacy.
+
+Two estimates are available:
+- ensemble(): Monte Carlo sampling of the parameters, reporting the spread of max ice pressure and the
+  fraction of samples that remain candidates.
+- sensitivities(): central finite-difference derivatives of max ice pressure with respect to each parameter,
+  combined linearly into a one-sigma error bar.
+
+Every perturbed planet is solved with eos_kernels.solve_planet, warm-started from the converged profile of the
+nominal planet, so each perturbation only needs the few iterations that take it from the nominal solution to
+its own (at least two, so that the returned pressures reflect the perturbed densities). Perturbed solves are
+independent and run in parallel worker processes. If the nominal planet does not converge there is nothing to
+warm-start from, and both estimates raise divergence.SolverDiverged.
+
+Usage:
+    import eos_uncertainty as unc
+    summary = unc.ensemble(0.8, 0.5, n_samples=200, phases=['VI', 'VII'])
+    summary['max_p_std'], summary['candidate_fraction']
+"""
+
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import criteria
+import divergence
+import eos_kernels as ek
+import planetary_dictionary as dct
+
+r_earth = 6370 * (10 ** 3)
+
+DEFAULT_RELATIVE_UNCERTAINTY = {'rho0': 0.01, 'B0': 0.05, 'B1': 0.1}
+#One-sigma uncertainty of each parameter as a fraction of its nominal value, used for any phase without an
+#entry in the uncertainties argument. These are generic placeholders; pass literature values where known.
+
+
+def nominal_profile(rand_earth, rand_ice, discrepancy=10, backend=None):
+    """
+    Builds and solves the nominal (unperturbed) planet in the same way as monte_carlo.evaluate_planet().
+
+    Parameters:
+    rand_earth (float): Planet radius in Earth radii.
+    rand_ice (float): Fractional depth of the ice layer; the rest is split equally between core and mantle.
+    discrepancy (float, optional): The convergence threshold for density in kg/m^3. Defaults to 10.
+    backend (str, optional): eos_kernels backend. Defaults to the module-wide backend.
+
+    Returns:
+    tuple: (radii_list, insert_dict, profile), profile being the PlanetProfile of the nominal planet.
+
+    Raises:
+    divergence.SolverDiverged: If the nominal planet does not converge, since every perturbed solve is warm-started
+                               from its densities.
+    """
+    radius = rand_earth * r_earth
+    radii_list = [*range(1, int(radius), int(radius / 1000))]
+    insert_dict = dct.planetary_dictionary(rand_earth, 0.5 * (1 - rand_ice), 0.5 * (1 - rand_ice))
+    profile = divergence.check(ek.solve_planet(radii_list, insert_dict, discrepancy=discrepancy, backend=backend))
+    return(radii_list, insert_dict, profile)
+
+
+def max_ice_pressure(insert_dict, profile):
+    """Returns the maximum pressure (Pa) at or beyond the mantle-ice boundary, or nan if the solve failed."""
+    if not profile.converged:
+        return(np.nan)
+    return(float(profile.pressure[profile.radius >= list(insert_dict.keys())[1]].max()))
+
+
+def uncertainty_table(phases=None, uncertainties=None):
+    """
+    Returns the one-sigma uncertainty of every perturbed parameter.
+
+    Parameters:
+    phases (list, optional): Names of the phases to perturb (eg: ['VII', 'bridgmanite']). Defaults to all phases.
+    uncertainties (dict, optional): Absolute one-sigma values keyed by phase then parameter,
+                                    eg: {'VII': {'B0': 1 * (10 ** 9), 'B1': 0.3}}.
+                                    Missing values fall back to DEFAULT_RELATIVE_UNCERTAINTY.
+
+    Returns:
+    dict: A dictionary mapping (phase, parameter) to its one-sigma uncertainty.
+    """
+    nominal = ek.material_params()
+    phases = list(nominal.keys()) if phases is None else phases
+    uncertainties = uncertainties or {}
+    table = {}
+    for phase in phases:
+        for parameter, fraction in DEFAULT_RELATIVE_UNCERTAINTY.items():
+            table[(phase, parameter)] = uncertainties.get(phase, {}).get(parameter, fraction * nominal[phase][parameter])
+    return(table)
+
+
+def _solve_perturbed(task):
+    radii_list, insert_dict, density_list, params, discrepancy, backend = task
+    profile = ek.solve_planet(radii_list, insert_dict, density_list=density_list, discrepancy=discrepancy,
+                              min_calls=2, params=params, backend=backend)
+    return(max_ice_pressure(insert_dict, profile))
+
+
+def _run(tasks, processes):
+    if processes == 1:
+        return(np.array([_solve_perturbed(task) for task in tasks]))
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return(np.array(list(pool.map(_solve_perturbed, tasks, chunksize=max(1, len(tasks) // 64)))))
+
+
+def ensemble(rand_earth, rand_ice, n_samples=100, phases=None, uncertainties=None, seed=None, discrepancy=1,
+             processes=None, backend=None):
+    """
+    Samples the phase parameters from independent normal distributions and solves the planet for each sample.
+
+    Parameters:
+    rand_earth (float): Planet radius in Earth radii.
+    rand_ice (float): Fractional depth of the ice layer.
+    n_samples (int, optional): Number of parameter samples. Defaults to 100.
+    phases (list, optional): Names of the phases to perturb. Defaults to all phases.
+    uncertainties (dict, optional): Absolute one-sigma values, as accepted by uncertainty_table().
+    seed (int, optional): Seed for the parameter samples, for reproducible ensembles.
+    discrepancy (float, optional): The convergence threshold for density in kg/m^3. Defaults to 1.
+    processes (int, optional): Number of worker processes; 1 solves in this process. Defaults to one per CPU.
+    backend (str, optional): eos_kernels backend. Defaults to the module-wide backend.
+
+    Returns:
+    dict: Summary of the ensemble with keys
+        - 'nominal_max_p': max ice pressure of the nominal planet (Pa)
+        - 'max_p': array of max ice pressure for each sample (Pa; nan where a solve did not converge)
+        - 'max_p_mean', 'max_p_std': mean and standard deviation over the converged samples (Pa)
+        - 'max_p_percentiles': dictionary of the 2.5, 16, 50, 84 and 97.5th percentiles (Pa)
+        - 'candidate_fraction': fraction of converged samples that are criteria.DIAMOND candidates (max_p >= 10 GPa)
+        - 'failed': number of samples that did not converge
+    """
+    radii_list, insert_dict, profile = nominal_profile(rand_earth, rand_ice, discrepancy, backend)
+    nominal = ek.material_params()
+    sigmas = uncertainty_table(phases, uncertainties)
+
+    rng = random.Random(seed)
+    tasks = []
+    for _ in range(n_samples):
+        params = {}
+        for (phase, parameter), sigma in sigmas.items():
+            params.setdefault(phase, {})[parameter] = rng.gauss(nominal[phase][parameter], sigma)
+        tasks.append((radii_list, insert_dict, profile.density, params, discrepancy, backend))
+
+    max_p = _run(tasks, processes)
+    converged = max_p[~np.isnan(max_p)]
+    percentiles = [2.5, 16, 50, 84, 97.5]
+    return({
+        'nominal_max_p': max_ice_pressure(insert_dict, profile),
+        'max_p': max_p,
+        'max_p_mean': float(np.mean(converged)) if converged.size else np.nan,
+        'max_p_std': float(np.std(converged, ddof=1)) if converged.size > 1 else np.nan,
+        'max_p_percentiles': dict(zip(percentiles, np.percentile(converged, percentiles))) if converged.size else {},
+        'candidate_fraction': float(np.mean(criteria.DIAMOND.candidate(converged))) if converged.size else np.nan,
+        'failed': int(np.sum(np.isnan(max_p)))
+    })
+
+
+def sensitivities(rand_earth, rand_ice, phases=None, uncertainties=None, relative_step=0.01, discrepancy=1,
+                  processes=None, backend=None):
+    """
+    Estimates the derivative of max ice pressure with respect to each phase parameter by central differences.
+
+    The density threshold defaults to 1 kg/m^3 (rather than Solver's 10) so that the solver tolerance is
+    small compared with the density change caused by a step of relative_step. ensemble() uses the same default.
+
+    Parameters:
+    rand_earth (float): Planet radius in Earth radii.
+    rand_ice (float): Fractional depth of the ice layer.
+    phases (list, optional): Names of the phases to perturb. Defaults to all phases.
+    uncertainties (dict, optional): Absolute one-sigma values, as accepted by uncertainty_table().
+    relative_step (float, optional): Finite-difference step as a fraction of each nominal value. Defaults to 0.01.
+    discrepancy (float, optional): The convergence threshold for density in kg/m^3. Defaults to 1.
+    processes (int, optional): Number of worker processes; 1 solves in this process. Defaults to one per CPU.
+    backend (str, optional): eos_kernels backend. Defaults to the module-wide backend.
+
+    Returns:
+    dict: Summary with keys
+        - 'nominal_max_p': max ice pressure of the nominal planet (Pa)
+        - 'derivatives': dictionary mapping (phase, parameter) to d(max_p)/d(parameter)
+        - 'contributions': dictionary mapping (phase, parameter) to |derivative| * sigma (Pa)
+        - 'max_p_sigma': linearized one-sigma uncertainty of max_p, the contributions added in quadrature (Pa);
+          nan if any derivative is missing
+        - 'failed': number of derivatives left nan because one of their perturbed solves did not converge
+    """
+    radii_list, insert_dict, profile = nominal_profile(rand_earth, rand_ice, discrepancy, backend)
+    nominal = ek.material_params()
+    sigmas = uncertainty_table(phases, uncertainties)
+
+    keys = list(sigmas.keys())
+    tasks = []
+    for phase, parameter in keys:
+        step = relative_step * nominal[phase][parameter]
+        for sign in (1, -1):
+            params = {phase: {parameter: nominal[phase][parameter] + sign * step}}
+            tasks.append((radii_list, insert_dict, profile.density, params, discrepancy, backend))
+
+    max_p = _run(tasks, processes)
+    derivatives = {}
+    contributions = {}
+    for k, (phase, parameter) in enumerate(keys):
+        step = relative_step * nominal[phase][parameter]
+        derivatives[(phase, parameter)] = (max_p[2 * k] - max_p[2 * k + 1]) / (2 * step)
+        contributions[(phase, parameter)] = abs(derivatives[(phase, parameter)]) * sigmas[(phase, parameter)]
+    return({
+        'nominal_max_p': max_ice_pressure(insert_dict, profile),
+        'derivatives': derivatives,
+        'contributions': contributions,
+        'max_p_sigma': float(np.sqrt(np.sum(np.square(list(contributions.values()))))),
+        'failed': int(np.sum(np.isnan(list(derivatives.values()))))
+    })
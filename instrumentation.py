@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Solver Instrumentation
+
+Opt-in call counters and per-stage wall-clock timers for the solver pipeline. Nothing is recorded
+unless an Instrumentation object is active, so the hooks in EoS_Bits and looped_solver cost a single
+attribute check when instrumentation is disabled.
+
+Usage:
+    import instrumentation as inst
+
+    with inst.Instrumentation() as stats:
+        with stats.planet(rand_earth=1.0, rand_ice=0.5):
+            looped_solver.Solver(radii_list, insert_dict)
+
+    stats.planets   # one dictionary of counters and timers per planet
+    stats.totals    # the same counters summed over the whole run
+
+Counters:
+- density_from_p_calls: number of calls to EoS_Bits.DensityFromP
+- bracket_iterations: bracket-widening (doubling) steps taken inside DensityFromP
+- bisection_iterations: safeguard bisection steps taken inside DensityFromP
+- newton_iterations: Newton steps taken inside DensityFromP (in eos_kernels, every step, safeguarded or not)
+- solver_iterations: fixed-point iterations (Adams-Williamson passes) taken by Solver
+- adams_williamson_time, eos_time: wall time (s) spent in each Solver stage
+- fused_solve_time: wall time (s) spent in the compiled per-planet solve of eos_kernels
+- wall_time: wall time (s) of the whole planet (per-planet records only)
+"""
+
+import time
+from contextlib import contextmanager, nullcontext
+
+active = None
+#The Instrumentation object currently recording, or None when instrumentation is disabled.
+
+COUNTERS = ['density_from_p_calls', 'bracket_iterations', 'bisection_iterations', 'newton_iterations',
+            'solver_iterations', 'adams_williamson_time', 'eos_time', 'fused_solve_time', 'wall_time']
+#Column order used when writing counters next to results.
+
+_null_stage = nullcontext()
+
+
+class Instrumentation:
+    """
+    Collects counters and stage timers while active, aggregated per planet and per run.
+
+    Attributes:
+    planets (list): One dictionary per completed planet() block holding its labels, counters and timers.
+    totals (dict): Counters and timers summed over everything recorded while active.
+    """
+
+    def __init__(self):
+        self.planets = []
+        self.totals = dict.fromkeys(COUNTERS, 0)
+        self._current = None
+        self._previous = None
+
+    def __enter__(self):
+        global active
+        self._previous = active
+        active = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global active
+        active = self._previous
+        return False
+
+    def add(self, name, amount=1):
+        """
+        Adds amount to the counter called name for the current planet (if any) and the run totals.
+
+        Parameters:
+        name (str): Name of the counter.
+        amount (float, optional): Amount to add. Defaults to 1.
+        """
+        self.totals[name] = self.totals.get(name, 0) + amount
+        if self._current is not None:
+            self._current[name] = self._current.get(name, 0) + amount
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager adding the wall time spent inside the block to the counter '<name>_time'."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f'{name}_time', time.perf_counter() - start)
+
+    @contextmanager
+    def planet(self, **labels):
+        """
+        Context manager grouping everything recorded inside the block into a single per-planet record.
+
+        Parameters:
+        **labels: Values identifying the planet (eg: sampled radius and ice fraction), stored in the record.
+
+        Yields:
+        dict: The per-planet record, which is complete once the block exits.
+        """
+        record = dict(labels)
+        record.update(dict.fromkeys(COUNTERS, 0))
+        outer = self._current
+        self._current = record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['wall_time'] = time.perf_counter() - start
+            self.totals['wall_time'] += record['wall_time']
+            self._current = outer
+            self.planets.append(record)
+
+
+def add(name, amount=1):
+    """Adds amount to the counter called name if instrumentation is active; otherwise does nothing."""
+    if active is not None:
+        active.add(name, amount)
+
+
+def stage(name):
+    """Returns a context manager timing a solver stage if instrumentation is active, else a no-op context."""
+    if active is None:
+        return _null_stage
+    return active.stage(name)
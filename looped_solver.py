@@ -21,23 +21,33 @@ Note:
 - All computations use SI units.
 
 Returns:
-- Two lists: densities and pressures corresponding to each radius.
+- A planet_profile.PlanetProfile holding the radius, density, pressure, gravity and layer of each shell,
+  together with the convergence status and iteration count. It still unpacks as (densities, pressures).
+
+Planets that oscillate, stagnate or diverge are detected within a few iterations and retried once with damped
+updates; if that fails too, the profile is returned unconverged with a failure record (see divergence.py).
+
+A tolerance.TolerancePolicy replaces the absolute density threshold with a relative one, from which the
+tolerance of every EoS inversion is derived, and caps the iterations of both.
 """
 
 # In[6]:
 
 
 import EoS_Bits as EOS
+import divergence
 import planetary_dictionary as dct
 import solve_adams_williamson as aw
+import instrumentation as inst
+from planet_profile import PlanetProfile
 
 import numpy as np
-from matplotlib import pyplot as plt
 
 r_earth = 6370 * (10 ** 3)
 
 
-def Solver(radii_list, insert_dict, density_list = [], discrepancy = 10, calls = 0):
+def Solver(radii_list, insert_dict, density_list = [], discrepancy = 10, calls = 0, quadrature_rule = 'rectangle',
+           damping = 1.0, monitor = None, policy = None):
     '''
     Computes the self-consistent radial density and pressure profiles of a planet given a list of radii 
     and a planetary composition dictionary.
@@ -48,11 +58,22 @@ def Solver(radii_list, insert_dict, density_list = [], discrepancy = 10, calls =
     density_list (list, optional): An optional list of initial density values as guesses (eg: zero-pressure densities). Defaults to an empty list.
     discrepancy (float, optional): The convergence threshold for density in kg/m^3. Defaults to 10.
     calls (int, optional): Recursion counter to prevent infinite loops. Defaults to 0.
+    quadrature_rule (str, optional): Radial integration rule for Adams-Williamson, one of quadrature.METHODS.
+                                     Defaults to 'rectangle'; 'trapezoid' or 'simpson' reach the same accuracy
+                                     with far fewer shells (see quadrature_convergence.py).
+    damping (float, optional): Fraction of each density update applied, rho <- rho + damping * (rho_new - rho).
+                               Defaults to 1 (no damping). Lowered automatically for the retry of a planet that
+                               oscillates, stagnates or diverges.
+    monitor (ResidualMonitor, optional): Residual history carried between recursions. Defaults to None.
+    policy (TolerancePolicy, optional): Relative convergence target and iteration caps, replacing discrepancy and
+                                        the 2000 iteration cap; the EoS inversions derive their tolerance from it.
+                                        Defaults to None (absolute thresholds).
 
     Returns:
-        tuple: A tuple containing two lists:
-            - List of densities at each radius (in kg/m^3)
-            - List of pressures at each radius (in Pa)
+        PlanetProfile: Arrays of the density (kg/m^3), pressure (Pa), gravity (m/s^2) and layer index at each radius,
+        with the convergence status and the number of iterations. It unpacks as (densities, pressures).
+        If the densities do not converge, converged is False, pressure and gravity are nan and failure holds
+        a divergence.SolveFailure record.
     '''
 #The density list is initially empty and is populated after the first run.
 #The discrepancy represents the error in density.
@@ -62,13 +83,14 @@ def Solver(radii_list, insert_dict, density_list = [], discrepancy = 10, calls =
     pressure_n1 = {}
     density_n1 = {}
     calls += 1
+    max_calls = 2000 if policy is None else policy.max_iterations
 
 
-    while calls <= 2000:
+    while calls <= max_calls:
     #Prevents the number of recursions from diverging.
         if int(max([*insert_dict.keys()])) != int(max(radii_list)):            
             insert_dict[int(float(f"{int(max(radii_list))}"))] = insert_dict.pop(int(float(f'{max([*insert_dict.keys()])}')))
-            return(Solver(radii_list, insert_dict, density_list = [], discrepancy = discrepancy, calls = 0))
+            return(Solver(radii_list, insert_dict, density_list = [], discrepancy = discrepancy, calls = 0, quadrature_rule = quadrature_rule, damping = damping, policy = policy))
         #Ensures that the maximum radius in the planet's dictionary and the radius list are compatible
 
         
@@ -80,107 +102,122 @@ def Solver(radii_list, insert_dict, density_list = [], discrepancy = 10, calls =
                                 density_list.append(int(insert_dict[cutoff][0]))
         #On the first iteration, the Solver makes a density_list using initial density guesses as preliminary values
     
-        pressure_list = aw.adams_williamson(radii_list, density_list)
-        #pressure_list is a list of initial pressures at each radius.
+        inst.add('solver_iterations')
+        with inst.stage('adams_williamson'):
+            gravity_list, pressure_list = aw.adams_williamson(radii_list, density_list, quadrature_rule, [*insert_dict.keys()])
+        #pressure_list is an array of initial pressures at each radius.
         
-        for n in radii_list:
-            pressure_n[n] = pressure_list[n][1]
+        for k, n in enumerate(radii_list):
+            pressure_n[n] = pressure_list[k]
         #At each radius in the list, a corresponding pressure is assigned. This is the nth pressure.
         
-        for n in radii_list:
-            nth_p_n = pressure_n[n]
-            #This assigns the pressure at the nth radius calculated for the nth time.
-            for cutoff in list(insert_dict.keys()):    
-                if n <= cutoff: 
-                #Here, we select the correct EoS and EoS parameters corresponding that layer's radius, pressure, and material.
+        capped = 0 if policy is None else policy.exceeded['inversion']
+        with inst.stage('eos'):
+            for n in radii_list:
+                nth_p_n = pressure_n[n]
+                #This assigns the pressure at the nth radius calculated for the nth time.
+                for cutoff in list(insert_dict.keys()):    
+                    if n <= cutoff: 
+                    #Here, we select the correct EoS and EoS parameters corresponding that layer's radius, pressure, and material.
                     
-                    if list(insert_dict.keys()).index(cutoff) == 0:
-                    #This "if block" is for calculations within the Core.
+                        if list(insert_dict.keys()).index(cutoff) == 0:
+                        #This "if block" is for calculations within the Core.
                         
-                        #We calculate the n+1th density and pressure using functions from EoS_Bits 
+                            #We calculate the n+1th density and pressure using functions from EoS_Bits 
                     
-                        density_n1[n] = EOS.CoreDensity(nth_p_n)
-                        pressure_n1[n] = EOS.Vinet(density_n1[n],7678,136.2 * (10 ** 9),5.97)
-                        break
+                            density_n1[n] = EOS.CoreDensity(nth_p_n, policy)
+                            pressure_n1[n] = EOS.Vinet(density_n1[n],7678,136.2 * (10 ** 9),5.97)
+                            break
                         
-                    elif list(insert_dict.keys()).index(cutoff) == 1:
-                    #This "if block" is for calculations within the Mantle.
+                        elif list(insert_dict.keys()).index(cutoff) == 1:
+                        #This "if block" is for calculations within the Mantle.
                         
-                        #We calculate the n+1th density and pressure using functions from EoS_Bits 
+                            #We calculate the n+1th density and pressure using functions from EoS_Bits 
                         
-                        density_n1[n] = EOS.RockDensity(nth_p_n)
+                            density_n1[n] = EOS.RockDensity(nth_p_n, policy)
                         
-                        #Depending on the pressure, different EOS parameters are selected.
-                        if nth_p_n < 2.5 * (10 ** 9):
-                            pressure_n1[n] = 0.701 * EOS.BM3(density_n1[n], 3221,125 * (10 ** 9),4) + 0.299 * EOS.BM3(density_n1[n],2648,37.4 * (10 ** 9),6.2)
-                            break
-                        elif nth_p_n < 8 * (10 ** 9):
-                            pressure_n1[n] = 0.701 * EOS.BM3(density_n1[n], 3221,125 * (10 ** 9),4) + 0.299 * EOS.BM3(density_n1[n],2921,96 * (10 ** 9),8.4)
-                            break
-                        elif nth_p_n < 14 * (10 ** 9):
-                            pressure_n1[n] = 0.701 * EOS.BM3(density_n1[n], 3221,125 * (10 ** 9),4) + 0.299 * EOS.BM3(density_n1[n],4290,309.9 * (10 ** 9),4.59)
-                            break
-                        elif nth_p_n < 18 * (10 ** 9):
-                            pressure_n1[n] = 0.701 * EOS.BM3(density_n1[n],3491,160 * (10 ** 9),4) + 0.299 * EOS.BM3(density_n1[n],4290,309.9 * (10 ** 9),4.59)
-                            break
-                        elif nth_p_n < 23 * (10 ** 9):
-                            pressure_n1[n] = 0.701 * EOS.BM3(density_n1[n],3548,182 * (10 ** 9),4.2) + 0.299 * EOS.BM3(density_n1[n],4290,309.9 * (10 ** 9),4.59)
-                            break
-                        elif nth_p_n < 120 * (10 ** 9):
-                            pressure_n1[n] = EOS.BM3(density_n1[n], 4101,256 * (10 ** 9),4)
-                            break
-                        else:
-                            pressure_n1[n] = EOS.Vinet(density_n1[n], 4058,221 * (10 ** 9),4.2)
-                            break
+                            #Depending on the pressure, different EOS parameters are selected.
+                            if nth_p_n < 2.5 * (10 ** 9):
+                                pressure_n1[n] = 0.701 * EOS.BM3(density_n1[n], 3221,125 * (10 ** 9),4) + 0.299 * EOS.BM3(density_n1[n],2648,37.4 * (10 ** 9),6.2)
+                                break
+                            elif nth_p_n < 8 * (10 ** 9):
+                                pressure_n1[n] = 0.701 * EOS.BM3(density_n1[n], 3221,125 * (10 ** 9),4) + 0.299 * EOS.BM3(density_n1[n],2921,96 * (10 ** 9),8.4)
+                                break
+                            elif nth_p_n < 14 * (10 ** 9):
+                                pressure_n1[n] = 0.701 * EOS.BM3(density_n1[n], 3221,125 * (10 ** 9),4) + 0.299 * EOS.BM3(density_n1[n],4290,309.9 * (10 ** 9),4.59)
+                                break
+                            elif nth_p_n < 18 * (10 ** 9):
+                                pressure_n1[n] = 0.701 * EOS.BM3(density_n1[n],3491,160 * (10 ** 9),4) + 0.299 * EOS.BM3(density_n1[n],4290,309.9 * (10 ** 9),4.59)
+                                break
+                            elif nth_p_n < 23 * (10 ** 9):
+                                pressure_n1[n] = 0.701 * EOS.BM3(density_n1[n],3548,182 * (10 ** 9),4.2) + 0.299 * EOS.BM3(density_n1[n],4290,309.9 * (10 ** 9),4.59)
+                                break
+                            elif nth_p_n < 120 * (10 ** 9):
+                                pressure_n1[n] = EOS.BM3(density_n1[n], 4101,256 * (10 ** 9),4)
+                                break
+                            else:
+                                pressure_n1[n] = EOS.Vinet(density_n1[n], 4058,221 * (10 ** 9),4.2)
+                                break
                         
-                    elif list(insert_dict.keys()).index(cutoff) == 2:
-                    #This "if block" is for calculations within the Ice.
+                        elif list(insert_dict.keys()).index(cutoff) == 2:
+                        #This "if block" is for calculations within the Ice.
                         
-                        #We calculate the n+1th density and pressure using functions from EoS_Bits 
-                        density_n1[n] = EOS.IceDensity(nth_p_n)
+                            #We calculate the n+1th density and pressure using functions from EoS_Bits 
+                            density_n1[n] = EOS.IceDensity(nth_p_n, policy)
                         
-                        if nth_p_n < 1 * (10 ** 9):
-                            pressure_n1[n] = EOS.Murnaghan(density_n1[n], 930, 9.85 * (10 ** 9), 6.6)
-                            break
-                        elif nth_p_n < 2.1 * (10 ** 9):
-                            pressure_n1[n] = EOS.BM3(density_n1[n], 1271, 14.05 * (10 ** 9), 4)
-                            break
-                        else:
-                            pressure_n1[n] = EOS.BM3(density_n1[n], 1456, 14.9 * (10 ** 9), 5.4)
-                            break
+                            if nth_p_n < 1 * (10 ** 9):
+                                pressure_n1[n] = EOS.Murnaghan(density_n1[n], 930, 9.85 * (10 ** 9), 6.6)
+                                break
+                            elif nth_p_n < 2.1 * (10 ** 9):
+                                pressure_n1[n] = EOS.BM3(density_n1[n], 1271, 14.05 * (10 ** 9), 4)
+                                break
+                            else:
+                                pressure_n1[n] = EOS.BM3(density_n1[n], 1456, 14.9 * (10 ** 9), 5.4)
+                                break
     
-        if all(abs(np.array(list(density_n1.values())[:1000]) - np.array(density_list[:1000]) < discrepancy)):
-            return(list(density_n1.values()), list(pressure_n1.values()))
-        #If all densities are self-consistent to 10 kg/m^3, return a list of densities and a list of pressures.
+
+        tolerance = discrepancy if policy is None else policy.density_tolerance(list(density_n1.values())[:1000])
+        #With a policy, each shell is held to the same relative tolerance.
+
+        if all(abs(np.array(list(density_n1.values())[:1000]) - np.array(density_list[:1000])) < tolerance):
+            if policy is not None and policy.exceeded['inversion'] > capped:
+                monitor = monitor or divergence.ResidualMonitor()
+                return(PlanetProfile.failed(radii_list, list(density_n1.values()), _layers(radii_list, insert_dict),
+                                            calls, monitor.failure('inversion_cap', calls, damping)))
+            #Densities from inversions that reached their cap are not within the policy's tolerance.
+            return(PlanetProfile(radii_list, list(density_n1.values()), list(pressure_n1.values()), gravity_list,
+                                 _layers(radii_list, insert_dict), converged=True, iterations=calls))
+        #If all densities are self-consistent (to 10 kg/m^3 by default), return the densities, pressures and gravities.
+        #The gravities are those of the last Adams-Williamson pass.
     
         else:
-            return(Solver(radii_list, insert_dict, density_list = list(density_n1.values()), discrepancy = discrepancy, calls = calls))
+            monitor = monitor or divergence.ResidualMonitor()
+            update = np.array(list(density_n1.values())) - np.array(density_list)
+            reason, damping = divergence.respond(monitor, monitor.update(update[:1000]), damping)
+            if reason is not None:
+                return(PlanetProfile.failed(radii_list, density_list, _layers(radii_list, insert_dict), calls,
+                                            monitor.failure(reason, calls, damping)))
+            #Oscillating, stagnating or diverging densities are retried once with damping before giving up.
+
+            if damping != 1:
+                density_list = list(np.array(density_list) + damping * update)
+            else:
+                density_list = list(density_n1.values())
+            return(Solver(radii_list, insert_dict, density_list = density_list, discrepancy = discrepancy, calls = calls, quadrature_rule = quadrature_rule, damping = damping, monitor = monitor, policy = policy))
         #If densities are not yet self-consistent, reiterate the process.
         
-    return([0], [0])
-    #If densities do not converge, then return empty lists.
-
-
-# Let's try creating a planet using ```planetary_dictionary``` and running our Solver to print out our densities and pressures.
-# 
-# Let's construct a planet that has a radius of 1 Earth radius. It will be 0.3 parts core and 0.5 parts mantle by depth.
-
-# In[8]:
+    if policy is not None:
+        policy.exceed('solver')
+    return(PlanetProfile.failed(radii_list, density_list, _layers(radii_list, insert_dict), calls - 1,
+                                (monitor or divergence.ResidualMonitor()).failure('max_iterations', calls - 1, damping)))
+    #If densities do not converge, return the last densities, flagged as not converged.
 
 
-print('Our dictionary:')
-print(dct.planetary_dictionary(1, 0.3, 0.5))
-print('\n')
+def _layers(radii_list, insert_dict):
+    #Layer index of each radius: the position of the first cutoff at or beyond it, as in the loop above.
+    cutoffs = np.array([*insert_dict.keys()])
+    return(np.searchsorted(cutoffs, np.asarray(radii_list), side='left'))
 
-print('Our densities and pressures:')
-print(Solver([*range(1, int(r_earth), int(r_earth / 1000))], dct.planetary_dictionary(1, 0.3, 0.5)))
-
-
-# The dictionary has three keys. Each key represents the boundary at which materials change. In other words, our core has a radius of Key 1 meters. Our mantle begins at the edge of our core and extends to Key 2 meters. Our ice layer begins at the edge of the mantle and extends to Key 3 meters.
-# 
-# Our list of densities and pressures both start at the innermost radius and end with the outermost radius specified in our ```radii_list```.
-# 
-# Now, let's plot our density and/or pressure as a function of radius.
 
 # In[9]:
 
@@ -197,6 +234,8 @@ def plotter(radii_list, insert_dict, density_or_pressure):
     Displays:
     A matplotlib plot of the selected quantity versus radius.
     """
+    from matplotlib import pyplot as plt
+
     if density_or_pressure.lower() == "density":
         to_plot = Solver(radii_list, insert_dict)[0]
     elif density_or_pressure.lower() == "pressure":
@@ -205,19 +244,34 @@ def plotter(radii_list, insert_dict, density_or_pressure):
     plt.show()
 
 
-# Call the ```plotter``` function with three arguments.
-# 
-# The first argument is our list of radii. In the following example, our list of radii runs from ```1``` to ```1 * 6.371 * (10 ** 6)``` in increments of ```6371``` (a thousand slices for an Earth-sized planet).
-# 
-# The second argument specifies the planet's profile. We use a planetary dictionary here.
-# 
-# The third argument is a string specifying either ```'density'``` or ```'pressure'``` to be plotted.
+# The examples below only run when this file is executed directly, eg: python looped_solver.py
+
+if __name__ == '__main__':
+    # Let's try creating a planet using ```planetary_dictionary``` and running our Solver to print out our densities and pressures.
+    #
+    # Let's construct a planet that has a radius of 1 Earth radius. It will be 0.3 parts core and 0.5 parts mantle by depth.
+
+    print('Our dictionary:')
+    print(dct.planetary_dictionary(1, 0.3, 0.5))
+    print('\n')
 
-# In[10]:
+    print('Our densities and pressures:')
+    print(Solver([*range(1, int(r_earth), int(r_earth / 1000))], dct.planetary_dictionary(1, 0.3, 0.5)))
 
+    # The dictionary has three keys. Each key represents the boundary at which materials change. In other words, our core has a radius of Key 1 meters. Our mantle begins at the edge of our core and extends to Key 2 meters. Our ice layer begins at the edge of the mantle and extends to Key 3 meters.
+    #
+    # Our list of densities and pressures both start at the innermost radius and end with the outermost radius specified in our ```radii_list```.
+    #
+    # Now, let's plot our density and/or pressure as a function of radius.
 
-plotter([*range(1, int(r_earth), int(r_earth / 1000))], dct.planetary_dictionary(1, 0.3, 0.6), 'density')
-plotter([*range(1, int(r_earth), int(r_earth / 1000))], dct.planetary_dictionary(1, 0.3, 0.6), 'pressure')
+    # Call the ```plotter``` function with three arguments.
+    #
+    # The first argument is our list of radii. In the following example, our list of radii runs from ```1``` to ```1 * 6.371 * (10 ** 6)``` in increments of ```6371``` (a thousand slices for an Earth-sized planet).
+    #
+    # The second argument specifies the planet's profile. We use a planetary dictionary here.
+    #
+    # The third argument is a string specifying either ```'density'``` or ```'pressure'``` to be plotted.
 
+    plotter([*range(1, int(r_earth), int(r_earth / 1000))], dct.planetary_dictionary(1, 0.3, 0.6), 'density')
+    plotter([*range(1, int(r_earth), int(r_earth / 1000))], dct.planetary_dictionary(1, 0.3, 0.6), 'pressure')
 
-# 
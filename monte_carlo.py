@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Monte Carlo Planets
+
+Monte Carlo simulation of hypothetical exoplanets with randomized composition. Each planet is solved with
+looped_solver.Solver and evaluated for diamond precipitation candidacy (by default criteria.DIAMOND, a maximum
+ice-layer pressure of at least 10 GPa). Results are written to a csv, and monte_carlo_plot() also saves mass-radius diagnostics plots.
+
+Sampled parameters:
+- rand_earth: planet radius, in [0.5, 1.5] Earth radii
+- rand_ice: fractional depth of the ice layer, in [0.1, 0.9]
+- rand_iron, rand_sio2: the remaining depth, split equally between the iron core and the silicate mantle
+
+By default rand_earth and rand_ice are independent uniform draws. Other samplers from samplers.py (Sobol,
+Halton, Latin hypercube and importance sampling near the diamond boundary) are selected with sampler=.
+Importance-sampled runs add a sample_weight column to the csv, to be used with samplers.weighted_fraction().
+
+Passing archive=<directory> to the runners also stores every planet's full density, pressure and gravity
+profiles in a profile_archive.ProfileArchive. Planets are keyed by a planet_id that continues after the last
+planet already in the archive, so several runs can share one archive, and the csv gains a planet_id column. Other criteria can then be
+evaluated on the stored profiles with criteria.evaluate_archive(), without solving the planets again.
+
+Planets whose solve does not converge (see divergence.py) are skipped rather than aborting the run: they get
+no csv row and are listed, with the reason, in a *_failures.csv next to the results.
+
+As results arrive, the runners also fill binned_stats.BinnedStats histograms of candidate and noncandidate
+counts and mean max_p per bin (radius x mass and radius x ice fraction), saved next to the csv. plot_results()
+renders from these bins, so plotting costs the same for 10^3 or 10^6 planets.
+
+monte_carlo_adaptive() samples planets until the confidence intervals of the candidate fraction (overall and,
+optionally, per mass bin) are narrower than a target width, instead of solving a fixed number of planets.
+
+See monte_carlo_planets.ipynb for an example run.
+"""
+
+import csv
+import math
+import os
+import warnings
+from contextlib import nullcontext
+from statistics import NormalDist
+
+import binned_stats
+import criteria
+import divergence
+import instrumentation as inst
+import looped_solver
+import planetary_dictionary as dct
+import profile_archive
+import samplers
+
+r_earth = 6370 * (10 ** 3)
+
+FAILURE_PARAMETERS = ["rand_earth", "rand_ice"]
+#Planet parameters recorded for each skipped planet in a *_failures.csv.
+
+CSV_HEADER = ["rand_earth (Earth Radii)", "rand_ice", "rand_iron", "rand_sio2", "planet_mass (kg)", "max_p (Pa)", "diamond_formation"]
+
+
+def compute_mass(radii, densities):
+    """
+    Computes the total mass of a sphere composed of concentric shells.
+
+    Parameters:
+    radii (list of float)
+    densities (list of float)
+
+    Returns total mass of the sphere
+    """
+
+    if len(radii) != len(densities):
+        raise ValueError("radii and density lists must be same length.")
+
+    total_mass = 0.0
+    for i in range(len(radii)):
+        r_outer = radii[i]
+        r_inner = 0 if i == 0 else radii[i - 1]
+        volume_shell = (4/3) * math.pi * (r_outer**3 - r_inner**3)
+        mass_shell = volume_shell * densities[i]
+        total_mass += mass_shell
+
+    return total_mass
+
+
+def evaluate_planet(rand_earth, rand_ice, archive=None, planet_id=None, criterion=criteria.DIAMOND):
+    """
+    Solves a single planet and evaluates it for diamond formation candidacy.
+
+    Parameters:
+    rand_earth (float): Planet radius in Earth radii.
+    rand_ice (float): Fractional depth of the ice layer; the rest is split equally between core and mantle.
+    archive (ProfileArchive, optional): If given, the planet's full radial profiles are appended to it.
+    planet_id (int, optional): Identifier of the planet in the archive, eg: next_planet_id(archive) + sample index.
+    criterion (criteria.Criterion, optional): Decides the diamond_formation column. Defaults to criteria.DIAMOND.
+
+    Returns:
+    list: A csv row in the order of CSV_HEADER.
+
+    Raises:
+    divergence.SolverDiverged: If the planet's densities do not converge. Nothing is archived for it.
+    ValueError: If planet_id is already in the archive (checked before solving).
+    """
+    if archive is not None and planet_id in archive:
+        raise ValueError(f"Planet {planet_id} is already in the archive.")
+
+    rand_radius = rand_earth * r_earth
+    radii_list = [*range(1, int(rand_radius), int(rand_radius / 1000))]
+
+    rand_iron = 0.5 * (1 - rand_ice)
+    rand_sio2 = 0.5 * (1 - rand_ice)
+
+    rand_planet = dct.planetary_dictionary(earth_rads=rand_earth, iron_part=rand_iron, sio2_part=rand_sio2)
+
+    profile = divergence.check(looped_solver.Solver(radii_list, rand_planet))
+
+    planet_mass = float(compute_mass(radii_list, profile.density))
+
+    boundary = list(rand_planet.keys())[1]
+    shells = criteria.IceShells.from_profiles([profile], [boundary])
+    metrics = criterion.metrics(shells)
+
+    max_p = float((metrics['max_p'] if 'max_p' in metrics else shells.maximum(shells.pressure))[0])
+    #The max_p column is the criterion's own when it reports one, so the two cannot disagree.
+
+    if archive is not None:
+        archive.append(planet_id, {'rand_earth': rand_earth, 'rand_ice': rand_ice, 'rand_iron': rand_iron,
+                                   'rand_sio2': rand_sio2, 'mantle_ice_boundary': boundary},
+                       profile.radius, profile.density, profile.pressure, profile.gravity)
+
+    return [rand_earth, rand_ice, rand_iron, rand_sio2, planet_mass, max_p, 'yes' if metrics[criterion.name][0] else 'no']
+
+
+def next_planet_id(archive):
+    """Returns the first planet_id after every planet already in a ProfileArchive (0 for an empty one or None)."""
+    if archive is None or not len(archive):
+        return 0
+    return int(archive.index['planet_id'].max()) + 1
+
+
+def unused_filename(number):
+    """Returns diamond_results_<number>.csv, or the first diamond_results_<number>_<counter>.csv not already taken."""
+    base_filename = f"diamond_results_{number}"
+    filename = f"{base_filename}.csv"
+    counter = 1
+
+    while os.path.exists(filename):
+        filename = f"{base_filename}_{counter}.csv"
+        counter += 1
+    return filename
+
+
+def monte_carlo_run(number, filename=None, instrument=False, sampler='uniform', seed=None, archive=None,
+                    criterion=criteria.DIAMOND, **sampler_options):
+    '''
+    Solves number randomly sampled planets and writes one csv row per planet.
+
+    Parameters:
+    number (int): Number of planets to sample.
+    filename (str, optional): Output csv. Defaults to a diamond_results_<number>.csv name that is not already taken.
+    instrument (bool, optional): If True, solver call counts and stage timings of every sampled planet, failed
+                                 ones included, are written to a companion *_stats.csv. Its sample_index column
+                                 matches a sample_index column added to the csv (and that of *_failures.csv), and
+                                 its failed column marks the planets that got no csv row. Defaults to False.
+    sampler (str, optional): Name of a sampler in samplers.SAMPLERS. Defaults to 'uniform'.
+    seed (int, optional): Seed for the sampler. With the default sampler and no seed, the global random module is used.
+    archive (str, optional): Directory of a profile archive (see profile_archive.py) to which the full profiles of
+                             every planet are appended. Their planet_id (the sample index, offset past any planets
+                             already archived) is written to a planet_id column of the csv.
+    criterion (criteria.Criterion, optional): Decides the diamond_formation column, and so the candidate counts
+                                              of the bins. Defaults to criteria.DIAMOND.
+    **sampler_options: Extra keyword arguments for the sampler (eg: half_width for 'importance').
+
+    Planets that do not converge are skipped and listed in <filename>_failures.csv.
+
+    Returns:
+    str: The name of the csv written.
+    '''
+    filename = filename or unused_filename(number)
+    rand_earths, rand_ices, weights = samplers.draw(sampler, number, seed=seed, **sampler_options)
+    weighted = sampler == 'importance'
+
+    stats = inst.Instrumentation() if instrument else None
+    stats_file = open(filename.replace(".csv", "_stats.csv"), "w", newline="") if instrument else None
+    profiles = profile_archive.ProfileArchive(archive, mode='a') if archive else None
+    first_id = next_planet_id(profiles)
+
+    failures = divergence.FailureLog(filename.replace(".csv", "_failures.csv"), FAILURE_PARAMETERS)
+    bins = binned_stats.new_bins()
+
+    with open(filename, "w", newline="") as f, stats or nullcontext(), profiles if profiles is not None else nullcontext(), failures:
+        writer = csv.writer(f)
+
+        writer.writerow(CSV_HEADER + (["sample_weight"] if weighted else []) + (["planet_id"] if profiles is not None else [])
+                        + (["sample_index"] if instrument else []))
+        if instrument:
+            stats_writer = csv.writer(stats_file)
+            stats_writer.writerow(["sample_index", "failed"] + inst.COUNTERS)
+
+        for i in range(number):
+            rand_earth = float(rand_earths[i])
+            rand_ice = float(rand_ices[i])
+
+            row = None
+            with stats.planet() if instrument else nullcontext():
+                try:
+                    row = evaluate_planet(rand_earth, rand_ice, profiles, first_id + i, criterion)
+                except divergence.SolverDiverged as error:
+                    failures.log(i, [rand_earth, rand_ice], error.failure)
+            if row is not None:
+                writer.writerow(row + ([float(weights[i])] if weighted else []) + ([first_id + i] if profiles is not None else [])
+                                + ([i] if instrument else []))
+                for layout_bins in bins.values():
+                    layout_bins.update_row(row, float(weights[i]))
+            if instrument:
+                stats_writer.writerow([i, 0 if row is not None else 1] + [stats.planets[-1][key] for key in inst.COUNTERS])
+            print(i)
+
+    binned_stats.save_bins(bins, filename)
+    if instrument:
+        stats_file.close()
+        print('Run totals:', stats.totals)
+    if failures.count:
+        print(f"Skipped {failures.count} of {number} planets, see '{failures.filename}'")
+    return filename
+
+
+def wilson_interval(successes, total, confidence=0.95):
+    """
+    Wilson score interval for a fraction.
+
+    Parameters:
+    successes (float): (Weighted) number of planets with the property.
+    total (float): (Effective) number of planets.
+    confidence (float, optional): Confidence level of the interval. Defaults to 0.95.
+
+    Returns:
+    tuple: (lower, upper) bounds of the interval, or (0, 1) if total is 0.
+    """
+    if total <= 0:
+        return (0.0, 1.0)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / total
+    centre = (p + z**2 / (2 * total)) / (1 + z**2 / total)
+    half_width = z * math.sqrt(p * (1 - p) / total + z**2 / (4 * total**2)) / (1 + z**2 / total)
+    return (max(0.0, centre - half_width), min(1.0, centre + half_width))
+
+
+def fraction_interval(candidates, weights, confidence=0.95):
+    """
+    Estimates a candidate fraction and its confidence interval from (possibly weighted) planets.
+
+    Weighted planets are summarized by their Kish effective sample size (sum of weights squared over the sum
+    of squared weights), which reduces to the plain count for unit weights.
+
+    Parameters:
+    candidates (list): 1 for each candidate planet, 0 otherwise.
+    weights (list): Sample weight of each planet.
+    confidence (float, optional): Confidence level of the interval. Defaults to 0.95.
+
+    Returns:
+    dict: estimate, lower, upper, width and effective sample size n_eff.
+    """
+    total_weight = sum(weights)
+    if total_weight <= 0:
+        return {'estimate': math.nan, 'lower': 0.0, 'upper': 1.0, 'width': 1.0, 'n_eff': 0.0}
+    estimate = sum(w * c for w, c in zip(weights, candidates)) / total_weight
+    n_eff = total_weight**2 / sum(w**2 for w in weights)
+    lower, upper = wilson_interval(estimate * n_eff, n_eff, confidence)
+    return {'estimate': estimate, 'lower': lower, 'upper': upper, 'width': upper - lower, 'n_eff': n_eff}
+
+
+def monte_carlo_adaptive(target_width, filename=None, mass_bins=None, confidence=0.95, batch_size=100,
+                         min_samples=200, max_samples=20000, sampler='uniform', seed=None, archive=None,
+                         criterion=criteria.DIAMOND, **sampler_options):
+    '''
+    Samples planets until the confidence interval of every tracked fraction is narrower than target_width.
+
+    Tracked fractions are the overall diamond-candidate fraction and, if mass_bins is given, the candidate
+    fraction within each planet mass bin. Intervals are checked after every batch_size planets. The csv has
+    the same columns as monte_carlo_run(), and a *_summary.csv next to it records the precision reached.
+    Mass bins that no solved planet has fallen in cannot narrow, so they are left out of the stopping test (with a
+    warning) and listed in the summary as empty_bins.
+    Planets that do not converge are skipped, as in monte_carlo_run(), and do not count towards the fractions.
+
+    Parameters:
+    target_width (float): Required full width of each confidence interval (eg: 0.02 for +/- 1%).
+    filename (str, optional): Output csv. Defaults to a diamond_results_adaptive.csv name that is not already taken.
+    mass_bins (list, optional): Increasing planet mass bin edges (kg). Planets outside the edges are not binned.
+    confidence (float, optional): Confidence level of the intervals. Defaults to 0.95.
+    batch_size (int, optional): Number of planets between interval checks. Defaults to 100.
+    min_samples (int, optional): Number of planets to sample before the first check. Defaults to 200.
+    max_samples (int, optional): Number of planets after which the run stops regardless. Defaults to 20000.
+    sampler (str, optional): Name of a sampler in samplers.SAMPLERS. Defaults to 'uniform'.
+    seed (int, optional): Seed for the sampler.
+    archive (str, optional): Directory of a profile archive to which the full profiles of every planet are appended,
+                             with their planet_id in the csv, as in monte_carlo_run().
+    criterion (criteria.Criterion, optional): Decides which planets are candidates. Defaults to criteria.DIAMOND.
+    **sampler_options: Extra keyword arguments for the sampler.
+
+    Returns:
+    dict: Summary with the csv filename, number of planets solved and skipped, whether the target was reached, the
+          empty mass bins, and the estimate, interval and effective sample size of each tracked fraction (keyed 'overall' and by mass bin).
+    '''
+    filename = filename or unused_filename('adaptive')
+    rand_earths, rand_ices, weights = samplers.draw(sampler, max_samples, seed=seed, **sampler_options)
+    weights = [float(w) for w in weights]
+    weighted = sampler == 'importance'
+    mass_bins = list(mass_bins or [])
+    bin_names = [f"{low:.3g}-{high:.3g} kg" for low, high in zip(mass_bins[:-1], mass_bins[1:])]
+
+    candidates = []
+    masses = []
+    solved_weights = []
+
+    def intervals():
+        tracked = {'overall': fraction_interval(candidates, solved_weights, confidence)}
+        for k, name in enumerate(bin_names):
+            members = [i for i, m in enumerate(masses) if mass_bins[k] <= m < mass_bins[k + 1]]
+            tracked[name] = fraction_interval([candidates[i] for i in members], [solved_weights[i] for i in members], confidence)
+        return tracked
+
+    def empty(tracked):
+        return [name for name, value in tracked.items() if value['n_eff'] == 0]
+
+    def reached(tracked):
+        #Empty bins are skipped, but the overall fraction (empty only if no planet was solved) never is.
+        return tracked['overall']['n_eff'] > 0 and all(value['width'] < target_width for value in tracked.values()
+                                                       if value['n_eff'] > 0)
+
+    warned = set()
+    profiles = profile_archive.ProfileArchive(archive, mode='a') if archive else None
+    first_id = next_planet_id(profiles)
+
+    failures = divergence.FailureLog(filename.replace(".csv", "_failures.csv"), FAILURE_PARAMETERS)
+    bins = binned_stats.new_bins()
+
+    with open(filename, "w", newline="") as f, profiles if profiles is not None else nullcontext(), failures:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER + (["sample_weight"] if weighted else []) + (["planet_id"] if profiles is not None else []))
+
+        tracked = intervals()
+        for i in range(max_samples):
+            try:
+                row = evaluate_planet(float(rand_earths[i]), float(rand_ices[i]), profiles, first_id + i, criterion)
+            except divergence.SolverDiverged as error:
+                failures.log(i, [float(rand_earths[i]), float(rand_ices[i])], error.failure)
+                continue
+            writer.writerow(row + ([weights[i]] if weighted else []) + ([first_id + i] if profiles is not None else []))
+            masses.append(row[4])
+            candidates.append(1 if row[6] == 'yes' else 0)
+            solved_weights.append(weights[i])
+            for layout_bins in bins.values():
+                layout_bins.update_row(row, weights[i])
+
+            solved = len(candidates)
+            if solved >= min_samples and (solved - min_samples) % batch_size == 0:
+                tracked = intervals()
+                print(solved, {name: round(value['width'], 4) for name, value in tracked.items()})
+                unwarned = [name for name in empty(tracked) if name not in warned]
+                if unwarned:
+                    warnings.warn(f"No planets in mass bins {unwarned} after {solved} planets; they are left out "
+                                  "of the stopping test.")
+                    warned.update(unwarned)
+                if reached(tracked):
+                    break
+        tracked = intervals()
+    binned_stats.save_bins(bins, filename)
+
+    summary = {'filename': filename, 'planets': len(candidates), 'skipped': failures.count,
+               'target_reached': reached(tracked), 'empty_bins': empty(tracked), 'fractions': tracked}
+
+    with open(filename.replace(".csv", "_summary.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["fraction", "estimate", "lower", "upper", "width", "n_eff", "target_width", "confidence", "planets"])
+        for name, value in tracked.items():
+            writer.writerow([name, value['estimate'], value['lower'], value['upper'], value['width'], value['n_eff'],
+                             target_width, confidence, len(candidates)])
+    return summary
+
+
+def plot_results(filename, layout='mass_radius'):
+    '''
+    Saves and shows binned diagnostics plots of a results csv: planets per bin, candidate fraction and mean max
+    ice pressure, over radius x mass or radius x ice fraction (see binned_stats.py).
+
+    The bins saved by monte_carlo_run() next to the csv are used when present; otherwise the csv is read in
+    chunks. Either way the plotting cost does not depend on the number of planets.
+
+    Parameters:
+    filename (str): A csv written by monte_carlo_run(). The plot is saved next to it as a png.
+    layout (str, optional): 'mass_radius' or 'ice_radius'. Defaults to 'mass_radius'.
+    '''
+    bins_file = binned_stats.bins_filename(filename, layout)
+    if os.path.exists(bins_file):
+        stats = binned_stats.BinnedStats.load(bins_file)
+    else:
+        stats = binned_stats.from_csv(filename, layout)
+
+    plot_filename = filename.replace(".csv", ".png" if layout == 'mass_radius' else f"_{layout}.png")
+    stats.plot(plot_filename, title=f'Planet Mass vs. Radius ({len(stats)} planets)' if layout == 'mass_radius'
+               else f'Ice Fraction vs. Radius ({len(stats)} planets)')
+
+
+def monte_carlo_plot(number, instrument=False, sampler='uniform', seed=None, criterion=criteria.DIAMOND,
+                     **sampler_options):
+    '''Calling this function will output binned mass-radius plots with information about diamond formation candidacy of hypothetical planets along with csv of data.
+    Make sure that the names of the plots and csvs already existing in the directory don't interfere or overwrite.
+    If instrument is True, solver call counts and stage timings for each planet are written to a companion *_stats.csv,
+    joined to the csv by their sample_index columns.
+    sampler, seed and sampler_options select how planets are drawn, and criterion classifies them, as in monte_carlo_run().
+    '''
+    plot_results(monte_carlo_run(number, instrument=instrument, sampler=sampler, seed=seed, criterion=criterion,
+                                 **sampler_options))
+
+
+if __name__ == '__main__':
+    monte_carlo_plot(5000)
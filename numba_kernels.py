@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Numba Kernels
+
+Nopython-compiled scalar versions of the kernels in eos_kernels, used by its 'numba' backend.
+This module is imported only when that backend is first used, so importing eos_kernels does not pay
+for importing numba. Call the kernels through eos_kernels rather than directly.
+"""
+
+import numba
+import numpy as np
+
+G = 6.6743015 / (10 ** 11)
+
+EPSILON = 4 * np.finfo(np.float64).eps
+#Relative width below which a density bracket cannot shrink any further.
+
+
+@numba.njit(cache=True)
+def eos_pressure(form, rho, rho0, B0, B1):
+    if form == 0:
+        foo = rho / rho0
+        return 1.5 * B0 * (foo ** (7 / 3) - foo ** (5 / 3)) * (1 + 0.75 * (B1 - 4) * (foo ** (2 / 3) - 1))
+    if form == 1:
+        eta = (rho0 / rho) ** (1 / 3)
+        return 3 * B0 * ((1 - eta) / eta ** 2) * np.exp(1.5 * (B1 - 1) * (1 - eta))
+    return (B0 / B1) * ((rho0 / rho) ** (-1 * B1) - 1)
+
+@numba.njit(cache=True)
+def eos_slope(form, rho, rho0, B0, B1):
+    if form == 0:
+        x = (rho / rho0) ** (1 / 3)
+        c = 0.75 * (B1 - 4)
+        dP_dx = 1.5 * B0 * ((7 * x ** 6 - 5 * x ** 4) * (1 + c * (x ** 2 - 1)) + (x ** 7 - x ** 5) * 2 * c * x)
+        return dP_dx * x / (3 * rho)
+    if form == 1:
+        eta = (rho0 / rho) ** (1 / 3)
+        a = 1.5 * (B1 - 1)
+        dP_deta = 3 * B0 * np.exp(a * (1 - eta)) * ((eta - 2) / eta ** 3 - a * (1 - eta) / eta ** 2)
+        return -dP_deta * eta / (3 * rho)
+    return (B0 / rho) * (rho / rho0) ** B1
+
+@numba.njit(cache=True)
+def density_from_p_scalar(P, rho0, B0, B1, form, thresh, rtol, max_steps):
+    #With rtol > 0, thresh is replaced by the relative density tolerance rtol and the steps are capped at
+    #max_steps, as with a tolerance.TolerancePolicy. Returns the density, the steps taken and whether it was capped.
+    base = 1 + B1 * P / B0
+    rho_guess = rho0 * base ** (1 / B1) if base > 0 else 0.9 * rho0
+    if form == 2:
+        return rho_guess, 0, 0
+    if P >= 0:
+        rho_lower = rho0
+        rho_upper = np.inf
+    else:
+        rho_lower = 0.0
+        rho_upper = rho0
+    steps = 0
+    while True:
+        P_guess = eos_pressure(form, rho_guess, rho0, B0, B1)
+        slope = eos_slope(form, rho_guess, rho0, B0, B1)
+        tolerance = thresh if rtol == 0 else rtol * rho_guess * abs(slope)
+        if np.abs(P - P_guess) < tolerance:
+            break
+        if P_guess > P:
+            rho_upper = rho_guess
+        else:
+            rho_lower = rho_guess
+        if rho_upper - rho_lower <= EPSILON * rho_upper < np.inf:
+            break
+        if steps >= max_steps:
+            return rho_guess, steps, 1
+        steps += 1
+        rho_next = rho_guess - (P_guess - P) / slope
+        if not (rho_lower < rho_next < rho_upper):
+            rho_next = 2 * rho_lower if np.isinf(rho_upper) else (rho_upper + rho_lower) / 2
+        rho_guess = rho_next
+    return rho_guess, steps, 0
+
+@numba.njit(cache=True)
+def density_from_p(P, rho0, B0, B1, form, thresh, rtol, max_steps):
+    rho = np.empty(P.size)
+    steps = 0
+    capped = 0
+    for k in range(P.size):
+        rho[k], n, cap = density_from_p_scalar(P[k], rho0, B0, B1, form, thresh, rtol, max_steps)
+        steps += n
+        capped += cap
+    return rho, steps, capped
+
+@numba.njit(cache=True)
+def adams_williamson(radii, densities):
+    step_size = radii[1] - radii[0]
+    gravities = np.empty(radii.size)
+    pressures = np.empty(radii.size)
+    mass_inside = 0.0
+    total_pressure = 0.0
+    for k in range(radii.size):
+        mass_inside += 4 * np.pi * (radii[k] ** 2) * step_size * densities[k]
+        integrand = (G * mass_inside * densities[k]) / (radii[k] ** 2)
+        total_pressure += integrand * step_size
+        gravities[k] = integrand / densities[k]
+        pressures[k] = total_pressure
+    return gravities, total_pressure - pressures
+
+@numba.njit(cache=True)
+def density_step(pressures, layer, layer_start, p_max, weight, rho0, B0, B1, form, thresh, rtol, max_steps):
+    densities = np.empty(pressures.size)
+    new_pressures = np.empty(pressures.size)
+    steps = 0
+    capped = 0
+    for k in range(pressures.size):
+        i = layer_start[layer[k]]
+        while pressures[k] >= p_max[i]:
+            i += 1
+        rho = 0.0
+        for c in range(weight.shape[1]):
+            if weight[i, c] > 0:
+                rho_c, n, cap = density_from_p_scalar(pressures[k], rho0[i, c], B0[i, c], B1[i, c], form[i, c],
+                                                      thresh, rtol, max_steps)
+                rho += weight[i, c] * rho_c
+                steps += n
+                capped += cap
+        pressure = 0.0
+        for c in range(weight.shape[1]):
+            if weight[i, c] > 0:
+                pressure += weight[i, c] * eos_pressure(form[i, c], rho, rho0[i, c], B0[i, c], B1[i, c])
+        densities[k] = rho
+        new_pressures[k] = pressure
+    return densities, new_pressures, steps, capped
+
+@numba.njit(cache=True)
+def solve(radii, layer, densities, layer_start, p_max, weight, rho0, B0, B1, form, discrepancy, max_calls, min_calls,
+          check_shells, damping, residuals, alignments, previous, history, proposals, counts, rtol, inversion_rtol,
+          max_inversion_steps):
+    #With rtol > 0, each checked shell must change by less than rtol times its density instead of discrepancy.
+    #Returns the number of capped inversions over all iterations and in the last one.
+    #For every unconverged iteration, keeps its starting and new densities (history, proposals) and its Newton
+    #steps and capped inversions (counts), so the caller can roll back to the iteration a monitor flags.
+    calls = 1
+    steps = 0
+    capped = 0
+    checked = min(check_shells, densities.size)
+    while calls <= max_calls:
+        gravities, pressures = adams_williamson(radii, densities)
+        new_densities, new_pressures, n, cap = density_step(pressures, layer, layer_start, p_max, weight, rho0, B0, B1,
+                                                            form, 0.01, inversion_rtol, max_inversion_steps)
+        steps += n
+        capped += cap
+        converged = calls >= min_calls
+        residual = 0.0
+        dot = 0.0
+        norm = 0.0
+        previous_norm = 0.0
+        for k in range(checked):
+            delta = new_densities[k] - densities[k]
+            if not abs(delta) < (discrepancy if rtol == 0 else rtol * abs(new_densities[k])):
+                converged = False
+            residual = max(residual, abs(delta))
+            if not np.isfinite(delta):
+                residual = np.inf
+            dot += delta * previous[k]
+            norm += delta * delta
+            previous_norm += previous[k] * previous[k]
+            previous[k] = delta
+        if converged:
+            return new_densities, new_pressures, gravities, calls, steps, capped, cap
+        history[calls - 1, :] = densities
+        proposals[calls - 1, :] = new_densities
+        counts[calls - 1, 0] = n
+        counts[calls - 1, 1] = cap
+        residuals[calls - 1] = residual
+        alignments[calls - 1] = dot / np.sqrt(norm * previous_norm) if norm * previous_norm > 0 else 0.0
+        if damping == 1.0:
+            densities = new_densities
+        else:
+            densities = densities + damping * (new_densities - densities)
+        calls += 1
+    return densities, densities, densities, -1, steps, capped, 0
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Planet Profile
+
+PlanetProfile is the result type of looped_solver.Solver and eos_kernels.solve_planet: the radius, density,
+pressure and gravity of every shell as NumPy arrays, the layer index of each shell (0 core, 1 mantle, 2 ice),
+whether the densities converged and how many iterations were needed.
+
+Slicing and reductions work on the arrays directly, without copying and without per-shell objects:
+    profile = Solver(radii_list, insert_dict)
+    profile.pressure[profile.layer == 2].max()       # max pressure in the ice layer
+    ice = profile.layer_slice(2)                      # shells of the ice layer, as a slice (views, no copy)
+    profile.radius[ice], profile.gravity[ice]
+
+For compatibility with code written for the earlier (densities, pressures) tuples, a profile still unpacks
+and indexes as one: densities, pressures = Solver(...), or Solver(...)[1].
+A solve that does not converge returns a profile with converged=False instead of ([0], [0]), and a
+divergence.SolveFailure record of why it was given up on as its failure.
+"""
+
+import numpy as np
+
+
+class PlanetProfile:
+    """
+    Radial profiles of a solved planet.
+
+    Parameters:
+    radius (array): Radius of each shell (m).
+    density (array): Density of each shell (kg/m^3).
+    pressure (array): Pressure of each shell (Pa). nan where the solve did not produce one.
+    gravity (array): Gravitational acceleration at each shell (m/s^2). nan where the solve did not produce one.
+    layer (array): Layer index of each shell (0 core, 1 mantle, 2 ice).
+    converged (bool, optional): Whether the densities were self-consistent. Defaults to True.
+    iterations (int, optional): Number of solver iterations. Defaults to 0.
+    failure (SolveFailure, optional): Why a solve that did not converge was given up on. Defaults to None.
+    """
+
+    __slots__ = ('radius', 'density', 'pressure', 'gravity', 'layer', 'converged', 'iterations', 'failure')
+
+    def __init__(self, radius, density, pressure, gravity, layer, converged=True, iterations=0, failure=None):
+        self.radius = np.asarray(radius, dtype=float)
+        self.density = np.asarray(density, dtype=float)
+        self.pressure = np.asarray(pressure, dtype=float)
+        self.gravity = np.asarray(gravity, dtype=float)
+        self.layer = np.asarray(layer, dtype=np.int64)
+        self.converged = bool(converged)
+        self.iterations = int(iterations)
+        self.failure = failure
+
+    @classmethod
+    def failed(cls, radius, density, layer, iterations, failure=None):
+        """Profile of a solve that did not converge: the last densities, with nan pressure and gravity."""
+        nan = np.full(len(radius), np.nan)
+        return(cls(radius, density, nan, nan, layer, converged=False, iterations=iterations, failure=failure))
+
+    def __iter__(self):
+        #Unpacks as the (densities, pressures) tuple returned by earlier versions of Solver.
+        yield self.density
+        yield self.pressure
+
+    def __getitem__(self, index):
+        return((self.density, self.pressure)[index])
+
+    def __repr__(self):
+        failure = '' if self.failure is None else f", failure={self.failure.reason!r}"
+        return(f"PlanetProfile(shells={self.radius.size}, converged={self.converged}, iterations={self.iterations}{failure})")
+
+    def layer_slice(self, layer):
+        """
+        Returns the slice of shells in a layer. Layers are contiguous and ordered outward,
+        so indexing an array with the slice gives a view rather than a copy.
+        """
+        start, stop = np.searchsorted(self.layer, [layer, layer + 1])
+        return(slice(int(start), int(stop)))
+
+    def mass(self):
+        """Total mass of the planet (kg), each shell extending from the previous radius to its own."""
+        outer = self.radius ** 3
+        inner = np.concatenate([[0.0], outer[:-1]])
+        return(float(np.sum((4 / 3) * np.pi * (outer - inner) * self.density)))
@@ -1,82 +1,237 @@
 #!/usr/bin/env python
 # coding: utf-8
-
-# In[ ]:
-
-
-get_ipython().run_line_magic('matplotlib', 'inline')
-
-
-# 
-# PREM: Preliminary Reference Earth Model
-# =======================================
-# 
-# The Preliminary reference Earth model (PREM) [Dziewonsky1981]_ is a one-dimensional
-# model representing the average Earth properties as a function of planetary radius.  The
-# model includes the depth, density, seismic velocities, attenuation (Q) and anisotropic
-# parameter ($\eta$) on the boundaries of several Earth layers.  The data is loaded
-# into :class:`pandas.DataFrame` objects, which can be used to plot and make computations.
-# 
-# 
-
-# In[88]:
-
-
-import rockhound as rh
-import matplotlib.pyplot as plt
-
-# Load PREM into a DataFrame
-prem = rh.fetch_prem()
-print(prem)
-
-
-# Plot density and velocities
-fig, axes = plt.subplots(1, 2, figsize=(9, 5), sharey=True)
-fig.suptitle("PREM: Preliminary Reference Earth Model")
-ax = axes[0]
-prem.plot("density", "depth", legend=False, ax=ax)
-ax.invert_yaxis()
-ax.set_xlabel("Density [g/cm³]")
-ax.set_ylabel("Depth [km]")
-ax.grid()
-ax = axes[1]
-for velocity in ["Vpv", "Vph", "Vsv", "Vsh"]:
-    prem.plot(velocity, "depth", legend=False, ax=ax, label=velocity)
-ax.grid()
-ax.legend()
-ax.set_xlabel("Velocity [km/s]")
-plt.show()
-
-
-# In[96]:
-
-
-get_ipython().run_line_magic('run', 'solve_bm3.ipynb')
-
-import rockhound as rh
-import matplotlib.pyplot as plt
-
-# Load PREM into a DataFrame
-prem = rh.fetch_prem()
-
-
-
-xval_list = prem.loc[:,'depth']
-sio2_yval_list = []
-mgsio3_yval_list = []
-for n in range(len(xval_list)):
-    #print(n, prem.loc[:,'density'][n] * 1000)
-    add_sio2 = bm3(prem.loc[:,'density'][n] * 1000, 2143.5, 309900000000, 4.59)
-    sio2_yval_list.append(add_sio2)
-
-    add_mgsio3 = bm3(prem.loc[:,'density'][n] * 1000, 4101, 256000000000, 4)
-    mgsio3_yval_list.append(add_mgsio3)
-    
-    #add_mg2sio3 = bm3(prem.loc[:,'density'][n] * 1000, 2143.5, 309900000000, 4.59)
-    #mg2sio3_yval_list.append(add_mg2sio3)
-
-ax.set_xlabel("Depth [km] (not radius)")
-plt.plot(xval_list, sio2_yval_list)
-plt.plot(xval_list, mgsio3_yval_list)
-plt.show()
-
+"""
+PREM: Preliminary Reference Earth Model
+
+The Preliminary Reference Earth Model (PREM) [Dziewonski1981] is a one-dimensional model of the average Earth
+properties as a function of planetary radius. It is bundled offline in data/prem/prem.csv: density tabulated
+every 10 km from the PREM density polynomials (both sides of each discontinuity are listed), with gravity and
+hydrostatic pressure integrated from that density profile.
+
+Since the solver reaches real planets only through its EoS parameters, PREM serves as a calibration check:
+- eos_residuals(): evaluates the core and mantle EoS at PREM pressures and compares with PREM density.
+- compare_to_solver(): solves an Earth-like planetary_dictionary and compares its density and pressure
+  profiles with PREM, shell by shell.
+Both are vectorized and need no network access, so they can be rerun after every change to EoS_Bits.
+
+Usage:
+    import prem
+    result = prem.compare_to_solver()
+    result['pressure_rms'], result['layers']['mantle']['density_rms']
+"""
+
+import csv
+import os
+
+import numpy as np
+
+import eos_kernels as ek
+import planetary_dictionary as dct
+from looped_solver import Solver
+
+PREM_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'prem', 'prem.csv')
+
+PREM_RADIUS = 6371 * (10 ** 3)
+CORE_RADIUS = 3480 * (10 ** 3)
+OCEAN_DEPTH = 3 * (10 ** 3)
+
+LAYERS = ['core', 'mantle', 'ice']
+#Solver layers. PREM's inner and outer core map to the core, everything from the core-mantle boundary to
+#the base of the ocean (including the crust) to the mantle, and the ocean to the ice layer.
+
+REGION_LAYER = {'inner_core': 0, 'outer_core': 0, 'lower_mantle': 1, 'transition_zone': 1, 'upper_mantle': 1,
+                'crust': 1, 'ocean': 2}
+
+
+def load_prem(filename=PREM_FILE):
+    """
+    Loads the bundled PREM table.
+
+    Parameters:
+    filename (str, optional): PREM csv. Defaults to data/prem/prem.csv.
+
+    Returns:
+    dict: Arrays in SI units, ordered by increasing radius:
+        - 'radius', 'depth' (m)
+        - 'region': PREM region name of each row (eg: 'outer_core')
+        - 'layer': Solver layer index of each row (0 core, 1 mantle, 2 ice)
+        - 'density' (kg/m^3), 'pressure' (Pa), 'gravity' (m/s^2)
+    """
+    with open(filename, 'r') as f:
+        reader = csv.reader(f)
+        next(reader)
+        rows = list(reader)
+
+    columns = list(zip(*rows))
+    region = np.array(columns[2])
+    return({
+        'radius': np.array(columns[0], dtype=float) * (10 ** 3),
+        'depth': np.array(columns[1], dtype=float) * (10 ** 3),
+        'region': region,
+        'layer': np.array([REGION_LAYER[name] for name in region]),
+        'density': np.array(columns[3], dtype=float),
+        'pressure': np.array(columns[4], dtype=float) * (10 ** 9),
+        'gravity': np.array(columns[5], dtype=float)
+    })
+
+
+def interpolate(prem, radii, field, layer=None):
+    """
+    Interpolates a PREM field at arbitrary radii.
+
+    Parameters:
+    prem (dict): PREM table from load_prem().
+    radii (array): Radii (m).
+    field (str): 'density', 'pressure' or 'gravity'.
+    layer (array, optional): Solver layer of each radius. If given, each radius is interpolated within the
+                             PREM rows of its own layer, so that densities are not smeared across the core-mantle
+                             boundary when the model's boundary does not fall exactly on PREM's.
+
+    Returns:
+    array: The field at each radius.
+    """
+    radii = np.asarray(radii, dtype=float)
+    if layer is None:
+        return(np.interp(radii, prem['radius'], prem[field]))
+    values = np.zeros(radii.shape)
+    layer = np.asarray(layer)
+    for l in np.unique(layer):
+        rows = prem['layer'] == l
+        values[layer == l] = np.interp(radii[layer == l], prem['radius'][rows], prem[field][rows])
+    return(values)
+
+
+def earth_dictionary():
+    """
+    Returns an Earth-like planetary_dictionary: PREM's radius, an iron core out to the core-mantle boundary,
+    a silicate mantle up to the 3 km ocean, which is modelled as the ice layer.
+    """
+    return(dct.planetary_dictionary(PREM_RADIUS / dct.r_earth, CORE_RADIUS / PREM_RADIUS,
+                                    (PREM_RADIUS - OCEAN_DEPTH - CORE_RADIUS) / PREM_RADIUS))
+
+
+def phase_pressures(phases, prem=None):
+    """
+    Evaluates the pressure of single phases at PREM densities, eg: to compare bridgmanite with the lower mantle.
+
+    Parameters:
+    phases (list): Phase names from EoS_Bits (eg: ['stichovite', 'bridgmanite']).
+    prem (dict, optional): PREM table. Defaults to load_prem().
+
+    Returns:
+    dict: A dictionary mapping each phase to the pressure (Pa) at every PREM density.
+    """
+    prem = load_prem() if prem is None else prem
+    params = ek.material_params()
+    return({phase: ek.pressure(prem['density'], params[phase]['rho0'], params[phase]['B0'], params[phase]['B1'],
+                               params[phase]['form']) for phase in phases})
+
+
+def _summarize(model, reference, layer, field):
+    residual = model - reference
+    summary = {f'{field}_rms': float(np.sqrt(np.mean(residual ** 2))),
+               f'{field}_max_abs': float(np.max(np.abs(residual)))}
+    if field == 'density':
+        summary['density_relative_rms'] = float(np.sqrt(np.mean((residual / reference) ** 2)))
+        #Pressure has no relative rms: it vanishes at the surface.
+    layers = {}
+    for l, name in enumerate(LAYERS):
+        in_layer = layer == l
+        if in_layer.any():
+            layers[name] = {f'{field}_rms': float(np.sqrt(np.mean(residual[in_layer] ** 2))),
+                            f'{field}_max_abs': float(np.max(np.abs(residual[in_layer])))}
+    return(residual, summary, layers)
+
+
+def eos_residuals(params=None, prem=None):
+    """
+    Compares the densities predicted by the EoS of each layer at PREM pressures with PREM density.
+
+    This checks the EoS parameters on their own, independently of the solver's integration.
+
+    Parameters:
+    params (dict, optional): Phase parameter overrides, as accepted by eos_kernels.material_params().
+    prem (dict, optional): PREM table. Defaults to load_prem().
+
+    Returns:
+    dict: 'radius', 'layer', 'density' (model), 'density_residual' (model - PREM) arrays, the overall
+          'density_rms', 'density_max_abs' and 'density_relative_rms', and 'layers', the rms and max per layer.
+    """
+    prem = load_prem() if prem is None else prem
+    density = ek.layer_densities(prem['pressure'], prem['layer'], params)
+    residual, summary, layers = _summarize(density, prem['density'], prem['layer'], 'density')
+    return({'radius': prem['radius'], 'layer': prem['layer'], 'density': density, 'density_residual': residual,
+            **summary, 'layers': layers})
+
+
+def compare_to_solver(solver=Solver, shells=1000, prem=None, **solver_options):
+    """
+    Solves an Earth-like planet and compares its profiles with PREM at every shell.
+
+    Parameters:
+    solver (function, optional): Solver or a drop-in such as eos_kernels.solve_planet. Defaults to Solver.
+    shells (int, optional): Number of shells, as in the Monte Carlo runs. Defaults to 1000.
+    prem (dict, optional): PREM table. Defaults to load_prem().
+    **solver_options: Extra keyword arguments for the solver (eg: discrepancy, or params for solve_planet).
+
+    Returns:
+    dict: Residuals (model - PREM) and their summaries:
+        - 'radius', 'layer', 'density', 'pressure': the solved profiles (m, -, kg/m^3, Pa)
+        - 'density_residual', 'pressure_residual': arrays at each radius
+        - 'density_rms', 'density_max_abs', 'density_relative_rms', 'pressure_rms' and 'pressure_max_abs'
+        - 'layers': the rms and max residuals per layer
+        - 'central_pressure', 'prem_central_pressure' (Pa) and 'mass', 'prem_mass' (kg)
+    """
+    prem = load_prem() if prem is None else prem
+    insert_dict = earth_dictionary()
+    radii_list = [*range(1, int(PREM_RADIUS), int(PREM_RADIUS / shells))]
+
+    profile = solver(radii_list, insert_dict, **solver_options)
+    if not profile.converged:
+        raise RuntimeError(f"The solver did not converge for the Earth-like planet ({profile.failure}).")
+
+    radii, densities, pressures, layer = profile.radius, profile.density, profile.pressure, profile.layer
+    density_residual, density_summary, density_layers = _summarize(
+        densities, interpolate(prem, radii, 'density', layer), layer, 'density')
+    pressure_residual, pressure_summary, pressure_layers = _summarize(
+        pressures, interpolate(prem, radii, 'pressure', layer), layer, 'pressure')
+
+    integrand = 4 * np.pi * prem['radius'] ** 2 * prem['density']
+    prem_mass = np.sum(0.5 * (integrand[1:] + integrand[:-1]) * np.diff(prem['radius']))
+    #Trapezoid rule on the 10 km table; rows repeated at discontinuities add nothing.
+
+    return({'radius': radii, 'layer': layer, 'density': densities, 'pressure': pressures,
+            'density_residual': density_residual, 'pressure_residual': pressure_residual,
+            **density_summary, **pressure_summary,
+            'layers': {name: {**density_layers.get(name, {}), **pressure_layers.get(name, {})}
+                       for name in LAYERS if name in density_layers},
+            'central_pressure': float(pressures[0]), 'prem_central_pressure': float(prem['pressure'][0]),
+            'mass': profile.mass(), 'prem_mass': float(prem_mass)})
+
+
+def plot_comparison(result, plot_filename='prem_comparison.png'):
+    """Saves and shows the solved density and pressure profiles of compare_to_solver() against PREM."""
+    from matplotlib import pyplot as plt
+
+    prem = load_prem()
+    fig, axes = plt.subplots(1, 2, figsize=(9, 5), sharey=True)
+    fig.suptitle("Solver vs PREM: Preliminary Reference Earth Model")
+    for ax, field, scale, label in [(axes[0], 'density', 1, "Density [kg/m³]"),
+                                    (axes[1], 'pressure', 1e9, "Pressure [GPa]")]:
+        ax.plot(prem[field] / scale, prem['depth'] / 1e3, label='PREM')
+        ax.plot(result[field] / scale, (PREM_RADIUS - result['radius']) / 1e3, label='Solver')
+        ax.set_xlabel(label)
+        ax.grid()
+    axes[0].invert_yaxis()
+    axes[0].set_ylabel("Depth [km]")
+    axes[1].legend()
+    plt.savefig(plot_filename, bbox_inches='tight')
+    plt.show()
+
+
+if __name__ == '__main__':
+    result = compare_to_solver()
+    print(f"Density rms residual: {result['density_rms']:.1f} kg/m^3, pressure rms residual: {result['pressure_rms'] / 1e9:.2f} GPa")
+    for name, values in result['layers'].items():
+        print(name, values)
+    plot_comparison(result)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Profile Archive
+
+Append-only on-disk archive of full radial profiles (radius, density, pressure and gravity) for every solved
+planet, so that new questions can be answered from stored profiles instead of re-solving the population.
+
+An archive is a directory holding:
+- index.csv: one row per planet with its planet_id, its sampled parameters, and the offset and length of its
+  profile in the data files.
+- radius.f32, density.f32, pressure.f32, gravity.f32: the profiles of all planets concatenated end to end as
+  raw little-endian float32 values.
+
+Readers memory-map the data files, so slicing a profile only touches the pages it needs and the archive never
+has to fit in memory. Profiles are appended data first and index row last; rows written by an interrupted
+append are ignored and trimmed the next time the archive is opened for writing.
+
+Usage:
+    import profile_archive as pa
+    with pa.ProfileArchive('profiles', mode='a') as archive:
+        archive.append(7, {'rand_earth': 0.8, 'rand_ice': 0.5}, radii, densities, pressures, gravities)
+
+    archive = pa.ProfileArchive('profiles')
+    archive.index['rand_earth']            # sampled radius of every planet
+    archive.profile(7)['pressure'][-10:]   # lazily sliced float32 array
+    archive.values('pressure')             # every planet's pressures, end to end
+"""
+
+import csv
+import os
+
+import numpy as np
+
+FIELDS = ['radius', 'density', 'pressure', 'gravity']
+#Profile arrays stored for each planet, one data file per field.
+
+DTYPE = np.dtype('<f4')
+
+
+def _trim_partial_line(filename):
+    #Drops a final index row that an interrupted append left without its newline.
+    if not os.path.exists(filename):
+        return
+    with open(filename, 'rb+') as f:
+        content = f.read()
+        if content and not content.endswith(b'\n'):
+            f.truncate(content.rfind(b'\n') + 1)
+
+
+class ProfileArchive:
+    """
+    An append-only archive of planet profiles stored in a directory.
+
+    Parameters:
+    path (str): Directory of the archive.
+    mode (str, optional): 'r' to read an existing archive, 'a' to create it if needed and append. Defaults to 'r'.
+    """
+
+    def __init__(self, path, mode='r'):
+        if mode not in ('r', 'a'):
+            raise ValueError("mode must be 'r' or 'a'.")
+        self.path = path
+        self.mode = mode
+        self._maps = {}
+        self._files = {}
+        self._index_file = None
+
+        index_path = os.path.join(path, 'index.csv')
+        if mode == 'a':
+            os.makedirs(path, exist_ok=True)
+            _trim_partial_line(index_path)
+        elif not os.path.exists(index_path):
+            raise FileNotFoundError(f"No profile archive at '{path}'.")
+        self._read_index(index_path)
+
+        if mode == 'a':
+            #Trim anything past the last indexed profile, left behind by an interrupted append.
+            end = int(self.index['offset'][-1] + self.index['length'][-1]) if len(self) else 0
+            for field in FIELDS:
+                with open(os.path.join(path, f'{field}.f32'), 'ab') as f:
+                    f.truncate(end * DTYPE.itemsize)
+                self._files[field] = open(os.path.join(path, f'{field}.f32'), 'ab')
+            self._end = end
+
+    def _read_index(self, index_path):
+        self.parameters = []
+        rows = []
+        if os.path.exists(index_path):
+            with open(index_path, 'r', newline='') as f:
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if header is not None:
+                    self.parameters = header[1:-2]
+                    rows = [row for row in reader if len(row) == len(header)]
+        columns = list(zip(*rows)) if rows else [[] for _ in range(len(self.parameters) + 3)]
+        self.index = {'planet_id': np.array(columns[0], dtype=np.int64)}
+        for k, name in enumerate(self.parameters):
+            self.index[name] = np.array(columns[k + 1], dtype=float)
+        self.index['offset'] = np.array(columns[-2], dtype=np.int64)
+        self.index['length'] = np.array(columns[-1], dtype=np.int64)
+        self._rows = {planet_id: k for k, planet_id in enumerate(self.index['planet_id'].tolist())}
+
+    def __len__(self):
+        return len(self.index['planet_id'])
+
+    def __contains__(self, planet_id):
+        return planet_id in self._rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        """Flushes and closes the files held open for appending."""
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+
+    def append(self, planet_id, parameters, radii, densities, pressures, gravities):
+        """
+        Appends the profile of one planet.
+
+        Parameters:
+        planet_id (int): Identifier of the planet, eg: its row in the Monte Carlo csv. Must be unique.
+        parameters (dict): Sampled parameters of the planet (eg: rand_earth, rand_ice). Every planet in an
+                           archive must have the same parameter names.
+        radii, densities, pressures, gravities (list): Profiles at each radius (m, kg/m^3, Pa, m/s^2).
+        """
+        if self.mode != 'a':
+            raise ValueError("Archive was opened read-only; open it with mode='a' to append.")
+        if planet_id in self._rows:
+            raise ValueError(f"Planet {planet_id} is already in the archive.")
+        if not self.parameters and not len(self):
+            self.parameters = list(parameters.keys())
+        elif list(parameters.keys()) != self.parameters:
+            raise ValueError(f"Expected parameters {self.parameters}, got {list(parameters.keys())}.")
+
+        arrays = [np.asarray(values, dtype=DTYPE) for values in (radii, densities, pressures, gravities)]
+        length = len(arrays[0])
+        if any(len(values) != length for values in arrays):
+            raise ValueError("radii, densities, pressures and gravities must be the same length.")
+
+        for field, values in zip(FIELDS, arrays):
+            self._files[field].write(values.tobytes())
+            self._files[field].flush()
+
+        index_path = os.path.join(self.path, 'index.csv')
+        if self._index_file is None:
+            new = not os.path.exists(index_path) or os.path.getsize(index_path) == 0
+            self._index_file = open(index_path, 'a', newline='')
+            if new:
+                csv.writer(self._index_file).writerow(['planet_id'] + self.parameters + ['offset', 'length'])
+        csv.writer(self._index_file).writerow([planet_id] + [parameters[name] for name in self.parameters]
+                                              + [self._end, length])
+        self._index_file.flush()
+
+        self._rows[planet_id] = len(self)
+        self.index['planet_id'] = np.append(self.index['planet_id'], planet_id)
+        for name in self.parameters:
+            self.index[name] = np.append(self.index.get(name, np.array([])), parameters[name])
+        self.index['offset'] = np.append(self.index['offset'], self._end)
+        self.index['length'] = np.append(self.index['length'], length)
+        self._end += length
+        self._maps = {}
+
+    def _map(self, field):
+        if field not in self._maps:
+            filename = os.path.join(self.path, f'{field}.f32')
+            if os.path.getsize(filename) == 0:
+                self._maps[field] = np.zeros(0, dtype=DTYPE)
+            else:
+                self._maps[field] = np.memmap(filename, dtype=DTYPE, mode='r')
+        return self._maps[field]
+
+    def row(self, planet_id):
+        """Returns the row of a planet in index."""
+        return self._rows[planet_id]
+
+    def values(self, field):
+        """
+        Returns the memory-mapped float32 array of one field for every planet, end to end. The profile of the
+        planet in row k of index is values(field)[offset[k]:offset[k] + length[k]].
+        """
+        return self._map(field)
+
+    def profile(self, planet_id, fields=None):
+        """
+        Returns the stored profiles of one planet as memory-mapped float32 arrays (no data is copied).
+
+        Parameters:
+        planet_id (int): Identifier of the planet.
+        fields (list, optional): Which of FIELDS to return. Defaults to all of them.
+
+        Returns:
+        dict: A dictionary mapping each field to its array.
+        """
+        k = self._rows[planet_id]
+        start = int(self.index['offset'][k])
+        stop = start + int(self.index['length'][k])
+        return {field: self._map(field)[start:stop] for field in (fields or FIELDS)}
+
+    def profiles(self, planet_ids=None, fields=None):
+        """
+        Iterates lazily over (planet_id, profile) pairs, in archive order by default.
+
+        Parameters:
+        planet_ids (list, optional): Planets to visit. Defaults to every planet in the archive.
+        fields (list, optional): Which of FIELDS to return. Defaults to all of them.
+        """
+        for planet_id in (self.index['planet_id'].tolist() if planet_ids is None else planet_ids):
+            yield planet_id, self.profile(planet_id, fields)
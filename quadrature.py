@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Radial Quadrature
+
+Selectable integration rules for the enclosed mass and the Adams-Williamson pressure of a planet whose density
+is known at evenly spaced radii (the shells of a radii_list).
+
+Methods:
+- 'rectangle': the original rule of solve_adams_williamson, mass += 4 pi r^2 step rho and pressure summed
+  outward from each shell. First order in the step size.
+- 'shell': exact shell volumes, 4/3 pi (r_k^3 - r_(k-1)^3), with each shell at its own density. Still first
+  order, but without the volume error of 4 pi r^2 step near the centre.
+- 'trapezoid': density varies linearly between shells and is integrated exactly against r^2; pressure uses the
+  trapezoid rule. Second order.
+- 'simpson': density and the pressure integrand are interpolated by quadratics through neighbouring shells
+  (averaging the two stencils of each interval where both fit in one layer). Third order or better.
+
+For every method but 'rectangle', the density jump at each layer cutoff is placed at the cutoff itself rather
+than smeared over the interval that contains it: each side of the cutoff is extrapolated from its own layer,
+and the pressure integrand is split there. Phase transitions inside a layer are not located, so they still
+limit the order of convergence close to them.
+
+The original grid, [*range(1, int(radius), int(radius / shells))], stops short of the surface by up to one
+step, which is a first-order error of its own; shell_radii() gives a grid ending at the surface.
+
+quadrature_convergence.py measures the error of each method against shell count.
+
+Usage:
+    import quadrature as quad
+    radii = quad.shell_radii(radius, 200)
+    gravities, pressures = quad.adams_williamson(radii, densities, 'simpson', cutoffs=[*insert_dict.keys()])
+"""
+
+import numpy as np
+
+G = 6.6743015 / (10 ** 11)
+
+METHODS = ['rectangle', 'shell', 'trapezoid', 'simpson']
+
+
+def shell_radii(radius, shells):
+    """
+    Returns shells evenly spaced radii ending at the surface: radius / shells, 2 radius / shells, ..., radius.
+
+    Parameters:
+    radius (float): Planet radius (m).
+    shells (int): Number of shells.
+    """
+    return(np.arange(1, shells + 1) * (radius / shells))
+
+
+def _layers(radii, cutoffs):
+    if cutoffs is None:
+        return(np.zeros(radii.size, dtype=np.int64), np.array([np.inf]))
+    cutoffs = np.array(cutoffs, dtype=float)
+    cutoffs[-1] = max(cutoffs[-1], radii[-1])
+    return(np.searchsorted(cutoffs, radii, side='left'), cutoffs)
+
+
+def _moment(x0, lo, hi, p0, p1, p2):
+    #Integral of r^2 (p0 + p1 (r - x0) + p2 (r - x0)^2) from lo to hi, expanded in u = r - x0.
+    u0 = lo - x0
+    u1 = hi - x0
+    coefficients = [x0 ** 2 * p0, x0 ** 2 * p1 + 2 * x0 * p0, x0 ** 2 * p2 + 2 * x0 * p1 + p0, 2 * x0 * p2 + p1, p2]
+    return(sum(c * (u1 ** (j + 1) - u0 ** (j + 1)) / (j + 1) for j, c in enumerate(coefficients)))
+
+
+def _integral(x0, lo, hi, p0, p1, p2):
+    #Integral of p0 + p1 (r - x0) + p2 (r - x0)^2 from lo to hi.
+    u0 = lo - x0
+    u1 = hi - x0
+    return(p0 * (u1 - u0) + p1 * (u1 ** 2 - u0 ** 2) / 2 + p2 * (u1 ** 3 - u0 ** 3) / 3)
+
+
+def _evaluate(x0, x, p0, p1, p2):
+    return(p0 + p1 * (x - x0) + p2 * (x - x0) ** 2)
+
+
+def _quadratic(values, k, h):
+    #Coefficients about node k of the quadratic through nodes k - 1, k and k + 1 (indices clipped to the array).
+    lower = values[np.clip(k - 1, 0, values.size - 1)]
+    middle = values[k]
+    upper = values[np.clip(k + 1, 0, values.size - 1)]
+    return(middle, (upper - lower) / (2 * h), (upper - 2 * middle + lower) / (2 * h ** 2))
+
+
+def _interval_fits(values, radii, layer, h, method):
+    """
+    Polynomial fits of values over each interval k = 1 .. n - 1 between radii[k - 1] and radii[k],
+    given as lists of (weight, x0, p0, p1, p2) terms whose weighted sum is the fit.
+    """
+    n = radii.size
+    k = np.arange(1, n)
+    a = radii[:-1]
+    same = layer[1:] == layer[:-1]
+    if method == 'trapezoid' or n < 3:
+        return([(1.0, a, values[:-1], (values[1:] - values[:-1]) / h, 0.0)])
+
+    #Quadratic about node k - 1 (nodes k - 2, k - 1, k) and about node k (nodes k - 1, k, k + 1).
+    back_ok = np.concatenate([[False], same[:-1]]) & same
+    ahead_ok = np.concatenate([same[1:], [False]]) & same
+    weight_back = np.where(back_ok & ahead_ok, 0.5, np.where(back_ok, 1.0, 0.0))
+    weight_ahead = np.where(back_ok & ahead_ok, 0.5, np.where(ahead_ok, 1.0, 0.0))
+    weight_linear = 1.0 - weight_back - weight_ahead
+    return([(weight_back, radii[k - 1], *_quadratic(values, k - 1, h)),
+            (weight_ahead, radii[k], *_quadratic(values, k, h)),
+            (weight_linear, a, values[:-1], (values[1:] - values[:-1]) / h, 0.0)])
+
+
+def _side_slopes(values, layer, h):
+    #Slope of each layer's values at its last (below) and first (above) node, from its neighbour in the layer.
+    below = np.zeros(values.size)
+    below[1:] = np.where(layer[1:] == layer[:-1], (values[1:] - values[:-1]) / h, 0.0)
+    above = np.zeros(values.size)
+    above[:-1] = np.where(layer[:-1] == layer[1:], (values[1:] - values[:-1]) / h, 0.0)
+    return(below, above)
+
+
+def _integrate(radii, densities, method, cutoffs):
+    radii = np.asarray(radii, dtype=float)
+    densities = np.asarray(densities, dtype=float)
+    if method not in METHODS:
+        raise ValueError(f"Unknown quadrature '{method}'; choose from {METHODS}.")
+
+    h = radii[1] - radii[0]
+    if method == 'rectangle':
+        shell_mass = 4 * np.pi * (radii ** 2) * h * densities
+        mass = np.cumsum(shell_mass)
+        integrand = (G * mass * densities) / (radii ** 2)
+        total_pressure = np.cumsum(integrand * h)
+        return(mass, integrand / densities, total_pressure[-1] - total_pressure)
+
+    layer, cutoffs = _layers(radii, cutoffs)
+    a, b = radii[:-1], radii[1:]
+    jump = layer[1:] != layer[:-1]
+    c = np.where(jump, np.clip(cutoffs[np.minimum(layer[:-1], cutoffs.size - 1)], a, b), b)
+    #Interval k runs from a to b; where it crosses a cutoff at c, [a, c] belongs to the lower layer and [c, b]
+    #to the upper one. Without a cutoff, c = b.
+
+    if method == 'shell':
+        lower_density = (a, densities[:-1], 0.0, 0.0)
+        upper_density = (b, densities[1:], 0.0, 0.0)
+        whole = 4 * np.pi * _moment(a, a, b, densities[1:], 0.0, 0.0)
+    else:
+        slope_below, slope_above = _side_slopes(densities, layer, h)
+        lower_density = (a, densities[:-1], slope_below[:-1], 0.0)
+        upper_density = (b, densities[1:], slope_above[1:], 0.0)
+        whole = sum(4 * np.pi * w * _moment(x0, a, b, p0, p1, p2)
+                    for w, x0, p0, p1, p2 in _interval_fits(densities, radii, layer, h, method))
+    lower_x0, *lower_p = lower_density
+    upper_x0, *upper_p = upper_density
+    lower_mass = 4 * np.pi * _moment(lower_x0, a, c, *lower_p)
+    upper_mass = 4 * np.pi * _moment(upper_x0, c, b, *upper_p)
+    interval_mass = np.where(jump, lower_mass + upper_mass, whole)
+
+    mass = (4 / 3) * np.pi * radii[0] ** 3 * densities[0] + np.concatenate([[0.0], np.cumsum(interval_mass)])
+    gravities = G * mass / radii ** 2
+    integrand = densities * gravities
+
+    if method == 'shell':
+        interval_pressure = integrand[1:] * h
+    else:
+        #At a cutoff, the integrand jumps with the density while the enclosed mass stays continuous.
+        gravity_c = G * (mass[:-1] + lower_mass) / c ** 2
+        below_c = _evaluate(lower_x0, c, *lower_p) * gravity_c
+        above_c = _evaluate(upper_x0, c, *upper_p) * gravity_c
+        split = (integrand[:-1] + below_c) / 2 * (c - a) + (above_c + integrand[1:]) / 2 * (b - c)
+        if method == 'trapezoid':
+            whole = (integrand[:-1] + integrand[1:]) / 2 * h
+        else:
+            whole = sum(w * _integral(x0, a, b, p0, p1, p2)
+                        for w, x0, p0, p1, p2 in _interval_fits(integrand, radii, layer, h, method))
+        interval_pressure = np.where(jump, split, whole)
+
+    total_pressure = np.concatenate([[0.0], np.cumsum(interval_pressure)])
+    return(mass, gravities, total_pressure[-1] - total_pressure)
+
+
+def enclosed_mass(radii, densities, method='rectangle', cutoffs=None):
+    """
+    Returns the mass inside each radius.
+
+    Parameters:
+    radii (array): Evenly spaced radii (m).
+    densities (array): Density at each radius (kg/m^3).
+    method (str, optional): One of METHODS. Defaults to 'rectangle'.
+    cutoffs (list, optional): Outer radius of each layer (eg: the keys of a planetary_dictionary), where the
+                              density may jump. Defaults to a single layer.
+
+    Returns:
+    array: Enclosed mass at each radius (kg).
+    """
+    return(_integrate(radii, densities, method, cutoffs)[0])
+
+
+def adams_williamson(radii, densities, method='rectangle', cutoffs=None):
+    """
+    Returns the gravity and the Adams-Williamson pressure at each radius, the pressure being zero at the last one.
+
+    Parameters:
+    radii (array): Evenly spaced radii (m).
+    densities (array): Density at each radius (kg/m^3).
+    method (str, optional): One of METHODS. Defaults to 'rectangle'.
+    cutoffs (list, optional): Outer radius of each layer, where the density may jump. Defaults to a single layer.
+
+    Returns:
+    tuple: Two arrays, the gravity (m/s^2) and the pressure (Pa) at each radius.
+    """
+    return(_integrate(radii, densities, method, cutoffs)[1:])
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Quadrature Convergence Study
+
+Solves one planet with every radial integration rule of quadrature.py at increasing shell counts and measures
+the error of each against a Simpson solve on a much finer grid. The baseline is the original setup: the
+rectangle rule on the [*range(1, int(radius), int(radius / shells))] grid used throughout the repo.
+
+Quantities compared:
+- central_pressure: pressure at the innermost shell (Pa)
+- ice_base_pressure: pressure at the mantle-ice boundary (Pa), extrapolated from the three innermost ice shells.
+  This is the maximum ice pressure of the diamond criterion, taken at the boundary itself. The criterion as
+  coded reads the innermost ice shell instead, which lies up to one step above the boundary and so adds a
+  first-order offset whatever the rule.
+- mass: enclosed mass at the surface, integrated with the same rule (kg)
+
+Every solve checks all shells for convergence (check_shells=None) and uses a tight discrepancy, so the errors
+are those of the integration rather than of the fixed-point iteration.
+
+On the default planet (data/quadrature_convergence/convergence.csv), trapezoid and Simpson are one to two
+orders of magnitude more accurate than the rectangle rule at the same shell count, on either grid. Past a few
+hundred shells their error no longer falls
+smoothly: the phase transitions inside the mantle and ice layers, which are not located (see quadrature.py),
+dominate what is left, and Simpson then gains nothing over the trapezoid rule.
+
+Results are written to data/quadrature_convergence/convergence.csv, with one row per method and shell count,
+and plotted on log-log axes.
+
+Usage:
+    python quadrature_convergence.py
+    import quadrature_convergence as qc
+    rows = qc.convergence_study(1.0, 0.3, 0.4)
+"""
+
+import csv
+import os
+
+import numpy as np
+
+import eos_kernels as ek
+import planetary_dictionary as dct
+import quadrature
+
+r_earth = 6370 * (10 ** 3)
+
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'quadrature_convergence')
+
+SHELL_COUNTS = [50, 100, 200, 400, 800, 1600, 3200]
+
+REFERENCE_SHELLS = 25600
+
+QUANTITIES = ['central_pressure', 'ice_base_pressure', 'mass']
+
+CSV_HEADER = ['method', 'grid', 'shells', *QUANTITIES, *[f'{name}_relative_error' for name in QUANTITIES]]
+
+
+def _ice_base_pressure(profile, boundary):
+    #Quadratic through the three innermost ice shells, evaluated at the boundary.
+    start = profile.layer_slice(2).start
+    radii = profile.radius[start:start + 3]
+    pressures = profile.pressure[start:start + 3]
+    return(float(np.polyval(np.polyfit(radii - boundary, pressures, 2), 0.0)))
+
+
+def solve_quantities(insert_dict, radii, method, discrepancy=1e-3, backend=None):
+    """
+    Solves a planet on the given radii with one quadrature rule.
+
+    Parameters:
+    insert_dict (dict): A planetary_dictionary.
+    radii (array): Evenly spaced radii (m).
+    method (str): One of quadrature.METHODS.
+    discrepancy (float, optional): Convergence threshold in kg/m^3. Defaults to 1e-3.
+    backend (str, optional): eos_kernels backend.
+
+    Returns:
+    dict: The central_pressure, ice_base_pressure (Pa) and mass (kg) of the solved planet.
+    """
+    profile = ek.solve_planet(radii, insert_dict, discrepancy=discrepancy, backend=backend, quadrature_rule=method,
+                              check_shells=None)
+    if not profile.converged:
+        raise RuntimeError(f"The {method} solve with {len(radii)} shells did not converge.")
+
+    cutoffs = [*insert_dict.keys()]
+    mass = quadrature.enclosed_mass(profile.radius, profile.density, method, cutoffs)[-1]
+    return({'central_pressure': float(profile.pressure[0]),
+            'ice_base_pressure': _ice_base_pressure(profile, cutoffs[1]),
+            'mass': float(mass)})
+
+
+def convergence_study(earth_rad=1.0, fe=0.3, si=0.4, shell_counts=SHELL_COUNTS, reference_shells=REFERENCE_SHELLS,
+                      methods=quadrature.METHODS, backend=None):
+    """
+    Measures the error of each quadrature rule against shell count.
+
+    Parameters:
+    earth_rad (float, optional): Planet radius in Earth radii. Defaults to 1.
+    fe (float, optional): Fractional depth of the iron core. Defaults to 0.3.
+    si (float, optional): Fractional depth of the silicate mantle. Defaults to 0.4.
+    shell_counts (list, optional): Shell counts to test. Defaults to SHELL_COUNTS.
+    reference_shells (int, optional): Shell count of the Simpson reference solve. Defaults to REFERENCE_SHELLS.
+    methods (list, optional): Rules to test. Defaults to quadrature.METHODS.
+    backend (str, optional): eos_kernels backend.
+
+    Returns:
+    list: One dict per method and shell count with the keys of CSV_HEADER. grid is 'surface' for
+          quadrature.shell_radii() and 'legacy' for the original range() grid (rectangle rule only).
+    """
+    insert_dict = dct.planetary_dictionary(earth_rad, fe, si)
+    radius = earth_rad * r_earth
+    reference = solve_quantities(insert_dict, quadrature.shell_radii(radius, reference_shells), 'simpson',
+                                 backend=backend)
+
+    runs = [('rectangle', 'legacy')] + [(method, 'surface') for method in methods]
+    rows = []
+    for method, grid in runs:
+        for shells in shell_counts:
+            if grid == 'legacy':
+                radii = np.array([*range(1, int(radius), int(radius / shells))], dtype=float)
+            else:
+                radii = quadrature.shell_radii(radius, shells)
+            values = solve_quantities(insert_dict, radii, method, backend=backend)
+            errors = {f'{name}_relative_error': abs(values[name] - reference[name]) / reference[name]
+                      for name in QUANTITIES}
+            rows.append({'method': method, 'grid': grid, 'shells': shells, **values, **errors})
+    return(rows)
+
+
+def write_csv(rows, filename=os.path.join(OUTPUT_DIR, 'convergence.csv')):
+    """Writes the rows of convergence_study() to a csv."""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, mode='w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=CSV_HEADER)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def plot_convergence(rows, plot_filename=os.path.join(OUTPUT_DIR, 'convergence.png')):
+    """Saves and shows the relative error of each quantity against shell count, on log-log axes."""
+    from matplotlib import pyplot as plt
+
+    fig, axes = plt.subplots(1, len(QUANTITIES), figsize=(13, 4.5), sharex=True)
+    fig.suptitle("Quadrature Error vs Shell Count")
+    labels = sorted({(row['method'], row['grid']) for row in rows}, key=lambda run: run[1] != 'legacy')
+    for ax, name in zip(axes, QUANTITIES):
+        for method, grid in labels:
+            run = [row for row in rows if row['method'] == method and row['grid'] == grid]
+            label = f'{method} (legacy grid)' if grid == 'legacy' else method
+            ax.loglog([row['shells'] for row in run], [row[f'{name}_relative_error'] for row in run], 'o-',
+                      label=label)
+        ax.set_title(name.replace('_', ' '))
+        ax.set_xlabel("Shells")
+        ax.grid(which='both', alpha=0.3)
+    axes[0].set_ylabel("Relative error")
+    axes[-1].legend()
+    plt.savefig(plot_filename, bbox_inches='tight')
+    plt.show()
+
+
+if __name__ == '__main__':
+    rows = convergence_study()
+    write_csv(rows)
+    for row in rows:
+        print(f"{row['method']:>9} {row['grid']:>7} {row['shells']:>5}  " +
+              "  ".join(f"{name} {row[f'{name}_relative_error']:.2e}" for name in QUANTITIES))
+    plot_convergence(rows)
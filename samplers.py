@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Monte Carlo Samplers
+
+Ways of drawing the (rand_earth, rand_ice) parameters of the Monte Carlo planet population.
+
+Available samplers:
+- 'uniform': independent uniform draws, as in the original monte_carlo_plot.
+- 'sobol': a randomly shifted two-dimensional Sobol sequence (low discrepancy).
+- 'halton': a randomly shifted Halton sequence in bases 2 and 3 (low discrepancy).
+- 'lhs': Latin hypercube sampling, one draw per stratum of each parameter.
+- 'importance': a mixture of uniform draws and draws concentrated in a band of radii around the estimated
+  diamond boundary (max ice pressure = 10 GPa). Each planet carries a weight p(x) / q(x) that undoes the
+  concentration, so weighted averages estimate the same population statistics as uniform sampling.
+
+Every sampler returns three arrays: rand_earth (Earth radii), rand_ice and the sample weights (all ones
+except for 'importance'). Population fractions should be estimated with weighted_fraction(); for importance
+samples, pass the boundary prediction from boundary_control() as a control variate.
+
+Usage:
+    import samplers
+    rand_earth, rand_ice, weights = samplers.draw('sobol', 4096, seed=1)
+"""
+
+import csv
+import os
+import random
+
+import numpy as np
+
+import criteria
+
+EARTH_RANGE = (0.5, 1.5)
+ICE_RANGE = (0.1, 0.9)
+#Sampled ranges of planet radius (Earth radii) and ice fraction, as in monte_carlo.py.
+
+BOUNDARY_GRID = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'max_pressure_colormap', 'max_pressure_data.csv')
+
+
+def _scale(unit, low_high):
+    low, high = low_high
+    return(low + (high - low) * unit)
+
+
+def uniform(number, seed=None):
+    """
+    Independent uniform draws. With seed=None the global random module is used, in the same order as the
+    original monte_carlo_plot (rand_earth, then rand_ice, for each planet), so random.seed() still applies.
+    """
+    rng = random if seed is None else random.Random(seed)
+    samples = [(rng.uniform(*EARTH_RANGE), rng.uniform(*ICE_RANGE)) for _ in range(number)]
+    rand_earth, rand_ice = (np.array(column) for column in zip(*samples)) if samples else (np.array([]), np.array([]))
+    return(rand_earth, rand_ice, np.ones(number))
+
+
+def sobol_points(number, seed=None):
+    """
+    Returns the first number points of the two-dimensional Sobol sequence as an array of shape (number, 2).
+
+    The first dimension uses the van der Corput direction numbers and the second the primitive polynomial
+    x + 1 with m_1 = 1. Points are generated in Gray-code order. If seed is given, a random digital shift
+    (XOR of the 32-bit coordinates) randomizes the sequence while keeping its low discrepancy.
+    """
+    bits = 32
+    directions = np.zeros((2, bits), dtype=np.uint64)
+    m = 1
+    for k in range(1, bits + 1):
+        directions[0, k - 1] = 1 << (bits - k)
+        if k > 1:
+            m = (2 * m) ^ m
+        directions[1, k - 1] = m << (bits - k)
+
+    points = np.zeros((number, 2), dtype=np.uint64)
+    current = np.zeros(2, dtype=np.uint64)
+    for n in range(1, number):
+        c = (~(n - 1) & n).bit_length() - 1
+        #Index of the lowest zero bit of n - 1.
+        current = current ^ directions[:, c]
+        points[n] = current
+    if seed is not None:
+        shift = np.random.default_rng(seed).integers(0, 1 << bits, size=2, dtype=np.uint64)
+        points = points ^ shift
+    return(points.astype(float) / float(1 << bits))
+
+
+def sobol(number, seed=None):
+    """Randomly shifted Sobol points scaled to the sampled ranges. Best balanced when number is a power of 2."""
+    unit = sobol_points(number, seed)
+    return(_scale(unit[:, 0], EARTH_RANGE), _scale(unit[:, 1], ICE_RANGE), np.ones(number))
+
+
+def _radical_inverse(indices, base):
+    result = np.zeros(indices.shape)
+    fraction = 1.0 / base
+    indices = indices.copy()
+    while np.any(indices > 0):
+        result += (indices % base) * fraction
+        indices //= base
+        fraction /= base
+    return(result)
+
+
+def halton(number, seed=None):
+    """Halton points in bases 2 and 3 (skipping the origin), scaled to the sampled ranges.
+    If seed is given, each coordinate receives a random shift modulo 1."""
+    indices = np.arange(1, number + 1)
+    unit = np.column_stack([_radical_inverse(indices, 2), _radical_inverse(indices, 3)])
+    if seed is not None:
+        unit = (unit + np.random.default_rng(seed).random(2)) % 1
+    return(_scale(unit[:, 0], EARTH_RANGE), _scale(unit[:, 1], ICE_RANGE), np.ones(number))
+
+
+def latin_hypercube(number, seed=None):
+    """Latin hypercube sample: each parameter range is split into number strata and each stratum is drawn once."""
+    rng = np.random.default_rng(seed)
+    unit = np.column_stack([(rng.permutation(number) + rng.random(number)) / number for _ in range(2)])
+    return(_scale(unit[:, 0], EARTH_RANGE), _scale(unit[:, 1], ICE_RANGE), np.ones(number))
+
+
+def boundary_from_grid(filename=BOUNDARY_GRID, threshold=None):
+    """
+    Estimates the diamond boundary from a max pressure grid such as the one written by contour_plot_maker.ipynb.
+
+    Parameters:
+    filename (str, optional): csv with columns ice_thickness_fraction, planet_radius_Earth_units, max_pressure_GPa.
+    threshold (float, optional): Max ice pressure defining the boundary (GPa). Defaults to the threshold of
+                                 criteria.DIAMOND (10 GPa).
+
+    Returns:
+    function: Maps an array of ice fractions to the estimated boundary radius (Earth radii), interpolated
+              linearly between the grid's crossings of the threshold; nan where the grid has no crossing.
+    """
+    threshold = criteria.DIAMOND.threshold / 1e9 if threshold is None else threshold
+    with open(filename, "r") as f:
+        reader = csv.reader(f)
+        next(reader)
+        grid = np.array([[float(value) for value in row] for row in reader])
+
+    ice_values = []
+    crossings = []
+    for ice in np.unique(grid[:, 0]):
+        rows = grid[grid[:, 0] == ice]
+        rows = rows[np.argsort(rows[:, 1])]
+        above = np.nonzero(rows[:, 2] >= threshold)[0]
+        if above.size == 0 or above[0] == 0:
+            continue
+        (r0, p0), (r1, p1) = rows[above[0] - 1, 1:], rows[above[0], 1:]
+        ice_values.append(ice)
+        crossings.append(r0 + (threshold - p0) * (r1 - r0) / (p1 - p0))
+
+    def boundary(rand_ice):
+        return(np.interp(rand_ice, ice_values, crossings, left=np.nan, right=np.nan))
+    return(boundary)
+
+
+def importance(number, seed=None, boundary=None, half_width=0.1, band_fraction=0.8):
+    """
+    Importance sampling concentrated near the diamond boundary.
+
+    Each planet is drawn either uniformly (probability 1 - band_fraction) or from the band: rand_ice uniform and
+    rand_earth uniform within half_width of the boundary radius for that ice fraction, clipped to the sampled
+    range (the whole range where the boundary is unknown or lies outside it). The proposal density q is the
+    matching mixture, and the weight p / q of each planet (p being the uniform density) makes weighted averages
+    unbiased for the uniform population.
+
+    Parameters:
+    number (int): Number of planets.
+    seed (int, optional): Seed for reproducible draws.
+    boundary (function, optional): Maps ice fractions to boundary radii (Earth radii), nan where unknown.
+                                   Defaults to boundary_from_grid().
+    half_width (float, optional): Half-width of the band in Earth radii. Defaults to 0.1.
+    band_fraction (float, optional): Probability of drawing from the band. Defaults to 0.8.
+
+    Returns:
+    tuple: (rand_earth, rand_ice, weights) arrays.
+    """
+    rng = np.random.default_rng(seed)
+    boundary = boundary or boundary_from_grid()
+    earth_low, earth_high = EARTH_RANGE
+
+    rand_ice = _scale(rng.random(number), ICE_RANGE)
+    centre = boundary(rand_ice)
+    band_low = np.clip(centre - half_width, earth_low, earth_high)
+    band_high = np.clip(centre + half_width, earth_low, earth_high)
+    #Where the boundary is unknown, or more than half_width outside the sampled range, the band is empty and the
+    #uniform density is used instead.
+    no_band = np.isnan(centre) | ~(band_high > band_low)
+    band_low = np.where(no_band, earth_low, band_low)
+    band_high = np.where(no_band, earth_high, band_high)
+
+    in_band = rng.random(number) < band_fraction
+    rand_earth = np.where(in_band, band_low + (band_high - band_low) * rng.random(number),
+                          _scale(rng.random(number), EARTH_RANGE))
+
+    #Both components draw rand_ice uniformly, so the weight only depends on the densities in rand_earth.
+    uniform_density = 1 / (earth_high - earth_low)
+    band_density = np.where((rand_earth >= band_low) & (rand_earth <= band_high), 1 / (band_high - band_low), 0)
+    weights = uniform_density / ((1 - band_fraction) * uniform_density + band_fraction * band_density)
+    return(rand_earth, rand_ice, weights)
+
+
+SAMPLERS = {'uniform': uniform, 'sobol': sobol, 'halton': halton, 'lhs': latin_hypercube, 'importance': importance}
+
+
+def draw(name, number, seed=None, **options):
+    """
+    Draws number planets with the named sampler.
+
+    Parameters:
+    name (str): One of the keys of SAMPLERS.
+    number (int): Number of planets.
+    seed (int, optional): Seed for reproducible draws.
+    **options: Extra keyword arguments for the sampler (eg: half_width for 'importance').
+
+    Returns:
+    tuple: (rand_earth, rand_ice, weights) arrays.
+    """
+    if name not in SAMPLERS:
+        raise ValueError(f"Unknown sampler '{name}'; choose from {list(SAMPLERS)}.")
+    return(SAMPLERS[name](number, seed=seed, **options))
+
+
+def boundary_control(rand_earth, rand_ice, boundary=None, resolution=400):
+    """
+    Predicts candidacy from the estimated boundary, for use as a control variate in weighted_fraction().
+
+    Planets larger than the boundary radius for their ice fraction are predicted to be candidates (where the
+    boundary is unknown, planets above 1 Earth radius are). Subtracting this prediction leaves only the
+    planets it misclassifies, which lie near the boundary where the importance sampler concentrates its draws.
+
+    Parameters:
+    rand_earth (array): Sampled planet radii (Earth radii).
+    rand_ice (array): Sampled ice fractions.
+    boundary (function, optional): Maps ice fractions to boundary radii. Defaults to boundary_from_grid().
+    resolution (int, optional): Grid resolution used to integrate the prediction over the sampled ranges.
+
+    Returns:
+    tuple: (predictions for each planet, population mean of the prediction under uniform sampling).
+    """
+    boundary = boundary or boundary_from_grid()
+
+    def predict(earth, ice):
+        centre = boundary(ice)
+        return((earth >= np.where(np.isnan(centre), 1.0, centre)).astype(float))
+
+    cells = (np.arange(resolution) + 0.5) / resolution
+    grid_earth, grid_ice = np.meshgrid(_scale(cells, EARTH_RANGE), _scale(cells, ICE_RANGE))
+    return(predict(np.asarray(rand_earth), np.asarray(rand_ice)), float(np.mean(predict(grid_earth, grid_ice))))
+
+
+def weighted_fraction(indicators, weights, control=None, control_mean=0.0):
+    """
+    Estimates a population fraction (eg: of diamond candidates) from weighted samples.
+
+    Parameters:
+    indicators (array): 1 where a planet has the property, 0 otherwise.
+    weights (array): Sample weights returned by draw().
+    control (array, optional): A prediction of the indicators with known population mean, eg: from
+                               boundary_control(). Only the weighted residuals are then averaged, which greatly
+                               reduces the error of importance-sampled estimates.
+    control_mean (float, optional): Population mean of control. Defaults to 0.
+
+    Returns:
+    tuple: (estimate, standard error). For unit weights and no control this is the plain fraction and its
+           binomial error. The error assumes independent draws, so it is conservative for 'sobol', 'halton'
+           and 'lhs' samples.
+    """
+    indicators = np.asarray(indicators, dtype=float)
+    if control is not None:
+        indicators = indicators - np.asarray(control, dtype=float)
+    values = np.asarray(weights, dtype=float) * indicators
+    if values.size < 2:
+        return(float(control_mean + np.mean(values)) if values.size else np.nan, np.nan)
+    return(float(control_mean + np.mean(values)), float(np.std(values, ddof=1) / np.sqrt(values.size)))
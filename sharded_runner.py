@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Sharded Runner
+
+Command line entry point that splits a Monte Carlo run or a max pressure grid sweep across independent jobs
+(eg: the tasks of a batch job array), then merges their outputs. No coordination is needed between shards:
+each one rebuilds the full, seeded sample set (or grid) from the run spec and solves only the planets whose
+sample index i satisfies i % shard_count == shard_index. Striding rather than blocking spreads small and
+large (slow) planets evenly over the shards.
+
+A run spec is a json file, eg:
+    {"kind": "monte_carlo", "name": "diamond_results_5000", "number": 5000, "sampler": "sobol", "seed": 1}
+    {"kind": "grid", "name": "max_pressure_data", "up_to_rad": 1.1}
+
+Monte Carlo specs may also give "sampler_options" (passed to samplers.draw). The seed defaults to 0 and must be an
+integer (not null), so that every shard draws the same planets.
+
+Each shard writes <out_dir>/<name>.<spec hash>.shard-<index>-of-<count>.csv, with the sample index as its first
+column. The spec hash (spec_hash()) covers every field of the spec, so shards of an edited spec (another seed,
+sampler or range under the same name) never reuse or merge with the files of the old one. Shard files are
+written under a temporary name and renamed when complete, so a shard whose file exists is finished; rerunning
+it is a no-op unless --force is given. Planets whose solve does not converge are skipped and listed in
+<name>.<spec hash>.shard-<index>-of-<count>.failures.csv instead (see divergence.py). The merge step checks
+that every sample is either present or listed as failed and writes, in sample order:
+- <name>.csv: the same csv as monte_carlo_run() or contour_plot.plot_max_p_vs_ratio()
+- <name>.npz: the same columns as numpy arrays
+- <name>_bins_<layout>.npz: for Monte Carlo runs, the binned_stats histograms of every shard, merged
+- <name>.png: the binned mass-radius plots or the max pressure colormap (unless --no-plot)
+- <name>_failures.csv: the skipped planets, if there were any
+
+Usage:
+    python sharded_runner.py run spec.json --shard-index $SLURM_ARRAY_TASK_ID --shard-count 64 --out-dir shards
+    python sharded_runner.py merge spec.json --shard-count 64 --out-dir shards
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import binned_stats
+import contour_plot
+import divergence
+import monte_carlo
+import samplers
+
+
+def load_spec(filename):
+    """
+    Reads and checks a run spec.
+
+    Returns:
+    dict: The spec, with defaults filled in.
+    """
+    with open(filename, 'r') as f:
+        spec = json.load(f)
+
+    if spec.get('kind') not in ('monte_carlo', 'grid'):
+        raise ValueError("Run spec 'kind' must be 'monte_carlo' or 'grid'.")
+    if spec['kind'] == 'monte_carlo':
+        if 'number' not in spec:
+            raise ValueError("Monte Carlo run specs need a 'number' of planets.")
+        spec.setdefault('name', f"diamond_results_{spec['number']}")
+        spec.setdefault('sampler', 'uniform')
+        spec.setdefault('seed', 0)
+        if not isinstance(spec['seed'], int) or isinstance(spec['seed'], bool):
+            raise ValueError("Monte Carlo run spec 'seed' must be an integer, so that every shard draws the same "
+                             "planets.")
+        spec.setdefault('sampler_options', {})
+    else:
+        if 'up_to_rad' not in spec:
+            raise ValueError("Grid run specs need an 'up_to_rad' planet radius.")
+        spec.setdefault('name', 'max_pressure_data')
+    return(spec)
+
+
+def _weighted(spec):
+    return(spec['kind'] == 'monte_carlo' and spec['sampler'] == 'importance')
+
+
+def header(spec):
+    """Returns the columns of the merged csv for a run spec (shard files add a leading sample_index)."""
+    if spec['kind'] == 'grid':
+        return(list(contour_plot.GRID_HEADER))
+    return(monte_carlo.CSV_HEADER + (["sample_weight"] if _weighted(spec) else []))
+
+
+def samples(spec):
+    """
+    Returns the full, ordered sample set of a run spec as a list of parameter tuples:
+    (rand_earth, rand_ice, weight) for Monte Carlo runs and (ice_thickness, earth_radius) for grids.
+    """
+    if spec['kind'] == 'grid':
+        ice_thicknesses, earth_radii = contour_plot.grid_axes(spec['up_to_rad'])
+        return([(ice, rad) for ice in ice_thicknesses for rad in earth_radii])
+    rand_earths, rand_ices, weights = samplers.draw(spec['sampler'], spec['number'], seed=spec['seed'],
+                                                    **spec['sampler_options'])
+    return(list(zip(rand_earths, rand_ices, weights)))
+
+
+def shard_indices(total, shard_index, shard_count):
+    """Returns the sample indices solved by one shard."""
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Shard index must be in [0, {shard_count}), got {shard_index}.")
+    return(range(shard_index, total, shard_count))
+
+
+def spec_hash(spec):
+    """Returns a short hash of every field of a run spec (with its defaults filled in)."""
+    return(hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:12])
+
+
+def shard_filename(spec, out_dir, shard_index, shard_count):
+    return(os.path.join(out_dir, f"{spec['name']}.{spec_hash(spec)}.shard-{shard_index:04d}-of-{shard_count:04d}.csv"))
+
+
+def failure_filename(spec, out_dir, shard_index, shard_count):
+    return(shard_filename(spec, out_dir, shard_index, shard_count).replace('.csv', '.failures.csv'))
+
+
+def failure_parameters(spec):
+    """Returns the names of the planet parameters recorded for each failed sample."""
+    return(contour_plot.FAILURE_PARAMETERS if spec['kind'] == 'grid' else monte_carlo.FAILURE_PARAMETERS)
+
+
+def evaluate(spec, sample):
+    """
+    Solves one sample and returns its row of the merged csv.
+
+    Raises:
+    divergence.SolverDiverged: If the planet's densities do not converge.
+    """
+    if spec['kind'] == 'grid':
+        ice_thick, earth_rad = sample
+        return([ice_thick, earth_rad, contour_plot.max_ice_pressure(earth_rad, ice_thick) / 1e9])
+    rand_earth, rand_ice, weight = sample
+    row = monte_carlo.evaluate_planet(float(rand_earth), float(rand_ice))
+    return(row + ([float(weight)] if _weighted(spec) else []))
+
+
+def run_shard(spec, shard_index, shard_count, out_dir='.', force=False):
+    """
+    Solves one shard of a run spec and writes its shard file.
+
+    Parameters:
+    spec (dict): A run spec from load_spec().
+    shard_index (int): Index of this shard, in [0, shard_count).
+    shard_count (int): Total number of shards.
+    out_dir (str, optional): Directory for shard files. Defaults to the working directory.
+    force (bool, optional): Recompute the shard even if its file already exists. Defaults to False.
+
+    Returns:
+    str: The name of the shard file.
+    """
+    filename = shard_filename(spec, out_dir, shard_index, shard_count)
+    if os.path.exists(filename) and not force:
+        print(f"Shard {shard_index} of {shard_count} already done: '{filename}'")
+        return(filename)
+
+    all_samples = samples(spec)
+    indices = shard_indices(len(all_samples), shard_index, shard_count)
+
+    os.makedirs(out_dir, exist_ok=True)
+    failed = failure_filename(spec, out_dir, shard_index, shard_count)
+    if os.path.exists(failed):
+        os.remove(failed)
+    #A failure list left by an earlier attempt would otherwise outlive a rerun in which every planet converges.
+
+    partial = filename + '.partial'
+    bins = binned_stats.new_bins()
+    with open(partial, 'w', newline='') as f, divergence.FailureLog(failed, failure_parameters(spec)) as failures:
+        writer = csv.writer(f)
+        writer.writerow(['sample_index'] + header(spec))
+        for count, i in enumerate(indices):
+            try:
+                row = evaluate(spec, all_samples[i])
+            except divergence.SolverDiverged as error:
+                failures.log(i, [float(value) for value in all_samples[i][:2]], error.failure)
+            else:
+                writer.writerow([i] + row)
+                if spec['kind'] == 'monte_carlo':
+                    for layout_bins in bins.values():
+                        layout_bins.update_row(row, float(all_samples[i][2]))
+            print(f"{count + 1}/{len(indices)}")
+    if spec['kind'] == 'monte_carlo':
+        binned_stats.save_bins(bins, filename)
+    os.replace(partial, filename)
+    return(filename)
+
+
+def merge(spec, shard_count, out_dir='.', plot=True):
+    """
+    Combines the shard files of a run spec into the final csv, npz and figure.
+
+    Parameters:
+    spec (dict): A run spec from load_spec().
+    shard_count (int): Number of shards the run was split into.
+    out_dir (str, optional): Directory holding the shard files, where the merged outputs are written.
+    plot (bool, optional): Also save the figure. Defaults to True.
+
+    Returns:
+    str: The name of the merged csv.
+    """
+    columns = header(spec)
+    rows = {}
+    failures = {}
+    missing = []
+    for shard_index in range(shard_count):
+        filename = shard_filename(spec, out_dir, shard_index, shard_count)
+        if not os.path.exists(filename):
+            missing.append(shard_index)
+            continue
+        with open(filename, 'r', newline='') as f:
+            reader = csv.reader(f)
+            if next(reader) != ['sample_index'] + columns:
+                raise ValueError(f"'{filename}' does not match the run spec.")
+            for row in reader:
+                rows[int(row[0])] = row[1:]
+        for row in divergence.read_failures(failure_filename(spec, out_dir, shard_index, shard_count)):
+            failures[int(row[0])] = row
+    if missing:
+        raise FileNotFoundError(f"Missing shards {missing} of {shard_count} for spec {spec_hash(spec)} in '{out_dir}'; "
+                                f"shards run with another version of the spec are not merged.")
+
+    total = len(samples(spec))
+    if sorted([*rows, *failures]) != list(range(total)):
+        raise ValueError(f"Shards hold {len(rows)} of {total} samples and {len(failures)} failures; were they run "
+                         f"with a different spec or shard count?")
+
+    merged = os.path.join(out_dir, f"{spec['name']}.csv")
+    solved = [i for i in range(total) if i in rows]
+    with open(merged, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for i in solved:
+            writer.writerow(rows[i])
+
+    if failures:
+        with open(merged.replace('.csv', '_failures.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(divergence.FAILURE_HEADER + failure_parameters(spec))
+            for i in sorted(failures):
+                writer.writerow(failures[i])
+        print(f"Skipped {len(failures)} of {total} planets, see '{merged.replace('.csv', '_failures.csv')}'")
+
+    table = [rows[i] for i in solved]
+    arrays = {}
+    for k, column in enumerate(columns):
+        values = [row[k] for row in table]
+        try:
+            arrays[column] = np.array(values, dtype=float)
+        except ValueError:
+            arrays[column] = np.array(values)
+    np.savez(merged.replace('.csv', '.npz'), **arrays)
+
+    if spec['kind'] == 'monte_carlo':
+        for layout in binned_stats.LAYOUTS:
+            shard_bins = [binned_stats.bins_filename(shard_filename(spec, out_dir, shard_index, shard_count), layout)
+                          for shard_index in range(shard_count)]
+            merged_bins = binned_stats.bins_filename(merged, layout)
+            if all(os.path.exists(name) for name in shard_bins):
+                bins = binned_stats.BinnedStats.load(shard_bins[0])
+                for name in shard_bins[1:]:
+                    bins.merge(binned_stats.BinnedStats.load(name))
+                bins.save(merged_bins)
+            elif os.path.exists(merged_bins):
+                os.remove(merged_bins)
+            #Without the bins of every shard, plot_results() bins the merged csv instead.
+
+    if plot:
+        if spec['kind'] == 'grid':
+            contour_plot.plot_from_csv(merged, merged.replace('.csv', '.png'))
+        else:
+            monte_carlo.plot_results(merged)
+    return(merged)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a Monte Carlo or grid sweep in independent shards, then merge them.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="Solve one shard.")
+    run_parser.add_argument('spec', help="Run spec json file.")
+    run_parser.add_argument('--shard-index', type=int, required=True)
+    run_parser.add_argument('--shard-count', type=int, required=True)
+    run_parser.add_argument('--out-dir', default='.')
+    run_parser.add_argument('--force', action='store_true', help="Recompute the shard even if it is already done.")
+
+    merge_parser = commands.add_parser('merge', help="Combine the shard outputs.")
+    merge_parser.add_argument('spec', help="Run spec json file.")
+    merge_parser.add_argument('--shard-count', type=int, required=True)
+    merge_parser.add_argument('--out-dir', default='.')
+    merge_parser.add_argument('--no-plot', action='store_true', help="Skip the figure.")
+
+    args = parser.parse_args(argv)
+    spec = load_spec(args.spec)
+    if args.command == 'run':
+        print(run_shard(spec, args.shard_index, args.shard_count, args.out_dir, args.force))
+    else:
+        print(merge(spec, args.shard_count, args.out_dir, plot=not args.no_plot))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,8 @@
 
 import numpy as np
 
+import quadrature
+
 r_earth = 6.371 * (10 ** 6)
 G = 6.6743015 / (10 ** 11)
 
@@ -25,17 +27,26 @@ def make_density_function(rad, local_densities):
     return(density_function)
 
 
-def find_mass_inside(density_function, current_radius):
+def find_mass_inside(density_function, current_radius, quadrature_rule='rectangle', cutoffs=None):
     """
     Calculates the mass inside a ball of given radius using a density function.
 
     Parameters:
     density_function (dict): A dictionary mapping radii to densities.
     current_radius (float): The radius at which to calculate the enclosed mass.
+    quadrature_rule (str, optional): Integration rule, one of quadrature.METHODS. Defaults to 'rectangle'.
+    cutoffs (list, optional): Outer radius of each layer (eg: the keys of a planetary_dictionary), where the
+                              density may jump. Only used by the higher-order rules.
 
     Returns:
-    float: The mass inside the ball of radius current_radius.
+    float: The mass inside the ball of radius current_radius (up to the last radius within it).
     """
+    if quadrature_rule != 'rectangle':
+        radii = np.array(list(density_function.keys()), dtype=float)
+        mass = quadrature.enclosed_mass(radii, list(density_function.values()), quadrature_rule, cutoffs)
+        inside = np.searchsorted(radii, current_radius, side='right')
+        return(float(mass[inside - 1]) if inside else 0.0)
+
     step_size = list(density_function.keys())[1] - list(density_function.keys())[0]
     #Computes the difference between each radius in the radii list.
     mass_inside = 0
@@ -50,7 +61,7 @@ def find_mass_inside(density_function, current_radius):
     return(mass_inside)
 
 
-def adams_williamson(rad, local_densities):
+def adams_williamson(rad, local_densities, quadrature_rule='rectangle', cutoffs=None):
     """
     Returns a list of gravities and a list of pressures corresponding to each radius within a planet 
     given a list of radii and densities at each radius.
@@ -58,32 +69,34 @@ def adams_williamson(rad, local_densities):
     Parameters:
     rad (list): A list of radii at which to calculate gravity and pressure.
     local_densities (list): A list of densities corresponding to each radius in rad.
+    quadrature_rule (str, optional): Integration rule, one of quadrature.METHODS. Defaults to 'rectangle', the
+                                     loop below; the other rules are evaluated by quadrature.adams_williamson.
+    cutoffs (list, optional): Outer radius of each layer, where the density may jump. Only used by the
+                              higher-order rules.
 
     Returns:
-    dict: A dictionary mapping each radius to a list of [gravity, pressure].
+    tuple: Two arrays, the gravity (m/s^2) and the pressure (Pa) at each radius in rad.
     """
+    if quadrature_rule != 'rectangle':
+        return(quadrature.adams_williamson(rad, local_densities, quadrature_rule, cutoffs))
+
     density_function = make_density_function(rad, local_densities)
     step_size = list(density_function.keys())[1] - list(density_function.keys())[0]
-    gravities_and_pressures = {}
-    pressures = []
+    gravities = np.zeros(len(density_function))
+    pressures = np.zeros(len(density_function))
     total_pressure = 0
 
-    for r, local_density in density_function.items():
-        if r <= max(density_function.keys()):
-            integrand = (G * find_mass_inside(density_function, r) * local_density) / (r ** 2)
-            #Computes the integrand found in the Adams-Williamson equation.
-            
-            differential_pressure = integrand * step_size
-            total_pressure += differential_pressure
-            
-            #In the dictionary (i.e. gravities_and_pressures), each r corresponds to a list of [gravity, pressure]
-            gravities_and_pressures[r] = [integrand / local_density, total_pressure]
+    for i, (r, local_density) in enumerate(density_function.items()):
+        integrand = (G * find_mass_inside(density_function, r) * local_density) / (r ** 2)
+        #Computes the integrand found in the Adams-Williamson equation.
+        
+        differential_pressure = integrand * step_size
+        total_pressure += differential_pressure
+        
+        gravities[i] = integrand / local_density
+        pressures[i] = total_pressure
     
-    for r in gravities_and_pressures.keys():
-        gravities_and_pressures[r][1] -= gravities_and_pressures[max(density_function.keys())][1]
-        gravities_and_pressures[r][1] = -gravities_and_pressures[r][1]
+    pressures = total_pressure - pressures
+    #Pressure is integrated outward from the center, so the pressure at r is what remains out to the surface.
         
-    return(gravities_and_pressures)
-    #Returns a dictionary with each radius corresponding to a gravity and a pressure;
-    #r: [gravity, pressure]
-
+    return(gravities, pressures)
@@ -8,6 +8,8 @@
 
 import numpy as np
 
+from EoS_Bits import BM3Slope
+
 #computes pressure from density via bm3. Used for checking density guesses
 def bm3(rho, rho_0, B_0, B_01):
     """Calculate pressure using the 3rd-order Birch-Murnaghan equation of state.
@@ -29,7 +31,7 @@ def bm3(rho, rho_0, B_0, B_01):
 
 
 
-def invert_bm3(P_target = 999999999999, rho_0 = 1487, rho_min = 1487, rho_max = 14870, B_0 = 14.9 * (10 ** 9), B_01 = 6.2, allowed_discrepancy = (0.05 * (10 ** 5))):
+def invert_bm3(P_target = 999999999999, rho_0 = 1487, rho_min = 1487, rho_max = 14870, B_0 = 14.9 * (10 ** 9), B_01 = 6.2, allowed_discrepancy = (0.05 * (10 ** 5)), policy = None, calls = 0):
     """Find the density that corresponds to a target pressure using the Birch-Murnaghan equation of state.
 
     This function uses a binary search algorithm to iteratively refine the density guess until the 
@@ -43,12 +45,22 @@ def invert_bm3(P_target = 999999999999, rho_0 = 1487, rho_min = 1487, rho_max =
     B_0 (float): Bulk modulus at zero pressure (Pa).
     B_01 (float): Pressure derivative of the bulk modulus (dimensionless).
     allowed_discrepancy (float): The acceptable difference between the target and calculated pressure (Pa).
+    policy (TolerancePolicy, optional): Replaces allowed_discrepancy with the policy's relative density tolerance
+                                        and caps the bisection steps; a capped search returns its last guess and
+                                        is counted in policy.exceeded. Defaults to None.
+    calls (int, optional): Recursion counter for the step cap. Defaults to 0.
 
     Returns:
     float: The density that produces the target pressure within the allowed discrepancy (kg/m^3).
     """
     rho_guess = (rho_min + rho_max) / 2
     P_guess = bm3(rho_guess, rho_0, B_0, B_01)
+    if policy is not None:
+        allowed_discrepancy = policy.pressure_tolerance(rho_guess, BM3Slope(rho_guess, rho_0, B_0, B_01))
+        if calls >= policy.max_inversion_steps and abs(P_guess - P_target) >= allowed_discrepancy:
+            policy.exceed('inversion')
+            return(rho_guess)
+    #With a policy, the tolerance is relative to the density and the number of steps is capped.
 
 #    print('rho guess: ', rho_guess)
 #    print('guess: ', P_guess)
@@ -59,10 +71,10 @@ def invert_bm3(P_target = 999999999999, rho_0 = 1487, rho_min = 1487, rho_max =
         return(rho_guess)
 
     elif P_guess > P_target:
-        return(invert_bm3(P_target, rho_0, rho_min, rho_guess, B_0, B_01, allowed_discrepancy))
+        return(invert_bm3(P_target, rho_0, rho_min, rho_guess, B_0, B_01, allowed_discrepancy, policy, calls + 1))
 
     elif P_guess < P_target:
-        return(invert_bm3(P_target, rho_0, rho_guess, rho_max, B_0, B_01, allowed_discrepancy))
+        return(invert_bm3(P_target, rho_0, rho_guess, rho_max, B_0, B_01, allowed_discrepancy, policy, calls + 1))
 
 #example list of target pressures
 example_target_pressures = [100000000000, 500000000000, 900000000000]
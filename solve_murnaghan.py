@@ -27,36 +27,23 @@ def murnaghan(rho, rho_0, B_0, B_01):
 
 #takes a target pressure and returns the density associated with it via murnaghan
 def invert_murnaghan(P_target, rho_0, rho_min, rho_max, B_0, B_01, allowed_discrepancy = (0.05 * (10 ** 9))):
-    """Iteratively calculates density corresponding to a target pressure using the Murnaghan equation.
+    """Calculates density corresponding to a target pressure using the exact inverse of the Murnaghan equation,
+    rho = rho_0 * (1 + B_01 * P / B_0) ** (1 / B_01).
     
     Parameters:
     P_target (float): The target pressure (Pa).
     rho_0 (float): Initial (zero-pressure) density (kg/m^3).
-    rho_min (float): Minimum density guess (kg/m^3).
-    rho_max (float): Maximum density guess (kg/m^3).
+    rho_min (float): Minimum density guess (kg/m^3). Kept for compatibility with the former bisection; unused.
+    rho_max (float): Maximum density guess (kg/m^3). Kept for compatibility with the former bisection; unused.
     B_0 (float): Bulk modulus at zero pressure (Pa).
     B_01 (float): Pressure derivative of the bulk modulus.
-    allowed_discrepancy (float): Maximum allowed difference between the calculated and target pressure (Pa).
+    allowed_discrepancy (float): Formerly the bisection tolerance (Pa); the inverse is exact, so it is unused.
     
     Returns:
     float: The calculated density corresponding to the target pressure.
     """
-    rho_guess = (rho_min + rho_max) / 2
-    P_guess = murnaghan(rho_guess, rho_0, B_0, B_01)
-
-#    print('rho guess: ', rho_guess)
-#    print('guess: ', P_guess)
-#    print('target: ', P_target, '\n')
-    
-    if abs(P_guess - P_target) < allowed_discrepancy:
-#        print(f"rho_guess: {rho_guess} in kg/m^3,\nP_guess: {np.format_float_scientific(P_guess, precision = 9)},\nP_target: {np.format_float_scientific(P_target, precision = 9)} in Pa\n")
-        return(rho_guess)
-
-    elif P_guess > P_target:
-        return(invert_murnaghan(P_target, rho_0, rho_min, rho_guess, B_0, B_01, allowed_discrepancy))
-
-    elif P_guess < P_target:
-        return(invert_murnaghan(P_target, rho_0, rho_guess, rho_max, B_0, B_01, allowed_discrepancy))
+    rho = rho_0 * (1 + B_01 * P_target / B_0) ** (1 / B_01)
+    return(rho)
 
 
 #example list of target pressures
@@ -11,6 +11,8 @@
 
 import numpy as np
 
+from EoS_Bits import VinetSlope
+
 #computes pressure from density via Vinet. Used for checking density guesses
 def vinet(rho, rho_0, B_0, B_01):
     """Calculate pressure using the Vinet equation of state.
@@ -29,7 +31,7 @@ def vinet(rho, rho_0, B_0, B_01):
     return(pressure)
 
 #takes a target pressure and returns the density associated with it via Vinet
-def invert_vinet(P_target, rho_0, rho_min, rho_max, B_0, B_01, allowed_discrepancy = (0.05 * (10 ** 9))):
+def invert_vinet(P_target, rho_0, rho_min, rho_max, B_0, B_01, allowed_discrepancy = (0.05 * (10 ** 9)), policy = None, calls = 0):
     """Iteratively calculates density corresponding to a target pressure using the Vinet equation.
     
     Parameters:
@@ -40,12 +42,22 @@ def invert_vinet(P_target, rho_0, rho_min, rho_max, B_0, B_01, allowed_discrepan
     B_0 (float): Bulk modulus at zero pressure (Pa).
     B_01 (float): Pressure derivative of the bulk modulus.
     allowed_discrepancy (float): Maximum allowed difference between the calculated and target pressure (Pa).
+    policy (TolerancePolicy, optional): Replaces allowed_discrepancy with the policy's relative density tolerance
+                                        and caps the bisection steps; a capped search returns its last guess and
+                                        is counted in policy.exceeded. Defaults to None.
+    calls (int, optional): Recursion counter for the step cap. Defaults to 0.
     
     Returns:
     float: The calculated density corresponding to the target pressure.
     """
     rho_guess = (rho_min + rho_max) / 2
     P_guess = vinet(rho_guess, rho_0, B_0, B_01)
+    if policy is not None:
+        allowed_discrepancy = policy.pressure_tolerance(rho_guess, VinetSlope(rho_guess, rho_0, B_0, B_01))
+        if calls >= policy.max_inversion_steps and abs(P_guess - P_target) >= allowed_discrepancy:
+            policy.exceed('inversion')
+            return(rho_guess)
+    #With a policy, the tolerance is relative to the density and the number of steps is capped.
 
 #    print('rho guess: ', rho_guess)
 #    print('guess: ', P_guess)
@@ -56,10 +68,10 @@ def invert_vinet(P_target, rho_0, rho_min, rho_max, B_0, B_01, allowed_discrepan
         return(rho_guess)
 
     elif P_guess > P_target:
-        return(invert_vinet(P_target, rho_0, rho_min, rho_guess, B_0, B_01, allowed_discrepancy))
+        return(invert_vinet(P_target, rho_0, rho_min, rho_guess, B_0, B_01, allowed_discrepancy, policy, calls + 1))
 
     elif P_guess < P_target:
-        return(invert_vinet(P_target, rho_0, rho_guess, rho_max, B_0, B_01, allowed_discrepancy))
+        return(invert_vinet(P_target, rho_0, rho_guess, rho_max, B_0, B_01, allowed_discrepancy, policy, calls + 1))
 
 
 #example list of target pressures
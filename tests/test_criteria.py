@@ -0,0 +1,11 @@
+import pytest
+
+import criteria
+
+
+def test_criterion_without_metrics_cannot_be_instantiated():
+    class Incomplete(criteria.Criterion):
+        name = 'incomplete'
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,21 @@
+import divergence
+
+
+def _verdicts(residuals):
+    monitor = divergence.ResidualMonitor()
+    return([monitor.record(residual, 1.0) for residual in residuals])
+
+
+def test_slow_geometric_convergence_is_never_flagged():
+    residuals = [1e3 * 0.985 ** k for k in range(2000)]
+    assert all(verdict is None for verdict in _verdicts(residuals))
+
+
+def test_flat_residuals_are_stagnating():
+    verdicts = _verdicts([5.0] * (divergence.WINDOW + 1))
+    assert verdicts[-1] == 'stagnating'
+    assert all(verdict is None for verdict in verdicts[:-1])
+
+
+def test_growing_residuals_are_diverging():
+    assert _verdicts([1.0, 2.0, 4.0, 8.0])[-1] == 'diverging'
@@ -0,0 +1,37 @@
+import pytest
+
+import divergence
+import eos_kernels as ek
+import planetary_dictionary as dct
+
+pytest.importorskip('numba')
+
+FLAG_AT = 7
+#1.4 Earth radii with 0.1 iron and 0.1 silicate converges at iteration 8, one iteration into the second chunk.
+
+
+def _solve(backend):
+    radius = 1.4 * 6370 * (10 ** 3)
+    radii_list = [*range(1, int(radius), int(radius / 1000))]
+    return(ek.solve_planet(radii_list, dct.planetary_dictionary(1.4, 0.1, 0.1), backend=backend))
+
+
+@pytest.mark.parametrize('flag', ['invalid', 'stagnating'])
+def test_backends_agree_on_a_flag_raised_before_convergence_in_a_chunk(monkeypatch, flag):
+    verdict = divergence.ResidualMonitor.verdict
+
+    def flag_once(monitor):
+        if len(monitor.residuals) == FLAG_AT:
+            return(flag)
+        return(verdict(monitor))
+
+    monkeypatch.setattr(divergence.ResidualMonitor, 'verdict', flag_once)
+    numpy_profile, numba_profile = _solve('numpy'), _solve('numba')
+    assert numba_profile.converged == numpy_profile.converged
+    assert numba_profile.iterations == numpy_profile.iterations
+    if flag == 'invalid':
+        assert not numba_profile.converged
+        assert numba_profile.failure.reason == numpy_profile.failure.reason == 'invalid'
+        assert numba_profile.failure.iterations == numpy_profile.failure.iterations == FLAG_AT
+    else:
+        assert numba_profile.density == pytest.approx(numpy_profile.density, rel=1e-10)
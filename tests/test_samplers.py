@@ -0,0 +1,22 @@
+import warnings
+
+import numpy as np
+
+import samplers
+
+
+def test_importance_boundary_outside_range_falls_back_to_uniform():
+    #A boundary more than half_width beyond the sampled radii leaves an empty band.
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        rand_earth, rand_ice, weights = samplers.importance(2000, seed=0, boundary=lambda ice: np.full_like(ice, 3.0))
+    assert np.all(weights == 1)
+    assert np.unique(rand_earth).size == rand_earth.size
+    assert rand_earth.min() >= samplers.EARTH_RANGE[0] and rand_earth.max() <= samplers.EARTH_RANGE[1]
+
+
+def test_importance_mixed_boundary_weights_stay_finite():
+    boundary = lambda ice: np.where(ice < 0.5, 1.0, -2.0)
+    rand_earth, rand_ice, weights = samplers.importance(2000, seed=1, boundary=boundary)
+    assert np.all(np.isfinite(weights)) and np.all(weights > 0)
+    assert np.all(weights[rand_ice >= 0.5] == 1)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Tolerance Policy
+
+One set of relative tolerances and iteration caps for the nested solves of the pipeline, in place of the
+unrelated absolute thresholds they use by default (DensityFromP: 0.01 Pa, invert_vinet: 5e7 Pa,
+invert_bm3: 5e3 Pa, Solver: 10 kg/m^3).
+
+The outer target is rtol, the relative change in density between two solver iterations below which a planet
+is converged. Every inner solve is only asked for what the outer loop can use:
+- an EoS inversion stops once its density is within inner_factor * rtol (relative) of the root. Its pressure
+  residual is converted to a density error through the local slope, |P - P(rho)| < tol * rho * dP/drho, so
+  the same tolerance holds at 1 GPa and at 1 TPa, where 0.01 Pa is below double-precision resolution.
+- the solver stops once every checked shell changes by less than rtol times its density.
+
+Each solve is capped (max_iterations for the solver, max_inversion_steps for an inversion). A capped solve
+returns its best estimate and is counted in exceeded, so a batch run can report how often the budget was not
+met. A planet whose converged iteration relied on a capped inversion is given up on with the divergence
+failure reason 'inversion_cap'.
+
+Usage:
+    import tolerance
+    policy = tolerance.TolerancePolicy(rtol=1e-4)
+    profile = Solver(radii_list, insert_dict, policy=policy)
+    profile = eos_kernels.solve_planet(radii_list, insert_dict, policy=policy)
+    print(policy.report())
+"""
+
+import numpy as np
+
+STAGES = ('solver', 'inversion')
+#Solves whose cap exceedances are counted.
+
+
+class TolerancePolicy:
+    """
+    Relative tolerances and iteration caps shared by the solver and the EoS inversions.
+
+    Parameters:
+    rtol (float, optional): Relative density change at which the solver is converged. Defaults to 1e-3
+                            (10 kg/m^3 in the core, about 1 kg/m^3 in the ice).
+    inner_factor (float, optional): Fraction of rtol allowed as the relative density error of each inversion.
+                                    Defaults to 0.1.
+    max_iterations (int, optional): Solver iteration cap. Defaults to 2000, as in Solver.
+    max_inversion_steps (int, optional): Iteration cap of each inversion. Defaults to 100.
+
+    Attributes:
+    exceeded (dict): Number of solves that reached their cap, keyed by stage ('solver' or 'inversion').
+    """
+
+    __slots__ = ('rtol', 'inner_factor', 'max_iterations', 'max_inversion_steps', 'exceeded')
+
+    def __init__(self, rtol=1e-3, inner_factor=0.1, max_iterations=2000, max_inversion_steps=100):
+        if not 0 < rtol < 1 or not 0 < inner_factor <= 1:
+            raise ValueError("rtol must lie in (0, 1) and inner_factor in (0, 1].")
+        self.rtol = float(rtol)
+        self.inner_factor = float(inner_factor)
+        self.max_iterations = int(max_iterations)
+        self.max_inversion_steps = int(max_inversion_steps)
+        self.exceeded = dict.fromkeys(STAGES, 0)
+
+    def __repr__(self):
+        return(f"TolerancePolicy(rtol={self.rtol}, inner_factor={self.inner_factor}, "
+               f"max_iterations={self.max_iterations}, max_inversion_steps={self.max_inversion_steps})")
+
+    @property
+    def inversion_rtol(self):
+        """Relative density error allowed in each inversion, derived from the outer target."""
+        return(self.rtol * self.inner_factor)
+
+    def density_tolerance(self, densities):
+        """Largest change of each density (kg/m^3) at which the solver is converged."""
+        return(self.rtol * np.abs(densities))
+
+    def pressure_tolerance(self, rho, slope):
+        """Pressure residual (Pa) of an inversion at density rho (kg/m^3) and slope dP/drho that meets inversion_rtol."""
+        return(self.inversion_rtol * rho * np.abs(slope))
+
+    def exceed(self, stage, count=1):
+        """Records count solves of the given stage that reached their cap."""
+        self.exceeded[stage] += int(count)
+
+    def report(self):
+        """One-line summary of the caps reached so far."""
+        if not any(self.exceeded.values()):
+            return("No iteration caps reached.")
+        return("Iteration caps reached: " + ", ".join(f"{stage} {count}" for stage, count in self.exceeded.items()
+                                                      if count))